@@ -1,65 +1,294 @@
+import asyncio
 import json
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-from typing import List, Dict
-from services.agent_orchestrator import orchestrate_debate
-from services.mongo_client import load_data as load_data_mongo, generate_embeddings
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from pydantic import BaseModel, Field
+from typing import Any, List, Dict, Optional
+from services.agent_orchestrator import orchestrate_debate, orchestrate_debate_batch, stream_debate
+from services.data_loader import load_file, is_source_file, source_collection, EMBEDDING_FIELDS
+from services.embedding_pipeline import embed_collection
+from services.embedding_cache import query_embedding_cache
+from services.agent_registry import agent_registry
+from services.debate_cache import debate_cache, DEBATE_CACHE_ENABLED
+from services.debate_rounds import DEBATE_MAX_ROUNDS
+from services.metrics import StageTimings, stats_collector
+from services.vector_engine import local_vector_engine
+from services.rollups import refresh_sales_rollups, try_refresh_sales_rollups
+from services import jobs
+from services.jobs import job_workers, JOB_WORKERS
+from services import llm_caller, mongo_client
+from services.singleflight import SingleFlight
+from services.llm_resilience import llm_resilience
+from services.llm_scheduler import llm_scheduler
+from services.embedding_cache import normalize_text
 import uvicorn
 import os
-from services.mongo_client import get_field_data, insert_field_data, create_vector_index
+import time
+from services.mongo_client import create_vector_index
 
-app = FastAPI()
+READY_CHECK_TIMEOUT = float(os.getenv("READY_CHECK_TIMEOUT", "2"))
+BATCH_MAX_TOPICS = int(os.getenv("BATCH_MAX_TOPICS", "1000"))
 
-class DebateRequest(BaseModel):
-    topic: str
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open and warm both connection pools before taking traffic
+    mongo_ping, llm_warm_up = await asyncio.gather(mongo_client.connect(), llm_caller.connect())
+    if not mongo_ping["ok"]:
+        print(f"MongoDB warm-up failed: {mongo_ping['error']}")
+    if not llm_warm_up["ok"]:
+        print(f"LLM endpoint warm-up failed: {llm_warm_up['error']}")
+    try:
+        await agent_registry.start()
+    except Exception as e:
+        # Configs are loaded lazily on first use if MongoDB isn't reachable yet
+        print(f"Agent config preload failed: {str(e)}")
+    if DEBATE_CACHE_ENABLED:
+        try:
+            await debate_cache.ensure_indexes()
+        except Exception as e:
+            print(f"Debate cache index creation failed, the debate cache is off: {str(e)}")
+    try:
+        await jobs.ensure_indexes()
+    except Exception as e:
+        print(f"Job queue index creation failed: {str(e)}")
+    job_workers.start(JOB_WORKERS)
+    yield
+    await job_workers.stop()
+    await agent_registry.stop()
+    await llm_caller.close()
+    mongo_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+stats_collector.register("embedding_cache", query_embedding_cache.stats)
+stats_collector.register("debate_cache", debate_cache.stats)
+
+# Identical concurrent debates share one run
+debate_flight = SingleFlight()
+stats_collector.register("debate_singleflight", debate_flight.stats)
+stats_collector.register("embedding_singleflight", llm_caller.embedding_flight.stats)
+stats_collector.register("llm", llm_resilience.totals)
+stats_collector.register("llm_scheduler", llm_scheduler.totals)
+stats_collector.register("jobs", job_workers.stats)
+
+class VectorSearchOptions(BaseModel):
+    num_candidates: Optional[int] = Field(None, ge=1, le=10000)
+    limit: Optional[int] = Field(None, ge=1, le=100)
+
+class DebateConfig(BaseModel):
+    """Settings shared by single and batch debates."""
     agents: Dict[str, str]
     context_scope: List[str]
     aggregator_model: str
+    bypass_cache: bool = False
+    include_timings: bool = False
+    # Per-collection overrides of the vector search settings
+    vector_search: Dict[str, VectorSearchOptions] = {}
+    # Pre-filters applied to every vector-searched collection that declares
+    # them, e.g. {"date_from": "2025-03-01", "product": ["Smart Filters"]}
+    filters: Dict[str, Any] = {}
+    # Rounds of rebuttal; the debate ends sooner once the agents' stances converge
+    rounds: int = Field(1, ge=1, le=DEBATE_MAX_ROUNDS)
+    convergence_threshold: Optional[float] = Field(None, gt=0, le=1)
+
+    def search_options(self) -> dict:
+        options = {}
+        for collection in self.context_scope:
+            overrides = self.vector_search.get(collection)
+            collection_options = overrides.model_dump(exclude_none=True) if overrides else {}
+            if self.filters:
+                collection_options["filters"] = self.filters
+            if collection_options:
+                options[collection] = collection_options
+        return options
+
+class DebateRequest(DebateConfig):
+    topic: str
+    stream_tokens: bool = False
+
+    def coalescing_key(self, streaming: bool = False) -> str:
+        """Identity of the debate this request runs; equal for requests with the same result."""
+        return json.dumps({
+            "topic": normalize_text(self.topic),
+            "agents": sorted(self.agents.items()),
+            "context_scope": sorted(self.context_scope),
+            "aggregator_model": self.aggregator_model,
+            "bypass_cache": self.bypass_cache,
+            "search_options": self.search_options(),
+            "rounds": [self.rounds, self.convergence_threshold],
+            "stream_tokens": self.stream_tokens if streaming else None,
+        }, sort_keys=True, default=str)
+
+class BatchDebateRequest(DebateConfig):
+    topics: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_TOPICS)
 
 @app.post("/debate")
 async def start_debate(request: DebateRequest):
     try:
         print("Request : ", request)
-        result = await orchestrate_debate(request.topic, request.agents, request.context_scope, request.aggregator_model)
+
+        async def run():
+            timings = StageTimings()
+            with timings.stage("debate"):
+                result = await orchestrate_debate(request.topic, request.agents, request.context_scope,
+                                                  request.aggregator_model, use_cache=not request.bypass_cache,
+                                                  timings=timings, search_options=request.search_options(),
+                                                  rounds=request.rounds,
+                                                  convergence_threshold=request.convergence_threshold)
+            return result, timings
+
+        result, timings = await debate_flight.do(request.coalescing_key(), run)
+        # The result may be shared with coalesced requests, so copy before adding to it
+        result = dict(result)
+        if request.include_timings:
+            result["timings"] = timings.as_list()
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
+
+
+@app.post("/debate/stream")
+async def start_debate_stream(request: DebateRequest):
+    """Stream debate events as newline-delimited JSON."""
+    print("Stream request : ", request)
+
+    async def events():
+        timings = StageTimings()
+        start = time.perf_counter()
+        async for event in stream_debate(request.topic, request.agents, request.context_scope,
+                                         request.aggregator_model, request.stream_tokens,
+                                         use_cache=not request.bypass_cache, timings=timings,
+                                         search_options=request.search_options(), rounds=request.rounds,
+                                         convergence_threshold=request.convergence_threshold):
+            if event["event"] == "done":
+                timings.record("debate", time.perf_counter() - start)
+                event = {**event, "timings": timings.as_list()}
+            yield event
+
+    async def generate():
+        # Identical concurrent streams share one debate; every client gets all of its events
+        async for event in debate_flight.stream(request.coalescing_key(streaming=True), events):
+            if event["event"] == "done" and not request.include_timings:
+                event = {key: value for key, value in event.items() if key != "timings"}
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.post("/debates/batch")
+async def start_debate_batch(request: BatchDebateRequest):
+    """Run one debate per topic, streaming each result as newline-delimited JSON as it completes."""
+    print(f"Batch request : {len(request.topics)} topics")
+
+    async def generate():
+        timings = StageTimings()
+        start = time.perf_counter()
+        async for event in orchestrate_debate_batch(request.topics, request.agents, request.context_scope,
+                                                    request.aggregator_model, use_cache=not request.bypass_cache,
+                                                    timings=timings, search_options=request.search_options(),
+                                                    rounds=request.rounds,
+                                                    convergence_threshold=request.convergence_threshold):
+            if event["event"] == "done":
+                timings.record("batch", time.perf_counter() - start)
+                if request.include_timings:
+                    event = {**event, "timings": timings.as_list()}
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.post("/jobs/load")
+async def start_load_job():
+    """Load and embed the sample data in the background; poll GET /jobs/{job_id} for progress."""
+    try:
+        job = await jobs.create_load_job("util")
+        return {"job_id": job["_id"], "status": job["status"]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _job_or_404(job) -> dict:
+    job = await job
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return await _job_or_404(jobs.get_job(job_id))
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    return await _job_or_404(jobs.cancel_job(job_id))
+
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str):
+    return await _job_or_404(jobs.resume_job(job_id))
+
 
 @app.get("/load_data")
 async def load_data():
+    """Load and embed the sample data within the request, streaming progress.
+
+    The work stops if the connection drops; POST /jobs/load runs it in the background.
+    """
     async def generate():
+        timings = StageTimings()
         try:
-            # Loading data for each collection         
-            files = [f for f in os.listdir('util') if f.endswith('.json')]
+            # Loading data for each collection, skipping unchanged documents
+            files = [f for f in os.listdir('util') if is_source_file(f)]
             for file in files:
-                with open(os.path.join('util', file), 'r') as f:
-                    data = json.load(f)
-                    collection_name = file.split('.')[0]
-                    yield f"Loading {collection_name}...\n"
-                    load_data_mongo(collection_name, data)
-                    yield f"{collection_name} loaded successfully!\n"
-            
-            # Creating vector embeddings
+                collection_name = source_collection(file)
+                yield f"Loading {collection_name}...\n"
+                load_start = time.perf_counter()
+                first = True
+                async for progress in load_file(os.path.join('util', file), collection_name):
+                    if progress["skipped"]:
+                        yield f"{collection_name} is up to date, skipping.\n"
+                        continue
+                    if first and progress["resumed_from"]:
+                        yield f"Resuming {collection_name} from document {progress['resumed_from']}\n"
+                    first = False
+                    # The total is known once the whole file has been streamed
+                    total = f"/{progress['total']}" if "total" in progress else ""
+                    yield (f"{collection_name}: {progress['position']}{total} documents "
+                           f"({progress['inserted']} new, {progress['updated']} changed, "
+                           f"{progress['unchanged']} unchanged)\n")
+                timings.record("load", time.perf_counter() - load_start, collection=collection_name)
+                if collection_name == "agents":
+                    agent_registry.invalidate()
+                yield f"{collection_name} loaded successfully!\n"
+
+            # Run on every load, so a refresh that failed last time is retried
+            with timings.stage("rollups", collection="sales_data"):
+                refreshed = await try_refresh_sales_rollups()
+            if refreshed is None:
+                yield "Sales rollups could not be refreshed; they will be retried on the next load.\n"
+            elif refreshed["full"] or refreshed["regions"]:
+                yield "Sales rollups refreshed.\n"
+
+            # Creating vector embeddings for new or changed documents
             yield f"Generating embeddings...\n"
-            embedding_dict = {
-                "customer_feedback": "feedback",
-                "performance_logs" : "summary"
-            }
 
-            for collection, field in embedding_dict.items():
+            for collection, field in EMBEDDING_FIELDS.items():
                 # Create vector index for each collection
-                await create_vector_index(collection)
+                with timings.stage("create_index", collection=collection):
+                    await create_vector_index(collection)
                 yield f"Creating vector index for {collection}...\n"
-                collection_data = await get_field_data(collection, field)
-                # print("Collection data", collection_data)
-                for data in collection_data:
-                    text = data[field]
-                    embedding = await generate_embeddings(text)
-                    doc_id = data['_id']
-                    await insert_field_data(collection, doc_id, "embedding", embedding)
-                
+                elapsed = 0.0
+                async for progress in embed_collection(collection, field):
+                    elapsed = progress["elapsed"]
+                    yield (f"Embedded {progress['done']}/{progress['total']} {collection} documents "
+                           f"({progress['docs_per_sec']:.1f} docs/sec)\n")
+                timings.record("embed", elapsed, collection=collection)
+
                 yield f"Vector index for {collection} created successfully!\n"
             
             yield "All data loaded and embeddings created successfully!\n"
@@ -70,9 +299,85 @@ async def load_data():
     return StreamingResponse(generate(), media_type="text/plain")
 
 
+@app.post("/admin/agents/reload")
+async def reload_agents():
+    try:
+        count = await agent_registry.load()
+        return {"reloaded": count, **agent_registry.stats()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/admin/rollups/refresh")
+async def refresh_rollups(full: bool = False):
+    try:
+        return await refresh_sales_rollups(full=full)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "embedding_cache": query_embedding_cache.stats(),
+        "agent_registry": agent_registry.stats(),
+        "debate_cache": debate_cache.stats(),
+        "local_vector_engine": local_vector_engine.stats(),
+        "debate_singleflight": debate_flight.stats(),
+        "embedding_singleflight": llm_caller.embedding_flight.stats(),
+        "llm_models": llm_resilience.stats(),
+        "llm_scheduler": llm_scheduler.stats()
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+
+@app.get("/ready")
+async def readiness_check():
+    """Ready once MongoDB answers, the LLM pool is warm and the agent registry has loaded.
+
+    The registry may be empty: on a fresh deployment agents are only loaded
+    through this backend's own /jobs/load, so their count is reported but not
+    required.
+
+    Failed warm-ups are retried here, so an instance that started before its
+    dependencies were reachable becomes ready once they are.
+    """
+    async def check_mongo():
+        return (await mongo_client.ping())["ok"]
+
+    async def check_llm():
+        if not llm_caller.pool_state()["warm_up"]["ok"]:
+            await llm_caller.warm_up()
+        return llm_caller.pool_state()["warm_up"]["ok"]
+
+    async def check_agents():
+        if agent_registry.stats()["age_seconds"] is None:
+            await agent_registry.load()
+        return True
+
+    names = ["mongo", "llm", "agents"]
+    results = await asyncio.gather(
+        *[asyncio.wait_for(check(), READY_CHECK_TIMEOUT) for check in (check_mongo, check_llm, check_agents)],
+        return_exceptions=True
+    )
+    checks = {name: result is True for name, result in zip(names, results)}
+    ready = all(checks.values())
+    return JSONResponse(status_code=200 if ready else 503, content={
+        "status": "ready" if ready else "not ready",
+        "checks": checks,
+        "mongo": mongo_client.pool_state(),
+        "llm": llm_caller.pool_state(),
+        "agents": agent_registry.stats()["agents"],
+    })
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
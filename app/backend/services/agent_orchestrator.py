@@ -1,42 +1,592 @@
 import traceback
 import asyncio
-from services.mongo_client import fetch_agent_config, get_query_results, fetch_context_data
-from services.prompt_builder import build_agent_prompt
-from services.llm_caller import call_llm
-from services.summarizer import summarize_debate
-
-async def orchestrate_debate(topic: str, agents: dict, context_scope: list, aggregator_model: str) -> dict:
-        try: 
-            tasks = []
-            agent_context = {}
-            # Fetch data from MongoDB
-            for collection in context_scope:
-                if collection == "sales_data": 
-                    # Fetch data from MongoDB
-                    agent_context[collection] = await fetch_context_data(collection)
+import contextlib
+import os
+import time
+from typing import AsyncIterator, List
+from services.mongo_client import get_query_results
+from services.rollups import SALES_COLLECTION, fetch_sales_rollups
+from services.agent_registry import agent_registry
+from services.prompt_builder import (build_agent_prompt, build_rebuttal_prompt, build_context_block,
+                                     context_view, shared_context_budget)
+from services.llm_caller import call_llm, stream_llm
+from services.llm_scheduler import INTERACTIVE, SUMMARY, BULK
+from services.summarizer import summarize_debate, build_summary_prompt
+from services.embedding_cache import query_embedding_cache
+from services.debate_cache import debate_cache, debate_config_key
+from services.debate_rounds import DebateRounds
+from services.metrics import StageTimings
+
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "5"))
+CONTEXT_FETCH_TIMEOUT = float(os.getenv("CONTEXT_FETCH_TIMEOUT", "5"))
+AGENT_CONFIG_TIMEOUT = float(os.getenv("AGENT_CONFIG_TIMEOUT", "2"))
+# Collections whose context doesn't depend on the topic, fetched once per batch
+TOPIC_INDEPENDENT_COLLECTIONS = {SALES_COLLECTION}
+# LLM calls in flight across every batch debate, and topics in flight per batch
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "16"))
+BATCH_TOPIC_CONCURRENCY = int(os.getenv("BATCH_TOPIC_CONCURRENCY", "8"))
+BATCH_EMBED_SIZE = int(os.getenv("BATCH_EMBED_SIZE", "64"))
+
+batch_llm_slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+
+def default_agent_config(agent_name: str) -> dict:
+    """Fallback persona used when an agent's configuration can't be loaded."""
+    return {
+        "name": agent_name,
+        "role": "Advisor",
+        "description": "offers an independent, balanced perspective"
+    }
+
+
+def _failure_reason(error: BaseException) -> str:
+    return "timed out" if isinstance(error, asyncio.TimeoutError) else str(error)
+
+
+async def _timed(timings: StageTimings, awaitable, stage: str, collection: str = "", model: str = ""):
+    with timings.stage(stage, collection=collection, model=model):
+        return await awaitable
+
+
+async def _fetch_collection(topic: str, collection: str, embedding_task: asyncio.Task, timings: StageTimings,
+                            search_options: dict = None, fields: list = None):
+    if collection == SALES_COLLECTION:
+        # Precomputed rollups (totals, trends, top regions) rather than raw rows
+        return await _timed(timings, fetch_sales_rollups(fields), "context_fetch", collection)
+    if fields:
+        search_options = {**(search_options or {}), "fields": fields}
+    # Perform vector search, embedding the topic once for all collections
+    # Shielded so one collection's deadline doesn't cancel the shared embedding
+    query_embedding = await asyncio.shield(embedding_task)
+    return await _timed(timings, get_query_results(topic, collection, query_embedding, search_options),
+                        "vector_search", collection)
+
+
+def _embedding_task(topic: str, timings: StageTimings, query_embedding: list = None) -> asyncio.Future:
+    if query_embedding is not None:
+        embedding_task = asyncio.get_running_loop().create_future()
+        embedding_task.set_result(query_embedding)
+        return embedding_task
+    return asyncio.create_task(asyncio.wait_for(
+        _timed(timings, query_embedding_cache.get_or_embed(topic), "embedding"), EMBEDDING_TIMEOUT
+    ))
+
+
+async def fetch_agent_configs(agent_names: list, timings: StageTimings = None) -> tuple:
+    """Look up every agent's config concurrently, each under its own deadline.
+
+    An agent whose config can't be loaded falls back to a default persona.
+
+    Returns:
+        tuple: (agent_configs, errors)
+    """
+    timings = timings or StageTimings()
+    results = await asyncio.gather(*[
+        asyncio.wait_for(_timed(timings, agent_registry.get(agent), "agent_config"), AGENT_CONFIG_TIMEOUT)
+        for agent in agent_names
+    ], return_exceptions=True)
+
+    errors = []
+    agent_configs = {}
+    for agent, result in zip(agent_names, results):
+        if isinstance(result, BaseException) or not result:
+            reason = _failure_reason(result) if isinstance(result, BaseException) else "not found"
+            print(f"Agent config for {agent} unavailable: {reason}")
+            errors.append({"stage": "agent_config", "agent": agent, "error": reason})
+            result = default_agent_config(agent)
+        agent_configs[agent] = result
+    return agent_configs, errors
+
+
+def context_fields(agent_configs: dict, context_scope: list) -> dict:
+    """The collections and fields to fetch so every agent gets its context view.
+
+    An agent config may declare a `context` view mapping collection names to
+    the fields it needs; an agent without one sees every collection in scope
+    with all its fields. Collections in scope that no agent's view includes
+    are not fetched.
+
+    Returns:
+        dict: Collection name -> sorted union of the declared fields, or None
+        for all fields, in `context_scope` order.
+    """
+    fields_by_collection = {}
+    for collection in context_scope:
+        fields = set()
+        for config in agent_configs.values():
+            view = config.get("context")
+            if view is None:
+                fields = None
+                break
+            fields.update(view.get(collection, ()))
+        if fields is None or fields:
+            fields_by_collection[collection] = sorted(fields) if fields else None
+    return fields_by_collection
+
+
+async def fetch_context(topic: str, fields_by_collection: dict, timings: StageTimings = None,
+                        search_options: dict = None, embedding_task: asyncio.Future = None) -> tuple:
+    """Fetch the given collections concurrently, each under its own deadline.
+
+    A fetch that fails or times out is left out of the context and reported
+    in the returned errors.
+
+    Args:
+        topic (str): The debate topic, used for vector search.
+        fields_by_collection (dict): Collection name -> fields to project (None for all).
+        timings (StageTimings): Records the duration of each fetch.
+        search_options (dict): Vector search options per collection name.
+        embedding_task (asyncio.Future): Resolves to the topic's embedding; the
+            topic is embedded here when it's omitted and a collection needs it.
+
+    Returns:
+        tuple: (agent_context, errors)
+    """
+    timings = timings or StageTimings()
+    collections = list(fields_by_collection)
+    owns_embedding = embedding_task is None and any(collection not in TOPIC_INDEPENDENT_COLLECTIONS
+                                                    for collection in collections)
+    if owns_embedding:
+        embedding_task = _embedding_task(topic, timings)
+
+    try:
+        results = await asyncio.gather(*[
+            asyncio.wait_for(
+                _fetch_collection(topic, collection, embedding_task, timings,
+                                  (search_options or {}).get(collection), fields_by_collection[collection]),
+                CONTEXT_FETCH_TIMEOUT
+            )
+            for collection in collections
+        ], return_exceptions=True)
+    finally:
+        if owns_embedding and not embedding_task.done():
+            embedding_task.cancel()
+
+    errors = []
+    agent_context = {}
+    for collection, result in zip(collections, results):
+        if isinstance(result, BaseException):
+            reason = _failure_reason(result)
+            print(f"Context fetch for {collection} failed: {reason}")
+            errors.append({"stage": "context", "collection": collection, "error": reason})
+            continue
+        agent_context[collection] = result
+    return agent_context, errors
+
+
+async def gather_context(topic: str, context_scope: list, agent_names: list, timings: StageTimings = None,
+                         search_options: dict = None) -> tuple:
+    """Fetch the agent configs, then the union of their context views in one pass.
+
+    The topic embedding starts before the configs are looked up, so vector
+    searches don't wait on it any longer than before. See `fetch_agent_configs`,
+    `context_fields` and `fetch_context`.
+
+    Args:
+        topic (str): The debate topic, used for vector search.
+        context_scope (list): Collection names the agents may see.
+        agent_names (list): Names of the agents taking part.
+        timings (StageTimings): Records the duration of each fetch.
+        search_options (dict): Vector search options per collection name.
+
+    Returns:
+        tuple: (agent_context, agent_configs, errors)
+    """
+    timings = timings or StageTimings()
+    embedding_task = None
+    if any(collection not in TOPIC_INDEPENDENT_COLLECTIONS for collection in context_scope):
+        embedding_task = _embedding_task(topic, timings)
+    try:
+        agent_configs, errors = await fetch_agent_configs(agent_names, timings)
+        agent_context, context_errors = await fetch_context(topic, context_fields(agent_configs, context_scope),
+                                                            timings, search_options, embedding_task)
+    finally:
+        if embedding_task is not None and not embedding_task.done():
+            embedding_task.cancel()
+    return agent_context, agent_configs, context_errors + errors
+
+
+def context_blocks(agents: dict, agent_configs: dict, agent_context: dict) -> dict:
+    """Each agent's context block, built from its own context view.
+
+    Agents with the same view share one block, sized to fit all their models,
+    so their prompts keep a common prefix.
+
+    Returns:
+        dict: Agent name -> context block.
+    """
+    groups = {}
+    for agent in agents:
+        view = agent_configs[agent].get("context")
+        key = None if view is None else tuple(sorted((col, tuple(sorted(fields))) for col, fields in view.items()))
+        groups.setdefault(key, (view, []))[1].append(agent)
+
+    blocks = {}
+    for view, members in groups.values():
+        block = build_context_block(context_view(agent_context, view),
+                                    shared_context_budget([agents[agent] for agent in members]))
+        blocks.update((agent, block) for agent in members)
+    return blocks
+
+
+async def lookup_cached_debate(topic: str, agents: dict, context_scope: list, aggregator_model: str,
+                               use_cache: bool = True, search_options: dict = None, rounds: int = 1,
+                               convergence_threshold: float = None, topic_embedding: list = None) -> tuple:
+    """Look the debate up in the semantic debate cache.
+
+    Returns:
+        tuple: (cached_result, cache_entry) where cached_result is the stored
+        debate on a hit (else None) and cache_entry holds what `store_cached_debate`
+        needs to store the new result (None when the cache is bypassed or unusable).
+    """
+    if not await debate_cache.available():
+        return None, None
+    if not use_cache:
+        debate_cache.bypassed += 1
+        return None, None
+    try:
+        if topic_embedding is None:
+            topic_embedding = await asyncio.wait_for(query_embedding_cache.get_or_embed(topic), EMBEDDING_TIMEOUT)
+    except Exception as e:
+        print(f"Skipping debate cache, topic embedding failed: {_failure_reason(e)}")
+        return None, None
+    config_key = debate_config_key(agents, context_scope, aggregator_model, search_options, rounds,
+                                   convergence_threshold)
+    cached = await debate_cache.lookup(topic_embedding, config_key)
+    return cached, (topic_embedding, config_key)
+
+
+def _cached_result(topic: str, cached: dict) -> dict:
+    return {
+        "topic": topic,
+        "agents": cached["agents"],
+        "responses": cached["responses"],
+        "summary": cached["summary"],
+        "cached": True,
+        "cached_topic": cached["topic"],
+        "similarity": cached["similarity"]
+    }
+
+
+async def store_cached_debate(topic: str, cache_entry: tuple, result: dict) -> None:
+    if cache_entry is None or result.get("degraded"):
+        return
+    topic_embedding, config_key = cache_entry
+    await debate_cache.store(topic, topic_embedding, config_key, result)
+
+
+def _round_prompt(config: dict, topic: str, context_block: str, previous: dict) -> str:
+    """The opening prompt in the first round, a rebuttal prompt after that."""
+    if not previous:
+        return build_agent_prompt(config, topic, context_block)
+    return build_rebuttal_prompt(config, topic, context_block,
+                                 {agent: response["response"] for agent, response in previous.items()})
+
+
+async def _run_agent(model: str, prompt: str, agent: str, round_number: int, events: asyncio.Queue,
+                     timings: StageTimings, priority: int = INTERACTIVE, llm_slots: asyncio.Semaphore = None,
+                     stream_tokens: bool = False) -> dict:
+    """One agent's turn, putting its "token" events (when `stream_tokens` is set) and its "agent" event on `events`.
+
+    Returns:
+        dict: The agent's result, or its `error` if its model failed or timed out.
+    """
+    try:
+        with timings.stage("llm", model=model):
+            async with llm_slots or contextlib.nullcontext():
+                if not stream_tokens:
+                    result = await call_llm(model, prompt, agent, priority)
                 else:
-                    # Perform vector search
-                    agent_context[collection] = await get_query_results(topic, collection)
-                 
-            for agent in agents: 
-                config = await fetch_agent_config(agent)
-                prompt = build_agent_prompt(config, topic, agent_context)
-                tasks.append(call_llm(agents.get(agent), prompt, agent))
-
-            responses = await asyncio.gather(*tasks)
-            # print("Responses", responses)
-            summary = await summarize_debate(topic, responses, aggregator_model)
+                    parts = []
+                    async for delta in stream_llm(model, prompt, priority):
+                        parts.append(delta)
+                        await events.put({"event": "token", "agent": agent, "delta": delta})
+                    result = {"agent": agent, "model": model, "response": "".join(parts)}
+    except Exception as e:
+        # The debate goes on without this agent; the failure is reported in its "agent" event
+        reason = _failure_reason(e)
+        print(f"Agent {agent} failed: {reason}")
+        await events.put({"event": "agent", "agent": agent, "model": model, "round": round_number,
+                          "response": f"No response ({reason})", "error": reason})
+        return {"agent": agent, "model": model, "error": reason}
+    await events.put({"event": "agent", "round": round_number, **result})
+    return result
 
-            return {
-                "topic": topic,
-                "agents": [r['agent'] for r in responses],
-                "responses": responses,
-                "summary": summary
-            }
+
+async def debate_round_events(topic: str, agents: dict, agent_configs: dict, agent_context: dict, errors: list,
+                              timings: StageTimings, rounds: int = 1, convergence_threshold: float = None,
+                              priority: int = INTERACTIVE, llm_slots: asyncio.Semaphore = None,
+                              stream_tokens: bool = False) -> AsyncIterator[dict]:
+    """Run the agents' rounds on context that has already been fetched, yielding events as they happen.
+
+    Events, in order: per round, a "round" event naming the agents that speak
+    in it, then per agent optional "token" events (when `stream_tokens` is set)
+    followed by an "agent" event as soon as that agent finishes; and finally
+    one "rounds_done" event with the final `responses`, the `errors` (`errors`
+    and the agents' failures, as a new list) and the round engine's `summary`.
+
+    Args:
+        errors (list): Failures so far.
+        priority (int): Scheduler priority of the agents' calls.
+        llm_slots (asyncio.Semaphore): Caps the LLM calls in flight, if given.
+
+    Raises:
+        RuntimeError: If every agent's model failed in a round.
+    """
+    blocks = context_blocks(agents, agent_configs, agent_context)
+    # Later rounds rebut the previous one, until the stances converge or settle
+    debate_rounds = DebateRounds(list(agents), rounds, convergence_threshold)
+    latest = {}
+    speakers = list(agents)
+    tasks = []
+    try:
+        while speakers:
+            round_number = debate_rounds.round
+            yield {"event": "round", "round": round_number, "agents": speakers}
+            queue = asyncio.Queue()
+            tasks = [
+                asyncio.create_task(_run_agent(
+                    agents.get(agent), _round_prompt(agent_configs[agent], topic, blocks[agent], latest), agent,
+                    round_number, queue, timings, priority, llm_slots, stream_tokens
+                ))
+                for agent in speakers
+            ]
+
+            pending = set(tasks)
+            while pending:
+                getter = asyncio.create_task(queue.get())
+                done, _ = await asyncio.wait(pending | {getter}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    yield getter.result()
+                else:
+                    getter.cancel()
+                for task in done - {getter}:
+                    pending.discard(task)
+                    task.result()
+            while not queue.empty():
+                yield queue.get_nowait()
+
+            # An agent whose model fails or times out is left out, like a failed context fetch;
+            # after the first round it keeps its previous response
+            for agent, task in zip(speakers, tasks):
+                if "error" in task.result():
+                    # A new list: the caller's may be shared, e.g. with coalesced streams
+                    errors = errors + [{"stage": "llm", "round": round_number, **task.result()}]
+                else:
+                    latest[agent] = task.result()
+            if not latest:
+                raise RuntimeError("Every agent's model failed: " + "; ".join(e["error"] for e in errors
+                                                                            if e["stage"] == "llm"))
+            speakers = await debate_rounds.next_speakers(speakers, latest)
+        yield {"event": "rounds_done", "responses": [latest[agent] for agent in agents if agent in latest],
+               "errors": errors, "summary": debate_rounds.summary()}
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def run_debate(topic: str, agents: dict, agent_configs: dict, agent_context: dict, aggregator_model: str,
+                     errors: list, timings: StageTimings, rounds: int = 1, convergence_threshold: float = None,
+                     priority: int = INTERACTIVE, llm_slots: asyncio.Semaphore = None) -> dict:
+    """Run the agents' rounds and the summary on context that has already been fetched.
+
+    Args:
+        errors (list): Failures so far; the result reports them with the agents' failures.
+        priority (int): Scheduler priority of the agents' calls; the summary
+            runs at SUMMARY, or at `priority` when that is lower.
+        llm_slots (asyncio.Semaphore): Caps the LLM calls in flight, if given.
+
+    Returns:
+        dict: The debate result.
+    """
+    async for event in debate_round_events(topic, agents, agent_configs, agent_context, errors, timings, rounds,
+                                           convergence_threshold, priority, llm_slots):
+        if event["event"] == "rounds_done":
+            responses, errors, rounds_summary = event["responses"], event["errors"], event["summary"]
+    with timings.stage("summary", model=aggregator_model):
+        async with llm_slots or contextlib.nullcontext():
+            summary = await summarize_debate(topic, responses, aggregator_model, max(priority, SUMMARY))
+
+    result = {
+        "topic": topic,
+        "agents": [r['agent'] for r in responses],
+        "responses": responses,
+        "summary": summary,
+        **rounds_summary
+    }
+    if errors:
+        result["degraded"] = errors
+    return result
+
+
+async def orchestrate_debate(topic: str, agents: dict, context_scope: list, aggregator_model: str,
+                             use_cache: bool = True, timings: StageTimings = None,
+                             search_options: dict = None, rounds: int = 1,
+                             convergence_threshold: float = None) -> dict:
+        timings = timings or StageTimings()
+        try:
+            with timings.stage("cache_lookup"):
+                cached, cache_entry = await lookup_cached_debate(topic, agents, context_scope, aggregator_model,
+                                                                 use_cache, search_options, rounds,
+                                                                 convergence_threshold)
+            if cached is not None:
+                return _cached_result(topic, cached)
+
+            with timings.stage("retrieval"):
+                agent_context, agent_configs, errors = await gather_context(topic, context_scope, list(agents), timings,
+                                                                            search_options)
+
+            result = await run_debate(topic, agents, agent_configs, agent_context, aggregator_model, errors, timings,
+                                      rounds, convergence_threshold)
+            await store_cached_debate(topic, cache_entry, result)
+            return result
         except Exception as e:
             error_traceback = traceback.format_exc()
             print(f"Error in orchestrating debate: {str(e)}\nTraceback:\n{error_traceback}")
             return {
                 "error": str(e),
                 "traceback": error_traceback
-            }
\ No newline at end of file
+            }
+
+
+async def stream_debate(topic: str, agents: dict, context_scope: list, aggregator_model: str,
+                        stream_tokens: bool = False, use_cache: bool = True,
+                        timings: StageTimings = None, search_options: dict = None, rounds: int = 1,
+                        convergence_threshold: float = None) -> AsyncIterator[dict]:
+    """Run a debate and yield events as each stage completes.
+
+    Events, in order: one "start" event; per round, a "round" event naming
+    the agents that speak in it, then per agent optional "token" events (when
+    `stream_tokens` is set) followed by an "agent" event as soon as that agent
+    finishes; "token" events for the Moderator (when `stream_tokens` is set);
+    one "summary" event, which also reports the rounds used; and finally
+    "done". Failures are reported as an "error" event that ends the stream. A
+    debate served from the debate cache yields "start", "agent", "summary" and
+    "done" events only, and "start" has `cached` set.
+    """
+    timings = timings or StageTimings()
+    try:
+        with timings.stage("cache_lookup"):
+            cached, cache_entry = await lookup_cached_debate(topic, agents, context_scope, aggregator_model,
+                                                             use_cache, search_options, rounds,
+                                                             convergence_threshold)
+        if cached is not None:
+            yield {"event": "start", "topic": topic, "agents": cached["agents"], "degraded": [],
+                   "cached": True, "cached_topic": cached["topic"], "similarity": cached["similarity"]}
+            for response in cached["responses"]:
+                yield {"event": "agent", **response}
+            yield {"event": "summary", "summary": cached["summary"]}
+            yield {"event": "done"}
+            return
+
+        with timings.stage("retrieval"):
+            agent_context, agent_configs, errors = await gather_context(topic, context_scope, list(agents), timings,
+                                                                        search_options)
+        yield {"event": "start", "topic": topic, "agents": list(agents), "degraded": errors}
+
+        # Closed with this stream, so a disconnected client cancels the agents' calls
+        async with contextlib.aclosing(debate_round_events(topic, agents, agent_configs, agent_context, errors,
+                                                           timings, rounds, convergence_threshold,
+                                                           stream_tokens=stream_tokens)) as events:
+            async for event in events:
+                if event["event"] == "rounds_done":
+                    responses, errors, rounds_summary = event["responses"], event["errors"], event["summary"]
+                else:
+                    yield event
+        summary_start = time.perf_counter()
+        if stream_tokens:
+            parts = []
+            async for delta in stream_llm(aggregator_model, build_summary_prompt(topic, responses, aggregator_model),
+                                          SUMMARY):
+                parts.append(delta)
+                yield {"event": "token", "agent": "Moderator", "delta": delta}
+            summary = "".join(parts)
+        else:
+            summary = await summarize_debate(topic, responses, aggregator_model)
+        timings.record("summary", time.perf_counter() - summary_start, model=aggregator_model)
+        yield {"event": "summary", "summary": summary, **rounds_summary}
+        await store_cached_debate(topic, cache_entry, {
+            "agents": list(agents), "responses": responses, "summary": summary, "degraded": errors
+        })
+        yield {"event": "done"}
+    except Exception as e:
+        print(f"Error in streaming debate: {str(e)}\nTraceback:\n{traceback.format_exc()}")
+        yield {"event": "error", "error": str(e)}
+
+
+async def orchestrate_debate_batch(topics: List[str], agents: dict, context_scope: list, aggregator_model: str,
+                                   use_cache: bool = True, timings: StageTimings = None, search_options: dict = None,
+                                   rounds: int = 1, convergence_threshold: float = None) -> AsyncIterator[dict]:
+    """Run one debate per topic with a shared configuration, yielding each result as it completes.
+
+    Work common to the topics is done once: every topic is embedded in batched
+    requests, and topic-independent context (TOPIC_INDEPENDENT_COLLECTIONS)
+    and agent configs are fetched a single time. Each topic then runs its own
+    vector searches and debate at BULK priority, with at most
+    BATCH_TOPIC_CONCURRENCY topics of the batch in flight and at most
+    BATCH_LLM_CONCURRENCY LLM calls in flight across every batch.
+
+    Events, in order: one "start" event with the failures shared by every
+    topic; one "result" event per topic, in completion order, with the topic's
+    `index` in `topics` and either its result or an `error`; and "done" with
+    the number of topics completed and failed.
+    """
+    timings = timings or StageTimings()
+    shared_errors = []
+    embeddings = [None] * len(topics)
+    if (any(collection not in TOPIC_INDEPENDENT_COLLECTIONS for collection in context_scope)
+            or (use_cache and await debate_cache.available())):
+        try:
+            with timings.stage("embedding"):
+                embeddings = await query_embedding_cache.get_or_embed_many(topics, batch_size=BATCH_EMBED_SIZE,
+                                                                           priority=BULK)
+        except Exception as e:
+            # Each topic is then embedded on its own
+            print(f"Batch topic embedding failed: {str(e)}")
+            shared_errors.append({"stage": "embedding", "error": str(e)})
+    with timings.stage("retrieval"):
+        agent_configs, errors = await fetch_agent_configs(list(agents), timings)
+        fields_by_collection = context_fields(agent_configs, context_scope)
+        shared_context, context_errors = await fetch_context(
+            "", {col: fields for col, fields in fields_by_collection.items() if col in TOPIC_INDEPENDENT_COLLECTIONS},
+            timings
+        )
+    topic_fields = {col: fields for col, fields in fields_by_collection.items()
+                    if col not in TOPIC_INDEPENDENT_COLLECTIONS}
+    shared_errors += context_errors + errors
+    yield {"event": "start", "topics": len(topics), "degraded": shared_errors}
+
+    topic_slots = asyncio.Semaphore(max(1, BATCH_TOPIC_CONCURRENCY))
+
+    async def debate(index: int, topic: str, embedding: list) -> dict:
+        async with topic_slots:
+            try:
+                cached, cache_entry = await lookup_cached_debate(topic, agents, context_scope, aggregator_model,
+                                                                 use_cache, search_options, rounds,
+                                                                 convergence_threshold, embedding)
+                if cached is not None:
+                    return {"index": index, **_cached_result(topic, cached)}
+                embedding_task = _embedding_task(topic, timings, embedding) if embedding is not None else None
+                topic_context, errors = await fetch_context(topic, topic_fields, timings, search_options,
+                                                            embedding_task)
+                result = await run_debate(topic, agents, agent_configs, {**shared_context, **topic_context},
+                                          aggregator_model, shared_errors + errors, timings, rounds,
+                                          convergence_threshold, BULK, batch_llm_slots)
+                await store_cached_debate(topic, cache_entry, result)
+                return {"index": index, **result}
+            except Exception as e:
+                print(f"Error in batch debate on {topic!r}: {str(e)}")
+                return {"index": index, "topic": topic, "error": str(e)}
+
+    tasks = [asyncio.create_task(debate(index, topic, embedding))
+             for index, (topic, embedding) in enumerate(zip(topics, embeddings))]
+    failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            failed += "error" in result
+            yield {"event": "result", **result}
+        yield {"event": "done", "completed": len(topics) - failed, "failed": failed}
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import time
+from typing import Optional
+
+from pymongo.errors import PyMongoError
+
+from services import mongo_client
+
+AGENT_CONFIG_TTL = float(os.getenv("AGENT_CONFIG_TTL", "300"))
+AGENT_CONFIG_WATCH = os.getenv("AGENT_CONFIG_WATCH", "true").lower() == "true"
+# Backoff between attempts to (re)open the change stream
+AGENT_CONFIG_WATCH_RETRY_MIN = float(os.getenv("AGENT_CONFIG_WATCH_RETRY_MIN", "1"))
+AGENT_CONFIG_WATCH_RETRY_MAX = float(os.getenv("AGENT_CONFIG_WATCH_RETRY_MAX", "300"))
+
+
+class AgentRegistry:
+    """In-memory registry of agent configurations from the `agents` collection.
+
+    Configs are loaded once and served from memory. A change stream on
+    `agents` keeps the registry current; when change streams aren't available
+    (standalone mongod) the registry reloads itself once `ttl_seconds` have
+    passed since the last load, and the stream is reopened with a backoff.
+    Names that aren't found are remembered for `ttl_seconds` too, until a load
+    or a change to `agents` clears them.
+    """
+
+    def __init__(self, ttl_seconds: float = AGENT_CONFIG_TTL):
+        self.ttl_seconds = ttl_seconds
+        self._configs = {}
+        self._names_by_id = {}
+        # Names looked up and not found, with when they were looked up
+        self._missing = {}
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+        self._watch_task: Optional[asyncio.Task] = None
+        self.watching = False
+        self.reloads = 0
+        self.changes_applied = 0
+
+    async def load(self, only_if_stale: bool = False) -> int:
+        """(Re)load every agent config from MongoDB.
+
+        Args:
+            only_if_stale (bool): Skip the reload if the registry was reloaded
+                (e.g. by a concurrent lookup) while waiting for the lock.
+
+        Returns:
+            int: Number of agent configs loaded.
+        """
+        async with self._lock:
+            if only_if_stale and not self._is_stale():
+                return len(self._configs)
+            docs = await mongo_client.db.agents.find({}).to_list(length=None)
+            self._configs = {doc["name"]: doc for doc in docs if "name" in doc}
+            self._names_by_id = {doc["_id"]: doc["name"] for doc in docs if "name" in doc}
+            self._missing = {}
+            self._loaded_at = time.monotonic()
+            self.reloads += 1
+            return len(self._configs)
+
+    def invalidate(self) -> None:
+        """Force the next lookup to reload from MongoDB."""
+        self._loaded_at = None
+        self._missing = {}
+
+    def _is_stale(self) -> bool:
+        if self._loaded_at is None:
+            return True
+        # With a live change stream the registry is kept current; TTL is only a fallback
+        return not self.watching and time.monotonic() - self._loaded_at > self.ttl_seconds
+
+    async def get(self, agent_name: str) -> Optional[dict]:
+        """Return an agent's configuration, loading it from MongoDB only if needed.
+
+        Args:
+            agent_name (str): The name of the agent to fetch.
+
+        Returns:
+            dict: The agent configuration, or None if no such agent exists.
+        """
+        if self._is_stale():
+            await self.load(only_if_stale=True)
+        config = self._configs.get(agent_name)
+        if config is not None:
+            return config
+        missed_at = self._missing.get(agent_name)
+        if missed_at is not None and time.monotonic() - missed_at <= self.ttl_seconds:
+            return None
+        config = await mongo_client.fetch_agent_config(agent_name)
+        if config is not None:
+            self._apply_document(config)
+        else:
+            self._missing[agent_name] = time.monotonic()
+        return config
+
+    def _apply_document(self, doc: dict) -> None:
+        previous_name = self._names_by_id.get(doc["_id"])
+        if previous_name is not None and previous_name != doc.get("name"):
+            self._configs.pop(previous_name, None)
+        if "name" in doc:
+            self._missing.pop(doc["name"], None)
+            self._configs[doc["name"]] = doc
+            self._names_by_id[doc["_id"]] = doc["name"]
+
+    def _apply_change(self, change: dict) -> None:
+        operation = change.get("operationType")
+        if operation in ("insert", "update", "replace") and change.get("fullDocument"):
+            self._apply_document(change["fullDocument"])
+        elif operation == "delete":
+            name = self._names_by_id.pop(change["documentKey"]["_id"], None)
+            if name is not None:
+                self._configs.pop(name, None)
+        else:
+            # drop, rename, invalidate, ...: fall back to a full reload
+            self.invalidate()
+        self.changes_applied += 1
+
+    async def watch(self) -> None:
+        """Apply changes from a change stream on `agents` until cancelled.
+
+        While the stream is unavailable the registry falls back to TTL reloads,
+        and the stream is reopened after a backoff that doubles up to
+        AGENT_CONFIG_WATCH_RETRY_MAX.
+        """
+        delay = AGENT_CONFIG_WATCH_RETRY_MIN
+        while True:
+            try:
+                async with mongo_client.db.agents.watch(full_document="updateLookup") as stream:
+                    self.watching = True
+                    delay = AGENT_CONFIG_WATCH_RETRY_MIN
+                    # Changes made between the initial load and opening the stream
+                    await self.load()
+                    async for change in stream:
+                        self._apply_change(change)
+            except PyMongoError as e:
+                print(f"Agent config change stream unavailable, using TTL reloads and retrying in "
+                      f"{delay:.1f}s: {str(e)}")
+            finally:
+                self.watching = False
+            await asyncio.sleep(delay)
+            delay = min(AGENT_CONFIG_WATCH_RETRY_MAX, delay * 2)
+
+    async def start(self) -> None:
+        """Load all configs and start watching for changes."""
+        await self.load()
+        if AGENT_CONFIG_WATCH and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self.watch())
+
+    async def stop(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    def stats(self) -> dict:
+        return {
+            "agents": sorted(self._configs),
+            "missing": len(self._missing),
+            "watching": self.watching,
+            "reloads": self.reloads,
+            "changes_applied": self.changes_applied,
+            "age_seconds": None if self._loaded_at is None else time.monotonic() - self._loaded_at,
+        }
+
+
+agent_registry = AgentRegistry()
@@ -0,0 +1,346 @@
+import codecs
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import re
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, Iterator, List, Tuple
+
+from bson import json_util
+from pymongo.operations import UpdateOne
+
+from services import mongo_client
+from services.metrics import register_label_values
+
+LOAD_CHUNK_SIZE = int(os.getenv("LOAD_CHUNK_SIZE", "500"))
+CHECKPOINT_COLLECTION = os.getenv("LOAD_CHECKPOINT_COLLECTION", "load_checkpoints")
+# Bytes read from a source file at a time
+LOAD_READ_SIZE = int(os.getenv("LOAD_READ_SIZE", str(1 << 16)))
+# Largest source document accepted, MongoDB's own document size limit
+MAX_DOCUMENT_BYTES = 16 * 1024 * 1024
+
+# Source files: a JSON array (or single object) or NDJSON, optionally gzipped
+SOURCE_SUFFIXES = (".json", ".ndjson", ".jsonl")
+
+# Fields that identify a source document across loads. A document whose key
+# fields are unchanged but whose other fields differ is updated in place;
+# collections without a key are identified by their full content.
+LOAD_KEYS = {
+    "agents": ["name"],
+    "sales_data": ["region", "quarter"],
+    "customer_feedback": ["customer_id", "created_at"],
+    "performance_logs": ["feature", "issue_type", "date_reported"],
+}
+
+# ISO-8601 string fields stored as BSON dates, so they can be range-filtered
+DATE_FIELDS = {
+    "performance_logs": ["date_reported"],
+}
+
+# Text field embedded for each vector-searched collection
+EMBEDDING_FIELDS = {
+    "customer_feedback": "feedback",
+    "performance_logs": "summary",
+}
+
+register_label_values(collections=[*LOAD_KEYS, *EMBEDDING_FIELDS])
+
+
+def _hash(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def content_hash(doc: dict) -> str:
+    """Stable hash of a source document's content."""
+    return _hash({k: v for k, v in doc.items() if not k.startswith("_") and k != "embedding"})
+
+
+def source_key(collection_name: str, doc: dict) -> str:
+    """Stable identity of a source document within its collection."""
+    key_fields = LOAD_KEYS.get(collection_name)
+    if not key_fields:
+        return content_hash(doc)
+    return _hash([doc.get(field) for field in key_fields])
+
+
+def _convert_dates(collection_name: str, doc: dict) -> dict:
+    for field in DATE_FIELDS.get(collection_name, []):
+        if isinstance(doc.get(field), str):
+            doc[field] = datetime.fromisoformat(doc[field].replace("Z", "+00:00"))
+    return doc
+
+
+def file_signature(path: str) -> dict:
+    stat = os.stat(path)
+    return {"file": os.path.basename(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+async def read_checkpoint(collection_name: str) -> dict:
+    return await mongo_client.db[CHECKPOINT_COLLECTION].find_one({"_id": collection_name}) or {}
+
+
+async def write_checkpoint(collection_name: str, signature: dict, position: int, status: str,
+                           offset: int = None) -> None:
+    """Record how far a load got: `position` documents, the next of which starts at byte `offset`."""
+    await mongo_client.db[CHECKPOINT_COLLECTION].replace_one(
+        {"_id": collection_name},
+        {"signature": signature, "position": position, "offset": offset, "status": status,
+         "updated_at": datetime.now(timezone.utc)},
+        upsert=True
+    )
+
+
+def is_source_file(filename: str) -> bool:
+    return filename.removesuffix(".gz").endswith(SOURCE_SUFFIXES)
+
+
+def source_collection(filename: str) -> str:
+    """Collection a source file loads into, e.g. sales_data.ndjson.gz -> sales_data."""
+    return filename.split(".")[0]
+
+
+def _open_source(path: str):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+# Extended JSON ({"$date": ...}) is decoded to native BSON types
+_decoder = json.JSONDecoder(object_hook=json_util.object_hook)
+_WHITESPACE = re.compile(r"[ \t\r\n]*")
+_ARRAY_SEPARATORS = re.compile(r"[ \t\r\n,]*")
+
+
+def iter_json_values(stream, offset: int = 0, in_array: bool = None) -> Iterator[Tuple[int, object]]:
+    """Incrementally parse the elements of a JSON array, or a sequence of JSON values such as NDJSON.
+
+    The stream is read LOAD_READ_SIZE bytes at a time, so memory use is bounded
+    by the largest single value rather than the size of the source.
+
+    Args:
+        stream: Binary file object, positioned at `offset`.
+        offset (int): Byte offset of the stream's position in the (decompressed) source.
+        in_array (bool): Whether the position is inside a top-level array;
+            detected from the first character when None.
+
+    Yields:
+        tuple: (offset, value), where offset is the byte offset at which the value starts.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer, pos = "", 0
+    eof = False
+    while True:
+        # Separators are ASCII, so characters skipped are bytes skipped
+        skipped = (_ARRAY_SEPARATORS if in_array else _WHITESPACE).match(buffer, pos).end()
+        offset += skipped - pos
+        pos = skipped
+        if pos < len(buffer):
+            if in_array is None:
+                in_array = buffer[pos] == "["
+                if in_array:
+                    pos += 1
+                    offset += 1
+                    continue
+            if in_array and buffer[pos] == "]":
+                return
+            try:
+                value, end = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof or len(buffer) - pos > MAX_DOCUMENT_BYTES:
+                    raise
+                end = None
+            # A value ending exactly at the end of the buffer (a number) may continue in the next read
+            if end is not None and (end < len(buffer) or eof):
+                yield offset, value
+                offset += len(buffer[pos:end].encode("utf-8"))
+                pos = end
+                continue
+        elif eof:
+            if in_array:
+                raise ValueError("Unterminated JSON array")
+            return
+        data = stream.read(LOAD_READ_SIZE)
+        eof = not data
+        buffer, pos = buffer[pos:] + decoder.decode(data, final=eof), 0
+
+
+def source_is_array(path: str) -> bool:
+    """Whether a source file holds a JSON array, rather than a sequence of values."""
+    with _open_source(path) as f:
+        while True:
+            data = f.read(LOAD_READ_SIZE)
+            stripped = data.lstrip(b" \t\r\n")
+            if stripped or not data:
+                return stripped[:1] == b"["
+
+
+def iter_documents(path: str, collection_name: str, offset: int = 0,
+                   in_array: bool = None) -> Iterator[Tuple[int, dict]]:
+    """Stream the source documents of a file, converting date fields.
+
+    Args:
+        path (str): Source file; gzipped when its name ends in .gz.
+        collection_name (str): Collection the documents are loaded into.
+        offset (int): Byte offset of a document to start at (see `iter_json_values`).
+        in_array (bool): Whether the file is a JSON array; required with `offset`.
+
+    Yields:
+        tuple: (offset, document)
+    """
+    with _open_source(path) as f:
+        if offset:
+            f.seek(offset)
+        for position, doc in iter_json_values(f, offset, in_array):
+            yield position, _convert_dates(collection_name, doc)
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """Lists of up to `size` consecutive items."""
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def _source_fields(collection_name: str, doc: dict) -> dict:
+    fields = {k: v for k, v in doc.items() if k != "_id"}
+    fields["_source_key"] = source_key(collection_name, doc)
+    fields["_content_hash"] = content_hash(doc)
+    text_field = EMBEDDING_FIELDS.get(collection_name)
+    if text_field:
+        fields["_text_hash"] = _hash(doc.get(text_field))
+    return fields
+
+
+async def ensure_source_key_index(collection_name: str, batch_size: int = LOAD_CHUNK_SIZE) -> None:
+    """Create the unique `_source_key` index, first migrating documents stored before it existed.
+
+    Documents inserted by the old loader have no `_source_key` and were inserted
+    again on every load. They get their `_source_key`, hashes and converted date
+    fields, and then all but one document per key is deleted, keeping one that
+    has a vector. Existing vectors are kept; they were embedded from the same field.
+    """
+    collection = mongo_client.db[collection_name]
+    if "_source_key_1" in await collection.index_information():
+        return
+    text_field = EMBEDDING_FIELDS.get(collection_name)
+    updates = []
+    async for doc in collection.find({"_source_key": {"$exists": False}}):
+        fields = _source_fields(collection_name, _convert_dates(collection_name, dict(doc)))
+        fields.pop("embedding", None)
+        if text_field and "embedding" in doc and "_embedded_hash" not in doc:
+            fields["_embedded_hash"] = fields["_text_hash"]
+        updates.append((doc["_id"], fields))
+        if len(updates) >= batch_size:
+            await mongo_client.bulk_update_fields(collection_name, updates)
+            updates = []
+    await mongo_client.bulk_update_fields(collection_name, updates)
+
+    duplicates = collection.aggregate([
+        {"$group": {"_id": "$_source_key", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    removed = 0
+    async for group in duplicates:
+        kept = await collection.find_one({"_id": {"$in": group["ids"]}, "embedding": {"$exists": True}}, {"_id": 1})
+        kept_id = kept["_id"] if kept else group["ids"][0]
+        result = await collection.delete_many({"_id": {"$in": [i for i in group["ids"] if i != kept_id]}})
+        removed += result.deleted_count
+    if updates or removed:
+        print(f"Migrated {collection_name} to source keys; removed {removed} duplicate documents")
+    await collection.create_index("_source_key", unique=True)
+
+
+async def upsert_documents(collection_name: str, documents: List[dict]) -> dict:
+    """Upsert source documents, writing only the ones that are new or changed.
+
+    Each stored document carries `_source_key` (its identity), `_content_hash`,
+    `_updated_at` (when it was last written) and, for embedded collections,
+    `_text_hash` of the embedded field.
+
+    Returns:
+        dict: Counts of inserted, updated and unchanged documents.
+    """
+    collection = mongo_client.db[collection_name]
+    prepared = {}
+    for doc in documents:
+        fields = _source_fields(collection_name, doc)
+        # Later duplicates within a chunk win, like repeated upserts would
+        prepared[fields["_source_key"]] = fields
+
+    existing = {
+        doc["_source_key"]: doc["_content_hash"]
+        async for doc in collection.find(
+            {"_source_key": {"$in": list(prepared)}}, {"_source_key": 1, "_content_hash": 1}
+        )
+    }
+    now = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne({"_source_key": key}, {"$set": {**fields, "_updated_at": now}}, upsert=True)
+        for key, fields in prepared.items()
+        if existing.get(key) != fields["_content_hash"]
+    ]
+    if operations:
+        await collection.bulk_write(operations, ordered=False)
+    inserted = sum(1 for key in prepared if key not in existing)
+    return {
+        "inserted": inserted,
+        "updated": len(operations) - inserted,
+        "unchanged": len(prepared) - len(operations),
+    }
+
+
+async def load_file(path: str, collection_name: str, chunk_size: int = LOAD_CHUNK_SIZE) -> AsyncIterator[dict]:
+    """Incrementally load a JSON array, NDJSON or gzipped source file into a collection.
+
+    The file is parsed as a stream and documents are upserted in chunks keyed
+    on `_source_key`; unchanged documents are skipped. A checkpoint records how
+    far the load got, so an interrupted load of the same file resumes from the
+    byte offset after the last completed chunk, and a file that was already
+    loaded completely is skipped.
+
+    Yields:
+        dict: Progress after each chunk (position, inserted, updated, unchanged,
+        resumed_from, skipped), and `total` once the whole file is loaded.
+    """
+    signature = file_signature(path)
+    checkpoint = await read_checkpoint(collection_name)
+    same_file = checkpoint.get("signature") == signature
+    if same_file and checkpoint.get("status") == "complete":
+        yield {"collection": collection_name, "skipped": True, "position": checkpoint["position"],
+               "total": checkpoint["position"], "inserted": 0, "updated": 0, "unchanged": 0, "resumed_from": 0}
+        return
+    start, offset = 0, 0
+    # Checkpoints written before offsets were recorded restart the file; unchanged documents aren't rewritten
+    if same_file and checkpoint.get("offset") is not None:
+        start, offset = checkpoint["position"], checkpoint["offset"]
+
+    await ensure_source_key_index(collection_name)
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    position = start
+    in_array = source_is_array(path) if offset else None
+    batches = batched(iter_documents(path, collection_name, offset, in_array), chunk_size)
+    batch = next(batches, [])
+    while True:
+        if batch:
+            result = await upsert_documents(collection_name, [doc for _, doc in batch])
+            for name in counts:
+                counts[name] += result[name]
+            position += len(batch)
+        # Read ahead one chunk, so the last progress update can carry the total
+        batch = next(batches, None)
+        progress = {"collection": collection_name, "skipped": False, "position": position, "resumed_from": start,
+                    **counts}
+        if batch is None:
+            await write_checkpoint(collection_name, signature, position, "complete")
+            yield {**progress, "total": position}
+            return
+        await write_checkpoint(collection_name, signature, position, "in_progress", offset=batch[0][0])
+        yield progress
+
+
+def embedding_needed_filter() -> dict:
+    """Documents with no vector, or whose text changed since it was embedded."""
+    return {"$or": [
+        {"embedding": {"$exists": False}},
+        {"$expr": {"$ne": ["$_embedded_hash", "$_text_hash"]}},
+    ]}
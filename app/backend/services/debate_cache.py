@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo.operations import SearchIndexModel
+
+from services import mongo_client
+from services.vector_codec import encode_vector
+
+# Allows the cache; it is used only once its vector index is queryable
+DEBATE_CACHE_ENABLED = os.getenv("DEBATE_CACHE_ENABLED", "true").lower() == "true"
+# Seconds between checks of whether a vector index still being built has become queryable
+DEBATE_CACHE_READY_CHECK_SECONDS = float(os.getenv("DEBATE_CACHE_READY_CHECK_SECONDS", "10"))
+DEBATE_CACHE_COLLECTION = os.getenv("DEBATE_CACHE_COLLECTION", "debate_cache")
+DEBATE_CACHE_INDEX = os.getenv("DEBATE_CACHE_INDEX", "debate_cache_index")
+DEBATE_CACHE_SIMILARITY = float(os.getenv("DEBATE_CACHE_SIMILARITY", "0.95"))
+DEBATE_CACHE_TTL = int(os.getenv("DEBATE_CACHE_TTL", "86400"))
+
+
+def debate_config_key(agents: dict, context_scope: list, aggregator_model: str, search_options: dict = None,
+                      rounds: int = 1, convergence_threshold: float = None) -> str:
+    """Hash of everything besides the topic that determines a debate's outcome."""
+    config = {
+        "agents": sorted(agents.items()),
+        "context_scope": sorted(context_scope),
+        "aggregator_model": aggregator_model,
+        "search_options": search_options or {},
+    }
+    if rounds > 1:
+        # Single-round debates keep the keys they were stored under
+        config["rounds"] = [rounds, convergence_threshold]
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class DebateCache:
+    """Semantic cache of finished debates stored in MongoDB.
+
+    Entries are keyed on the debate configuration (agent->model map, context
+    scope and aggregator model) and matched on topic similarity with a filtered
+    $vectorSearch. Entries expire through a TTL index on `created_at`.
+
+    The cache stays off until `ensure_indexes` has succeeded and Atlas reports
+    the vector index as queryable, so deployments without Atlas Search (a local
+    mongod), or with an index still being built, don't pay for a topic
+    embedding and a failing $vectorSearch on every debate.
+    """
+
+    def __init__(self, similarity_threshold: float = DEBATE_CACHE_SIMILARITY, ttl_seconds: int = DEBATE_CACHE_TTL):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.index_created = False
+        self.ready = False
+        self._checked_at: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return DEBATE_CACHE_ENABLED and self.ready
+
+    @property
+    def collection(self):
+        return mongo_client.db[DEBATE_CACHE_COLLECTION]
+
+    async def _check_ready(self) -> list:
+        self._checked_at = time.monotonic()
+        indexes = await self.collection.list_search_indexes(DEBATE_CACHE_INDEX).to_list(length=None)
+        self.ready = any(index.get("queryable") or index.get("status") == "READY" for index in indexes)
+        return indexes
+
+    async def ensure_indexes(self, num_dimensions: int = 768) -> None:
+        """Create the TTL index and the vector index used for lookups."""
+        await self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+        if await self._check_ready():
+            self.index_created = True
+            return
+        await self.collection.create_search_index(model=SearchIndexModel(
+            definition={
+                "fields": [
+                    {
+                        "type": "vector",
+                        "numDimensions": num_dimensions,
+                        "path": "topic_embedding",
+                        "similarity": "cosine"
+                    },
+                    {
+                        "type": "filter",
+                        "path": "config_key"
+                    }
+                ]},
+            name=DEBATE_CACHE_INDEX,
+            type="vectorSearch"
+        ))
+        # Atlas builds the index in the background; `available` waits for it
+        self.index_created = True
+
+    async def available(self) -> bool:
+        """Whether lookups can run, re-checking an index that wasn't queryable yet every
+        DEBATE_CACHE_READY_CHECK_SECONDS."""
+        if not DEBATE_CACHE_ENABLED or not self.index_created:
+            return False
+        if not self.ready and time.monotonic() - self._checked_at >= DEBATE_CACHE_READY_CHECK_SECONDS:
+            try:
+                await self._check_ready()
+            except Exception as e:
+                print(f"Debate cache index check failed: {str(e)}")
+        return self.ready
+
+    async def lookup(self, topic_embedding: list, config_key: str) -> Optional[dict]:
+        """Find a stored debate with the same configuration and a similar topic.
+
+        Args:
+            topic_embedding (list): Embedding of the new topic.
+            config_key (str): Key from `debate_config_key`.
+
+        Returns:
+            dict: The stored debate with its `similarity`, or None on a miss.
+        """
+        pipeline = [
+            {
+                "$vectorSearch": {
+                    "index": DEBATE_CACHE_INDEX,
+                    "queryVector": encode_vector(topic_embedding, "float32"),
+                    "path": "topic_embedding",
+                    "filter": {"config_key": config_key},
+                    "numCandidates": 20,
+                    "limit": 1
+                }
+            }, {
+                "$project": {
+                    "_id": 0,
+                    "topic": 1,
+                    "agents": 1,
+                    "responses": 1,
+                    "summary": 1,
+                    "score": {"$meta": "vectorSearchScore"}
+                }
+            }
+        ]
+        try:
+            results = await self.collection.aggregate(pipeline).to_list(length=None)
+        except Exception as e:
+            print(f"Debate cache lookup failed: {str(e)}")
+            results = []
+
+        if results:
+            # Atlas normalizes cosine scores to (1 + cosine) / 2
+            similarity = 2 * results[0].pop("score") - 1
+            if similarity >= self.similarity_threshold:
+                self.hits += 1
+                return {**results[0], "similarity": similarity}
+        self.misses += 1
+        return None
+
+    async def store(self, topic: str, topic_embedding: list, config_key: str, result: dict) -> None:
+        """Store a finished debate for later lookups."""
+        try:
+            await self.collection.insert_one({
+                "topic": topic,
+                "topic_embedding": encode_vector(topic_embedding, "float32"),
+                "config_key": config_key,
+                "agents": result["agents"],
+                "responses": result["responses"],
+                "summary": result["summary"],
+                "created_at": datetime.now(timezone.utc)
+            })
+        except Exception as e:
+            print(f"Debate cache write failed: {str(e)}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "similarity_threshold": self.similarity_threshold,
+        }
+
+
+debate_cache = DebateCache()
@@ -0,0 +1,130 @@
+import os
+import re
+from typing import Optional
+
+import numpy as np
+
+from services.llm_caller import generate_embeddings_batch
+from services.llm_scheduler import INTERACTIVE
+
+# Upper bound on the rounds a request can ask for
+DEBATE_MAX_ROUNDS = int(os.getenv("DEBATE_MAX_ROUNDS", "4"))
+# Stop once the agents' stances are this similar to each other (mean pairwise cosine)
+DEBATE_CONVERGENCE_THRESHOLD = float(os.getenv("DEBATE_CONVERGENCE_THRESHOLD", "0.9"))
+# An agent whose stance is this similar to its previous one sits out the remaining rounds
+DEBATE_STABILITY_THRESHOLD = float(os.getenv("DEBATE_STABILITY_THRESHOLD", "0.95"))
+
+_STANCE = re.compile(r"Stance:\s*\**\s*(.+?)\s*\**\s*(?:\n|Rationale:|$)", re.IGNORECASE | re.DOTALL)
+
+
+def extract_stance(response: str) -> str:
+    """The stance line of an agent's response, or the whole response if it has none."""
+    match = _STANCE.search(response or "")
+    return match.group(1).strip() if match else (response or "").strip()
+
+
+def mean_pairwise_similarity(vectors: list) -> Optional[float]:
+    """Mean cosine similarity over every pair of unit vectors (None for fewer than two)."""
+    if len(vectors) < 2:
+        return None
+    matrix = np.vstack(vectors)
+    similarities = matrix @ matrix.T
+    pairs = len(vectors) * (len(vectors) - 1)
+    return float((similarities.sum() - np.trace(similarities)) / pairs)
+
+
+class DebateRounds:
+    """Decides whether a multi-round debate goes on, and which agents speak next.
+
+    After each round the agents' stances are embedded. The debate stops when
+    the stances have converged (their mean pairwise similarity reaches
+    `convergence_threshold`), when no agent changed its stance, or after
+    `rounds` rounds. An agent whose stance barely moved since its previous
+    round is considered settled and sits out the remaining rounds.
+    """
+
+    def __init__(self, agents: list, rounds: int = 1, convergence_threshold: float = None,
+                 stability_threshold: float = DEBATE_STABILITY_THRESHOLD):
+        self.agents = list(agents)
+        self.rounds = max(1, min(rounds, DEBATE_MAX_ROUNDS))
+        self.convergence_threshold = convergence_threshold or DEBATE_CONVERGENCE_THRESHOLD
+        self.stability_threshold = stability_threshold
+        self.round = 1
+        self.calls = 0
+        self.stable = set()
+        self.stop_reason = None
+        self.history = []
+        self._stances = {}
+
+    @property
+    def calls_saved(self) -> int:
+        """Agent calls a full run of every round would have made, minus those made."""
+        return self.rounds * len(self.agents) - self.calls
+
+    async def _embed(self, responses: dict) -> dict:
+        """Unit stance vectors for the agents whose stance changed since it was last embedded."""
+        changed = {agent: extract_stance(response["response"]) for agent, response in responses.items()
+                   if agent not in self._stances or self._stances[agent][0] != response["response"]}
+        if not changed:
+            return {}
+        vectors = np.asarray(await generate_embeddings_batch(list(changed.values()), priority=INTERACTIVE),
+                             dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        return dict(zip(changed, vectors))
+
+    async def next_speakers(self, speakers: list, responses: dict) -> list:
+        """Record a finished round and pick the agents for the next one.
+
+        Args:
+            speakers (list): Agents asked to speak this round.
+            responses (dict): Latest response of every agent still in the
+                debate, keyed by agent name.
+
+        Returns:
+            list: Agents to call in the next round; empty when the debate is over.
+        """
+        self.calls += len(speakers)
+        record = {"round": self.round, "agents": list(speakers), "similarity": None}
+        self.history.append(record)
+        if self.round >= self.rounds:
+            self.stop_reason = "max_rounds"
+            return []
+        for agent in speakers:
+            if agent in self._stances and responses.get(agent, {}).get("response") == self._stances[agent][0]:
+                # Repeated itself word for word
+                self.stable.add(agent)
+        try:
+            embedded = await self._embed(responses)
+        except Exception as e:
+            # Without embeddings there is nothing to measure; carry on with everyone
+            print(f"Stance embedding failed, debate continues without early stopping: {str(e)}")
+            self.round += 1
+            return [agent for agent in responses if agent not in self.stable]
+
+        for agent, vector in embedded.items():
+            previous = self._stances.get(agent)
+            if previous is not None and float(previous[1] @ vector) >= self.stability_threshold:
+                self.stable.add(agent)
+            self._stances[agent] = (responses[agent]["response"], vector)
+
+        similarity = mean_pairwise_similarity([self._stances[agent][1] for agent in responses])
+        record["similarity"] = None if similarity is None else round(similarity, 4)
+        if similarity is not None and similarity >= self.convergence_threshold:
+            self.stop_reason = "converged"
+            return []
+        speakers = [agent for agent in responses if agent not in self.stable]
+        if not speakers:
+            self.stop_reason = "stable"
+            return []
+        self.round += 1
+        return speakers
+
+    def summary(self) -> dict:
+        """What the round engine reports alongside the debate result."""
+        return {
+            "rounds_used": self.round,
+            "llm_calls_saved": self.calls_saved,
+            "stop_reason": self.stop_reason,
+            "round_history": self.history,
+        }
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from services.llm_caller import generate_embeddings, generate_embeddings_batch, DEFAULT_EMBEDDING_MODEL
+from services.llm_scheduler import INTERACTIVE
+from services.vector_codec import encode_vector, decode_vector
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "3600"))
+EMBEDDING_CACHE_COLLECTION = os.getenv("EMBEDDING_CACHE_COLLECTION", "")
+EMBEDDING_CACHE_PERSIST_TTL = int(os.getenv("EMBEDDING_CACHE_PERSIST_TTL", str(30 * 24 * 3600)))
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text for cache lookups (case-folded, whitespace collapsed)."""
+    return " ".join(text.split()).casefold()
+
+
+class EmbeddingCache:
+    """Two-tier cache of text embeddings keyed on (model, normalized text).
+
+    Normalization only decides which texts share an entry; the text embedded on
+    a miss is the original one.
+
+    The first tier is an in-process LRU with a TTL and a maximum number of
+    entries. The optional second tier is a MongoDB collection with a TTL index,
+    shared by every backend process.
+    """
+
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_SIZE, ttl_seconds: float = EMBEDDING_CACHE_TTL,
+                 collection=None, persist_ttl_seconds: int = EMBEDDING_CACHE_PERSIST_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_ttl_seconds = persist_ttl_seconds
+        self.collection = None
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, list]]" = OrderedDict()
+        self._index_ready = False
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        if collection is not None:
+            self.attach_collection(collection)
+
+    def attach_collection(self, collection) -> None:
+        """Enable the persistent tier on the given motor collection."""
+        self.collection = collection
+        self._index_ready = False
+
+    @staticmethod
+    def _persistent_id(key: Tuple[str, str]) -> str:
+        return hashlib.sha256("\0".join(key).encode("utf-8")).hexdigest()
+
+    def _get_local(self, key: Tuple[str, str]) -> Optional[list]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, embedding = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return embedding
+
+    def _put_local(self, key: Tuple[str, str], embedding: list) -> None:
+        self._entries[key] = (time.monotonic(), embedding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _ensure_index(self) -> None:
+        if self._index_ready:
+            return
+        await self.collection.create_index("created_at", expireAfterSeconds=self.persist_ttl_seconds)
+        self._index_ready = True
+
+    async def _get_persistent(self, key: Tuple[str, str]) -> Optional[list]:
+        if self.collection is None:
+            return None
+        try:
+            doc = await self.collection.find_one({"_id": self._persistent_id(key)}, {"embedding": 1})
+        except Exception as e:
+            print(f"Embedding cache lookup failed: {str(e)}")
+            return None
+        return decode_vector(doc["embedding"]) if doc else None
+
+    async def _put_persistent(self, key: Tuple[str, str], embedding: list) -> None:
+        if self.collection is None:
+            return
+        try:
+            await self._ensure_index()
+            await self.collection.replace_one(
+                {"_id": self._persistent_id(key)},
+                {"model": key[0], "text": key[1], "embedding": encode_vector(embedding, "float32"),
+                 "created_at": datetime.now(timezone.utc)},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Embedding cache write failed: {str(e)}")
+
+    async def get_or_embed(self, text: str, model: str = DEFAULT_EMBEDDING_MODEL) -> list:
+        """Return the embedding for `text`, computing it only on a cache miss.
+
+        Args:
+            text (str): Text to embed.
+            model (str): Embedding model name.
+
+        Returns:
+            list: The embedding vector.
+        """
+        key = (model, normalize_text(text))
+        embedding = self._get_local(key)
+        if embedding is not None:
+            self.hits += 1
+            return embedding
+
+        embedding = await self._get_persistent(key)
+        if embedding is not None:
+            self.persistent_hits += 1
+            self._put_local(key, embedding)
+            return embedding
+
+        self.misses += 1
+        embedding = await generate_embeddings(text, model)
+        self._put_local(key, embedding)
+        await self._put_persistent(key, embedding)
+        return embedding
+
+    async def get_or_embed_many(self, texts: List[str], model: str = DEFAULT_EMBEDDING_MODEL,
+                                batch_size: int = 64, priority: int = INTERACTIVE) -> List[list]:
+        """Return embeddings for many texts, embedding the misses in batched requests.
+
+        Args:
+            texts (list): Texts to embed.
+            model (str): Embedding model name.
+            batch_size (int): Texts per embeddings request.
+            priority (int): Scheduler priority of the embeddings requests.
+
+        Returns:
+            list: One embedding per text, in input order.
+        """
+        keys = [(model, normalize_text(text)) for text in texts]
+        # The first original text seen for each key is the one embedded
+        originals = {}
+        for key, text in zip(keys, texts):
+            originals.setdefault(key, text)
+        found = {}
+        for key in dict.fromkeys(keys):
+            embedding = self._get_local(key)
+            if embedding is not None:
+                self.hits += 1
+                found[key] = embedding
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing and self.collection is not None:
+            ids = {self._persistent_id(key): key for key in missing}
+            try:
+                async for doc in self.collection.find({"_id": {"$in": list(ids)}}, {"embedding": 1}):
+                    key = ids[doc["_id"]]
+                    found[key] = decode_vector(doc["embedding"])
+                    self.persistent_hits += 1
+                    self._put_local(key, found[key])
+            except Exception as e:
+                print(f"Embedding cache lookup failed: {str(e)}")
+            missing = [key for key in missing if key not in found]
+
+        for start in range(0, len(missing), max(1, batch_size)):
+            batch = missing[start:start + batch_size]
+            embeddings = await generate_embeddings_batch([originals[key] for key in batch], model, priority)
+            self.misses += len(batch)
+            for key, embedding in zip(batch, embeddings):
+                found[key] = embedding
+                self._put_local(key, embedding)
+                await self._put_persistent(key, embedding)
+        return [found[key] for key in keys]
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size of the in-process tier."""
+        lookups = self.hits + self.persistent_hits + self.misses
+        return {
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "persistent": self.collection is not None,
+        }
+
+
+query_embedding_cache = EmbeddingCache()
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, List
+
+from services import mongo_client
+from services.llm_caller import generate_embeddings_batch
+from services.mongo_client import get_field_data, bulk_update_fields
+from services.data_loader import embedding_needed_filter
+from services.vector_codec import EMBEDDING_STORAGE, encode_vector
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+
+
+def _batches(items: List[dict], size: int) -> List[List[dict]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+async def _embed_batch(collection_name: str, field_name: str, batch: List[dict]) -> int:
+    vectors = await generate_embeddings_batch([doc[field_name] for doc in batch])
+    await bulk_update_fields(collection_name, [
+        (doc["_id"], {"embedding": encode_vector(vector, EMBEDDING_STORAGE), "_embedded_hash": doc.get("_text_hash"),
+                      "_embedded_at": datetime.now(timezone.utc)})
+        for doc, vector in zip(batch, vectors)
+    ])
+    return len(batch)
+
+
+async def embed_documents(collection_name: str, field_name: str, documents: List[dict],
+                          batch_size: int = EMBED_BATCH_SIZE, max_concurrency: int = EMBED_MAX_CONCURRENCY) -> int:
+    """Embed the given documents (with `_id`, the field and `_text_hash`) and write the vectors back.
+
+    Returns:
+        int: Number of documents embedded
+    """
+    documents = [doc for doc in documents if doc.get(field_name)]
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def embed_batch(batch: List[dict]) -> int:
+        async with semaphore:
+            return await _embed_batch(collection_name, field_name, batch)
+
+    counts = await asyncio.gather(*[embed_batch(batch) for batch in _batches(documents, max(1, batch_size))])
+    return sum(counts)
+
+
+async def embed_collection(collection_name: str, field_name: str,
+                           batch_size: int = EMBED_BATCH_SIZE,
+                           max_concurrency: int = EMBED_MAX_CONCURRENCY) -> AsyncIterator[dict]:
+    """Embed a text field and write the vectors back in bulk.
+
+    Only documents without a vector, or whose text changed since it was embedded
+    (`_text_hash` differs from `_embedded_hash`), are embedded, so an interrupted
+    run picks up where it stopped. Documents are read from a cursor batch by
+    batch rather than all at once, and texts are sent to the embeddings endpoint
+    in batches of `batch_size`, with at most `max_concurrency` requests in flight.
+    Each batch is written back with a single bulk_write, in the EMBEDDING_STORAGE
+    format.
+
+    Args:
+        collection_name (str): Name of the collection
+        field_name (str): Name of the text field to embed
+        batch_size (int): Number of texts per embeddings request
+        max_concurrency (int): Maximum embeddings requests in flight
+
+    Yields:
+        dict: Progress after each completed batch (done, total, elapsed, docs_per_sec)
+    """
+    query = {"$and": [embedding_needed_filter(), {field_name: {"$nin": [None, ""]}}]}
+    total = await mongo_client.db[collection_name].count_documents(query)
+    start = time.perf_counter()
+    # Documents are read batch by batch, with at most `max_concurrency` batches held at a time
+    pending = set()
+    done = 0
+    exhausted = False
+    batches = get_field_data(collection_name, field_name, query, ["_text_hash"], max(1, batch_size))
+    try:
+        while True:
+            while not exhausted and len(pending) < max(1, max_concurrency):
+                batch = await anext(batches, None)
+                if batch is None:
+                    exhausted = True
+                else:
+                    pending.add(asyncio.create_task(_embed_batch(collection_name, field_name, batch)))
+            if not pending:
+                break
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                done += task.result()
+                elapsed = time.perf_counter() - start
+                yield {
+                    "collection": collection_name,
+                    "done": done,
+                    "total": total,
+                    "elapsed": elapsed,
+                    "docs_per_sec": done / elapsed if elapsed > 0 else 0.0,
+                }
+    finally:
+        for task in pending:
+            task.cancel()
+        await batches.aclose()
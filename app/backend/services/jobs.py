@@ -0,0 +1,490 @@
+"""Background jobs backed by a MongoDB work queue.
+
+A job runs in stages, and each stage is split into chunks stored in
+`job_chunks`. Workers claim chunks of a job's current stage under a lease,
+so any number of workers, in any number of processes, share the work; a
+chunk whose worker died is claimed again once its lease expires. When the
+last chunk of a stage is done the job moves to the next stage. Chunks are
+idempotent, so a chunk that runs twice does no harm. Progress, throughput
+and errors are kept on the job document in `jobs`.
+
+The backend runs JOB_WORKERS workers itself. Run more, on this or other
+hosts with the same data files, with (from app/backend):
+
+    python -m services.jobs [--workers 4]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.operations import UpdateOne
+
+from services import mongo_client
+from services.agent_registry import agent_registry
+from services.data_loader import (EMBEDDING_FIELDS, LOAD_CHUNK_SIZE, embedding_needed_filter, ensure_source_key_index,
+                                  file_signature, is_source_file, iter_documents, read_checkpoint, source_collection,
+                                  source_is_array, upsert_documents, write_checkpoint)
+from services.embedding_pipeline import embed_documents
+from services.rollups import try_refresh_sales_rollups
+
+JOBS_COLLECTION = os.getenv("JOBS_COLLECTION", "jobs")
+JOB_CHUNKS_COLLECTION = os.getenv("JOB_CHUNKS_COLLECTION", "job_chunks")
+# Workers started by the backend process; 0 leaves the work to standalone workers
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+# Claims of a chunk (its own failures and expired leases) before the job fails
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Documents per embedding chunk
+JOB_EMBED_CHUNK_SIZE = int(os.getenv("JOB_EMBED_CHUNK_SIZE", "256"))
+# Errors kept on a job document
+JOB_MAX_ERRORS = 20
+# Chunks enqueued per bulk write while planning a stage
+JOB_ENQUEUE_BATCH = 1000
+
+LOAD_STAGES = ["plan", "load", "prepare_embed", "embed"]
+# Job counter of the documents each stage has processed, for its throughput
+STAGE_COUNTERS = {"load": "loaded", "embed": "embedded"}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _jobs():
+    return mongo_client.db[JOBS_COLLECTION]
+
+
+def _chunks():
+    return mongo_client.db[JOB_CHUNKS_COLLECTION]
+
+
+async def ensure_indexes() -> None:
+    await _chunks().create_index([("job_id", 1), ("stage", 1), ("status", 1)])
+    await _chunks().create_index([("status", 1), ("lease_until", 1)])
+    await _jobs().create_index([("status", 1)])
+
+
+async def _enqueue(job_id: str, stage: int, chunk_type: str, payloads: List[dict]) -> None:
+    """Add chunks to a stage. Chunk ids are derived from their keys, so enqueueing again is a no-op."""
+    if not payloads:
+        return
+    now = _now()
+    await _chunks().bulk_write([
+        UpdateOne({"_id": f"{job_id}:{chunk_type}:{payload['key']}"}, {"$setOnInsert": {
+            "job_id": job_id, "stage": stage, "type": chunk_type, "payload": payload,
+            "status": "pending", "attempts": 0, "created_at": now,
+        }}, upsert=True)
+        for payload in payloads
+    ], ordered=False)
+
+
+async def create_load_job(directory: str) -> dict:
+    """Create a job loading every source file (JSON, NDJSON, gzipped) in `directory`, then embedding what changed.
+
+    Returns:
+        dict: The new job document.
+    """
+    files = sorted(f for f in os.listdir(directory) if is_source_file(f))
+    now = _now()
+    job = {
+        "_id": uuid.uuid4().hex,
+        "kind": "load",
+        "status": "running",
+        "stage": 0,
+        "stages": LOAD_STAGES,
+        "files": [{"collection": source_collection(f), "path": os.path.abspath(os.path.join(directory, f))}
+                  for f in files],
+        "progress": {},
+        "loaded": 0,
+        "embedded": 0,
+        "errors": [],
+        "created_at": now,
+        "updated_at": now,
+        "started_at": None,
+        "stage_started_at": None,
+        "finished_at": None,
+    }
+    await _jobs().insert_one(job)
+    await _enqueue(job["_id"], 0, "plan", [{"key": "all"}])
+    return job
+
+
+async def get_job(job_id: str) -> Optional[dict]:
+    """The job document with chunk counts per stage and the current stage's throughput, or None if there is no
+    such job."""
+    job = await _jobs().find_one({"_id": job_id})
+    if job is None:
+        return None
+    counts = await _chunks().aggregate([
+        {"$match": {"job_id": job_id}},
+        {"$group": {"_id": {"stage": "$stage", "status": "$status"}, "count": {"$sum": 1}}},
+    ]).to_list(length=None)
+    chunks = {name: {} for name in job["stages"]}
+    for count in counts:
+        chunks[job["stages"][count["_id"]["stage"]]][count["_id"]["status"]] = count["count"]
+    job["chunks"] = chunks
+    job["current_stage"] = job["stages"][min(job["stage"], len(job["stages"]) - 1)]
+    finished = job.get("finished_at")
+    end = finished.replace(tzinfo=finished.tzinfo or timezone.utc) if finished else _now()
+
+    def since(start: Optional[datetime]) -> Optional[float]:
+        return (end - start.replace(tzinfo=start.tzinfo or timezone.utc)).total_seconds() if start else None
+
+    job["elapsed_seconds"] = since(job.get("started_at"))
+    stage_elapsed = since(job.get("stage_started_at") or job.get("started_at"))
+    counter = STAGE_COUNTERS.get(job["current_stage"])
+    job["docs_per_sec"] = job.get(counter, 0) / stage_elapsed if counter and stage_elapsed else 0.0
+    return job
+
+
+async def cancel_job(job_id: str) -> Optional[dict]:
+    """Stop a running job. Chunks already in flight finish but are not counted."""
+    now = _now()
+    cancelled = await _jobs().update_one({"_id": job_id, "status": "running"},
+                                         {"$set": {"status": "cancelled", "finished_at": now, "updated_at": now}})
+    if cancelled.modified_count:
+        await _chunks().update_many({"job_id": job_id, "status": {"$in": ["pending", "leased"]}},
+                                    {"$set": {"status": "cancelled"}})
+    return await get_job(job_id)
+
+
+async def resume_job(job_id: str) -> Optional[dict]:
+    """Restart a failed or cancelled job from where it stopped."""
+    now = _now()
+    resumed = await _jobs().update_one({"_id": job_id, "status": {"$in": ["failed", "cancelled"]}},
+                                       {"$set": {"status": "running", "finished_at": None, "updated_at": now}})
+    if resumed.modified_count:
+        await _chunks().update_many({"job_id": job_id, "status": {"$in": ["failed", "cancelled"]}},
+                                    {"$set": {"status": "pending", "attempts": 0}})
+        await advance(job_id)
+    return await get_job(job_id)
+
+
+async def _record_error(job_id: str, error: dict) -> None:
+    await _jobs().update_one({"_id": job_id}, {"$push": {"errors": {"$each": [error], "$slice": -JOB_MAX_ERRORS}},
+                                               "$set": {"updated_at": _now()}})
+
+
+async def advance(job_id: str) -> None:
+    """Move a running job past every stage whose chunks are all done."""
+    while True:
+        job = await _jobs().find_one({"_id": job_id, "status": "running"}, {"stage": 1, "stages": 1})
+        if job is None or job["stage"] >= len(job["stages"]):
+            return
+        if await _chunks().count_documents({"job_id": job_id, "stage": job["stage"], "status": {"$ne": "done"}}):
+            return
+        now = _now()
+        update = {"stage": job["stage"] + 1, "updated_at": now}
+        if job["stage"] + 1 < len(job["stages"]):
+            update["stage_started_at"] = now
+        else:
+            update.update(status="completed", finished_at=now)
+        # Only one worker moves the job on
+        moved = await _jobs().update_one({"_id": job_id, "stage": job["stage"], "status": "running"},
+                                         {"$set": update})
+        if not moved.modified_count:
+            return
+
+
+# Open reader of the last file loaded, so a worker taking the chunks of a file
+# in order continues parsing where the previous chunk stopped
+_reader = {"key": None, "documents": None, "position": None}
+
+
+def _chunk_documents(payload: dict) -> List[dict]:
+    path, signature = payload["path"], payload["signature"]
+    if file_signature(path) != signature:
+        raise RuntimeError(f"{os.path.basename(path)} changed after the job was planned")
+    key = (path, payload["collection"], signature["size"], signature["mtime_ns"])
+    if _reader["key"] != key or _reader["position"] != payload["start"]:
+        if _reader["documents"] is not None:
+            _reader["documents"].close()
+        # Seeks straight to the chunk's first document
+        _reader.update(key=key, position=payload["start"], documents=iter_documents(
+            path, payload["collection"], payload["offset"], payload["array"]))
+    count = payload["end"] - payload["start"]
+    try:
+        documents = [doc for _, doc in itertools.islice(_reader["documents"], count)]
+    except Exception:
+        _reader["key"] = None
+        raise
+    _reader["position"] += len(documents)
+    if len(documents) != count:
+        _reader["key"] = None
+        raise RuntimeError(f"{os.path.basename(path)} ended after {_reader['position']} documents")
+    return documents
+
+
+async def _plan_file(job: dict, collection: str, path: str, signature: dict) -> int:
+    """Stream a file once, enqueueing a load chunk, with its byte offset, every LOAD_CHUNK_SIZE documents."""
+    in_array = source_is_array(path)
+    payloads = []
+    total = 0
+    for position, (offset, _) in enumerate(iter_documents(path, collection)):
+        total = position + 1
+        if position % LOAD_CHUNK_SIZE == 0:
+            # Parsing is synchronous; let the lease renewal run on a large file
+            await asyncio.sleep(0)
+            payloads.append({"key": f"{collection}:{position}", "collection": collection, "path": path,
+                             "signature": signature, "array": in_array, "offset": offset, "start": position})
+        if len(payloads) > JOB_ENQUEUE_BATCH:
+            await _enqueue(job["_id"], 1, "load", [{**payload, "end": payload["start"] + LOAD_CHUNK_SIZE}
+                                                   for payload in payloads[:-1]])
+            payloads = payloads[-1:]
+    await _enqueue(job["_id"], 1, "load", [{**payload, "end": min(payload["start"] + LOAD_CHUNK_SIZE, total)}
+                                           for payload in payloads])
+    if file_signature(path) != signature:
+        raise RuntimeError(f"{os.path.basename(path)} changed while the job was planned")
+    return total
+
+
+async def _plan(job: dict, chunk: dict) -> dict:
+    """Split each changed file into load chunks; files loaded completely before are skipped."""
+    progress = {}
+    for file in job["files"]:
+        collection, path = file["collection"], file["path"]
+        signature = file_signature(path)
+        checkpoint = await read_checkpoint(collection)
+        if checkpoint.get("signature") == signature and checkpoint.get("status") == "complete":
+            progress[f"progress.{collection}"] = {"skipped": True, "total": checkpoint["position"]}
+            continue
+        await ensure_source_key_index(collection)
+        total = await _plan_file(job, collection, path, signature)
+        # The signature the chunks were planned from is the one checkpointed once they are loaded
+        progress[f"progress.{collection}"] = {"skipped": False, "signature": signature, "total": total, "loaded": 0,
+                                              "inserted": 0, "updated": 0, "unchanged": 0}
+    await _enqueue(job["_id"], 2, "prepare_embed", [{"key": "all"}])
+    if progress:
+        await _jobs().update_one({"_id": job["_id"]}, {"$set": progress})
+    return {}
+
+
+async def _load(job: dict, chunk: dict) -> dict:
+    payload = chunk["payload"]
+    collection = payload["collection"]
+    result = await upsert_documents(collection, _chunk_documents(payload))
+    count = payload["end"] - payload["start"]
+    return {f"progress.{collection}.loaded": count, "loaded": count,
+            **{f"progress.{collection}.{name}": value for name, value in result.items()}}
+
+
+async def _prepare_embed(job: dict, chunk: dict) -> dict:
+    """Finish the loaded collections, then split what needs embedding into chunks."""
+    # Before the checkpoints, and on every load, so a refresh that failed last time is retried
+    await try_refresh_sales_rollups()
+    loaded = [file for file in job["files"] if not job["progress"].get(file["collection"], {}).get("skipped")]
+    for file in loaded:
+        planned = job["progress"][file["collection"]]
+        await write_checkpoint(file["collection"], planned["signature"], planned["total"], "complete")
+    collections = {file["collection"] for file in loaded}
+    if "agents" in collections:
+        agent_registry.invalidate()
+
+    progress = {}
+    for collection, field in EMBEDDING_FIELDS.items():
+        await mongo_client.create_vector_index(collection)
+        cursor = mongo_client.db[collection].find(
+            {"$and": [embedding_needed_filter(), {field: {"$nin": [None, ""]}}]}, {"_id": 1},
+            batch_size=JOB_EMBED_CHUNK_SIZE
+        )
+        payloads = []
+        ids = []
+        to_embed = 0
+        async for doc in cursor:
+            ids.append(doc["_id"])
+            if len(ids) == JOB_EMBED_CHUNK_SIZE:
+                payloads.append({"key": f"{collection}:{to_embed}", "collection": collection, "field": field,
+                                 "ids": ids})
+                to_embed += len(ids)
+                ids = []
+            if len(payloads) == JOB_ENQUEUE_BATCH:
+                await _enqueue(job["_id"], 3, "embed", payloads)
+                payloads = []
+        if ids:
+            payloads.append({"key": f"{collection}:{to_embed}", "collection": collection, "field": field, "ids": ids})
+            to_embed += len(ids)
+        await _enqueue(job["_id"], 3, "embed", payloads)
+        progress[f"progress.{collection}.to_embed"] = to_embed
+        progress[f"progress.{collection}.embedded"] = 0
+    await _jobs().update_one({"_id": job["_id"]}, {"$set": progress})
+    return {}
+
+
+async def _embed(job: dict, chunk: dict) -> dict:
+    payload = chunk["payload"]
+    collection, field = payload["collection"], payload["field"]
+    # Documents embedded since the chunk was planned are skipped
+    documents = await mongo_client.db[collection].find(
+        {"$and": [{"_id": {"$in": payload["ids"]}}, embedding_needed_filter()]}, {field: 1, "_text_hash": 1}
+    ).to_list(length=None)
+    await embed_documents(collection, field, documents)
+    count = len(payload["ids"])
+    return {f"progress.{collection}.embedded": count, "embedded": count}
+
+
+HANDLERS = {"plan": _plan, "load": _load, "prepare_embed": _prepare_embed, "embed": _embed}
+
+
+class JobWorker:
+    """Claims and runs chunks until stopped."""
+
+    def __init__(self, name: str = None):
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.chunks_done = 0
+        self.chunks_failed = 0
+
+    async def claim(self) -> Optional[dict]:
+        """Lease the oldest pending (or abandoned) chunk of a running job's current stage."""
+        running = await _jobs().find({"status": "running"}, {"stage": 1}).to_list(length=None)
+        if not running:
+            return None
+        now = _now()
+        return await _chunks().find_one_and_update(
+            {"$and": [
+                {"$or": [{"job_id": job["_id"], "stage": job["stage"]} for job in running]},
+                {"$or": [{"status": "pending"}, {"status": "leased", "lease_until": {"$lt": now}}]},
+            ]},
+            {"$set": {"status": "leased", "worker": self.name,
+                      "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS)},
+             "$inc": {"attempts": 1}},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _renew_lease(self, chunk: dict) -> None:
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            await _chunks().update_one(
+                {"_id": chunk["_id"], "status": "leased", "attempts": chunk["attempts"]},
+                {"$set": {"lease_until": _now() + timedelta(seconds=JOB_LEASE_SECONDS)}}
+            )
+
+    async def _fail(self, chunk: dict, reason: str) -> None:
+        self.chunks_failed += 1
+        job_id = chunk["job_id"]
+        print(f"Job {job_id} chunk {chunk['_id']} failed (attempt {chunk['attempts']}): {reason}")
+        await _record_error(job_id, {"chunk": chunk["_id"], "attempt": chunk["attempts"], "error": reason,
+                                     "at": _now()})
+        final = chunk["attempts"] >= JOB_MAX_ATTEMPTS
+        await _chunks().update_one({"_id": chunk["_id"], "status": "leased", "attempts": chunk["attempts"]},
+                                   {"$set": {"status": "failed" if final else "pending", "error": reason}})
+        if final:
+            now = _now()
+            await _jobs().update_one({"_id": job_id, "status": "running"},
+                                     {"$set": {"status": "failed", "finished_at": now, "updated_at": now}})
+
+    async def process(self, chunk: dict) -> None:
+        job_id = chunk["job_id"]
+        if chunk["attempts"] > JOB_MAX_ATTEMPTS:
+            # Leased and abandoned too often, e.g. it crashes its worker
+            await self._fail(chunk, "lease expired too many times")
+            return
+        job = await _jobs().find_one({"_id": job_id})
+        if job is None or job["status"] != "running":
+            return
+        if job.get("started_at") is None:
+            now = _now()
+            await _jobs().update_one({"_id": job_id, "started_at": None},
+                                     {"$set": {"started_at": now, "stage_started_at": now}})
+
+        renewal = asyncio.create_task(self._renew_lease(chunk))
+        try:
+            increments = await HANDLERS[chunk["type"]](job, chunk)
+        except Exception as e:
+            await self._fail(chunk, str(e))
+            return
+        finally:
+            renewal.cancel()
+
+        # Counted only by the worker still holding the lease, so a chunk run twice counts once
+        done = await _chunks().update_one(
+            {"_id": chunk["_id"], "status": "leased", "attempts": chunk["attempts"]},
+            {"$set": {"status": "done", "finished_at": _now()}}
+        )
+        if done.modified_count:
+            self.chunks_done += 1
+            update = {"$set": {"updated_at": _now()}}
+            if increments:
+                update["$inc"] = increments
+            await _jobs().update_one({"_id": job_id}, update)
+        await advance(job_id)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                chunk = await self.claim()
+                if chunk is not None:
+                    await self.process(chunk)
+                    continue
+                # Also moves on jobs whose last chunk's worker died before advancing them
+                for job in await _jobs().find({"status": "running"}, {"_id": 1}).to_list(length=None):
+                    await advance(job["_id"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job worker {self.name} error: {str(e)}")
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+
+class JobWorkers:
+    """Worker tasks running in this process."""
+
+    def __init__(self):
+        self.workers = []
+        self._tasks = []
+
+    def start(self, count: int = JOB_WORKERS) -> None:
+        for _ in range(count):
+            worker = JobWorker()
+            self.workers.append(worker)
+            self._tasks.append(asyncio.create_task(worker.run()))
+
+    async def join(self) -> None:
+        await asyncio.gather(*self._tasks)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.workers = []
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self.workers),
+            "chunks_done": sum(worker.chunks_done for worker in self.workers),
+            "chunks_failed": sum(worker.chunks_failed for worker in self.workers),
+        }
+
+
+job_workers = JobWorkers()
+
+
+async def run_workers(count: int) -> None:
+    await mongo_client.connect()
+    await ensure_indexes()
+    job_workers.start(count)
+    print(f"Started {count} job workers")
+    try:
+        await job_workers.join()
+    finally:
+        await job_workers.stop()
+        mongo_client.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=max(1, JOB_WORKERS))
+    args = parser.parse_args()
+    asyncio.run(run_workers(args.workers))
+
+
+if __name__ == "__main__":
+    main()
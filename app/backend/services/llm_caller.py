@@ -1,32 +1,283 @@
+import asyncio
 import httpx
 import os
+import time
+from typing import AsyncIterator
 from together import AsyncTogether, Together
 
+from services.singleflight import SingleFlight
+from services.llm_resilience import llm_resilience, LLM_FALLBACK_MODELS
+from services.llm_scheduler import llm_scheduler, INTERACTIVE, BULK
+from services.metrics import register_label_values
+from services.prompt_builder import estimate_tokens, MAX_COMPLETION_TOKENS
+
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    # HTTP/2 needs the optional h2 package (httpx[http2])
+    _HTTP2_AVAILABLE = False
+
 
 TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
+# Point at any Together/OpenAI-compatible server, e.g. the benchmark stand-in
+TOGETHER_BASE_URL = os.getenv("TOGETHER_BASE_URL") or None
+DEFAULT_EMBEDDING_MODEL = "togethercomputer/m2-bert-80M-32k-retrieval"
+register_label_values(models=[DEFAULT_EMBEDDING_MODEL])
 
-async_client = AsyncTogether(api_key=TOGETHER_API_KEY)
+# HTTP connection pool shared by every LLM and embeddings request
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+# Connections opened by warm_up(); with HTTP/2 one connection multiplexes every request
+LLM_WARM_CONNECTIONS = int(os.getenv("LLM_WARM_CONNECTIONS", "2"))
 
-async def generate_embeddings(text: str, model: str = "togethercomputer/m2-bert-80M-32k-retrieval") -> list:
-    """Generate embeddings for given text using Together AI."""
-    response = await async_client.embeddings.create(
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """A response body that reports when it is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._on_close()
+
+
+class InFlightTransport(httpx.AsyncBaseTransport):
+    """Counts requests from the moment they are sent until their response body is closed."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+
+    def _finished(self) -> None:
+        self.in_flight -= 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._finished()
+            raise
+        closed = False
+
+        def on_close() -> None:
+            nonlocal closed
+            if not closed:
+                closed = True
+                self._finished()
+
+        response.stream = _TrackedStream(response.stream, on_close)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def _create_transport() -> InFlightTransport:
+    return InFlightTransport(httpx.AsyncHTTPTransport(
+        http2=LLM_HTTP2 and _HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+    ))
+
+
+# Created at import for scripts; the backend replaces them in connect() on startup.
+# Retries are left to llm_scheduler, which sees every request.
+transport = _create_transport()
+http_client = httpx.AsyncClient(transport=transport, timeout=LLM_REQUEST_TIMEOUT)
+async_client = AsyncTogether(api_key=TOGETHER_API_KEY, base_url=TOGETHER_BASE_URL, http_client=http_client,
+                             max_retries=0)
+_warm_up = {"ok": False, "latency_ms": None, "error": "not warmed up"}
+
+
+async def connect() -> dict:
+    """Open a fresh client on the running event loop and warm its pool."""
+    global async_client, http_client, transport
+    await async_client.close()
+    transport = _create_transport()
+    http_client = httpx.AsyncClient(transport=transport, timeout=LLM_REQUEST_TIMEOUT)
+    async_client = AsyncTogether(api_key=TOGETHER_API_KEY, base_url=TOGETHER_BASE_URL, http_client=http_client,
+                                 max_retries=0)
+    return await warm_up()
+
+
+async def close() -> None:
+    """Close the client and its pooled connections."""
+    await async_client.close()
+    _warm_up.update({"ok": False, "latency_ms": None, "error": "closed"})
+
+
+async def warm_up(connections: int = LLM_WARM_CONNECTIONS) -> dict:
+    """Open pooled connections to the LLM endpoint (DNS, TCP and TLS handshakes).
+
+    A cheap HEAD request per connection is enough; its status is irrelevant.
+
+    Returns:
+        dict: ok, latency_ms and error (None on success).
+    """
+    start = time.perf_counter()
+    url = str(async_client.base_url)
+    results = await asyncio.gather(
+        *[http_client.head(url) for _ in range(max(1, connections))], return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if len(errors) == len(results):
+        _warm_up.update({"ok": False, "latency_ms": None, "error": str(errors[0])})
+    else:
+        _warm_up.update({"ok": True, "latency_ms": (time.perf_counter() - start) * 1000, "error": None})
+    return dict(_warm_up)
+
+
+def pool_state() -> dict:
+    """Pool settings, requests in flight (see InFlightTransport) and the outcome of the last warm-up."""
+    return {
+        "http2": LLM_HTTP2 and _HTTP2_AVAILABLE,
+        "max_connections": LLM_MAX_CONNECTIONS,
+        "max_keepalive_connections": LLM_MAX_KEEPALIVE_CONNECTIONS,
+        "in_flight": transport.in_flight,
+        "peak_in_flight": transport.peak_in_flight,
+        "requests": transport.requests,
+        "warm_up": dict(_warm_up),
+    }
+
+
+# Identical concurrent embedding requests share one API call
+embedding_flight = SingleFlight()
+
+
+
+async def _generate_embeddings(text: str, model: str) -> list:
+    response = await llm_scheduler.run(model, INTERACTIVE, estimate_tokens(text), lambda: async_client.embeddings.create(
         model=model,
         input=text
-    )
+    ))
     return response.data[0].embedding
 
-async def call_llm(model: str, prompt: str, agent_name: str) -> dict:
-    """Run a single LLM call with a reference model."""
-    response = await async_client.chat.completions.create(
+async def generate_embeddings(text: str, model: str = DEFAULT_EMBEDDING_MODEL) -> list:
+    """Generate embeddings for given text using Together AI."""
+    return await embedding_flight.do((model, text), lambda: _generate_embeddings(text, model))
+
+async def generate_embeddings_batch(texts: list, model: str = DEFAULT_EMBEDDING_MODEL, priority: int = BULK) -> list:
+    """Generate embeddings for a batch of texts in a single Together AI request.
+
+    Args:
+        texts (list): Texts to embed.
+        model (str): Embedding model name.
+        priority (int): Scheduler priority; bulk work is queued behind
+            interactive and summary requests.
+
+    Returns:
+        list: One embedding per input text, in input order.
+    """
+    tokens = sum(estimate_tokens(text) for text in texts)
+    response = await llm_scheduler.run(model, priority, tokens, lambda: async_client.embeddings.create(
         model=model,
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.7,
-        max_tokens=512,
+        input=texts
+    ))
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+async def _complete(model: str, prompt: str, priority: int, timeout: float, on_send):
+    return await llm_scheduler.run(
+        model, priority, estimate_tokens(prompt) + MAX_COMPLETION_TOKENS,
+        lambda: async_client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.7,
+            max_tokens=MAX_COMPLETION_TOKENS,
+        ),
+        timeout,
+        on_send
+    )
+
+async def call_llm(model: str, prompt: str, agent_name: str, priority: int = INTERACTIVE) -> dict:
+    """Run a single LLM call with a reference model.
+
+    The call is queued in the outbound scheduler under `priority`, bounded
+    (queueing and retries included) by the model's timeout, hedged to the
+    model's fallback once it runs past the model's p95 latency, and
+    served by the model's fallback while its circuit is open (see
+    llm_resilience). `model` in the result is the model that actually answered.
+    """
+    response, used_model = await llm_resilience.call(
+        model, lambda name, timeout, on_send: _complete(name, prompt, priority, timeout, on_send)
     )
     
-    print("Response from : ", model, ": " , response)
-    return {
+    print("Response from : ", used_model, ": " , response)
+    result = {
                 "agent": agent_name,
-                "model": model,
+                "model": used_model,
                 "response": response.choices[0].message.content
-            }
\ No newline at end of file
+            }
+    if used_model != model:
+        result["requested_model"] = model
+    return result
+
+async def stream_llm(model: str, prompt: str, priority: int = INTERACTIVE,
+                     retry_on_fallback: bool = True) -> AsyncIterator[str]:
+    """Stream a single LLM call, yielding content deltas as they arrive.
+
+    Streams aren't hedged, but they respect the model's circuit breaker, and
+    the model's timeout bounds the wait for the stream to open (queueing and
+    retries included) and then for each chunk. A stream that fails
+    before its first delta is retried once on the fallback model.
+    """
+    used_model = llm_resilience.choose_model(model)
+    timeout = llm_resilience.timeout(used_model)
+    # Health is measured from when the stream is sent, not while it waits in the scheduler
+    sent_at = [time.perf_counter()]
+    received = False
+    try:
+        stream = await llm_scheduler.run(
+            used_model, priority, estimate_tokens(prompt) + MAX_COMPLETION_TOKENS,
+            lambda: async_client.chat.completions.create(
+                model=used_model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                max_tokens=MAX_COMPLETION_TOKENS,
+                stream=True,
+            ),
+            timeout,
+            lambda: sent_at.append(time.perf_counter())
+        )
+        chunks = stream.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+            except StopAsyncIteration:
+                break
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                received = True
+                yield chunk.choices[0].delta.content
+    except (asyncio.CancelledError, GeneratorExit):
+        # Abandoned by the consumer; says nothing about the model's health
+        llm_resilience.health(used_model).breaker.release()
+        raise
+    except Exception as e:
+        llm_resilience.record(used_model, time.perf_counter() - sent_at[-1], e)
+        fallback = LLM_FALLBACK_MODELS.get(used_model)
+        if received or not retry_on_fallback or used_model != model or not fallback:
+            raise
+        print(f"Stream from {used_model} failed, retrying on {fallback}: {str(e)}")
+        async for delta in stream_llm(fallback, prompt, priority, retry_on_fallback=False):
+            yield delta
+        return
+    llm_resilience.record(used_model, time.perf_counter() - sent_at[-1])
@@ -0,0 +1,280 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from together import RateLimitError
+
+from services.llm_scheduler import QueueTimeoutError
+from services.metrics import register_label_values
+
+# Per-call deadline; per-model overrides, e.g. {"meta-llama/Llama-3.3-70B-Instruct-Turbo": 45}
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MODEL_TIMEOUTS = json.loads(os.getenv("LLM_MODEL_TIMEOUTS", "{}"))
+# Model that takes over (hedges, or replaces an open circuit) for a model, e.g. {"model-a": "model-b"}
+LLM_FALLBACK_MODELS = json.loads(os.getenv("LLM_FALLBACK_MODELS", "{}"))
+register_label_values(models=[*LLM_MODEL_TIMEOUTS, *LLM_FALLBACK_MODELS, *LLM_FALLBACK_MODELS.values()])
+# A hedge is sent to the fallback once a call has run past the model's observed latency percentile
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+# Consecutive failures that open a model's circuit, and how long it stays open
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when a model's circuit is open and no fallback is available."""
+
+
+class CircuitBreaker:
+    """Stops traffic to a model after consecutive failures.
+
+    Closed: calls flow. After `failure_threshold` consecutive failures the
+    circuit opens and calls are refused for `reset_seconds`; then it is half
+    open and lets a single trial call through, which closes it on success or
+    opens it again on failure.
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES,
+                 reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """A call let through was abandoned without an outcome."""
+        self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+
+
+class ModelHealth:
+    """Recent latencies, breaker and counters for one model."""
+
+    def __init__(self, window: int = LLM_LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.breaker = CircuitBreaker()
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.queue_timeouts = 0
+        self.rate_limited = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self.latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def stats(self) -> dict:
+        p95 = self.percentile(95)
+        return {
+            "state": self.breaker.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "queue_timeouts": self.queue_timeouts,
+            "rate_limited": self.rate_limited,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "fallbacks": self.fallbacks,
+            "times_opened": self.breaker.times_opened,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+        }
+
+
+class ResilientCaller:
+    """Runs LLM calls with per-model timeouts, hedging, fallbacks and circuit breakers."""
+
+    def __init__(self):
+        self.models = {}
+
+    def health(self, model: str) -> ModelHealth:
+        if model not in self.models:
+            self.models[model] = ModelHealth()
+        return self.models[model]
+
+    @staticmethod
+    def timeout(model: str) -> float:
+        return float(LLM_MODEL_TIMEOUTS.get(model, LLM_TIMEOUT))
+
+    def choose_model(self, model: str) -> str:
+        """`model`, or its fallback while `model`'s circuit is open.
+
+        Raises:
+            CircuitOpenError: If neither can take the call.
+        """
+        if self.health(model).breaker.allow():
+            return model
+        fallback = self.fallback(model)
+        if fallback:
+            self.health(model).fallbacks += 1
+            return fallback
+        raise CircuitOpenError(f"Circuit open for {model} and no fallback is available")
+
+    def fallback(self, model: str) -> Optional[str]:
+        """`model`'s configured fallback, if it can take a call now."""
+        fallback = LLM_FALLBACK_MODELS.get(model)
+        if fallback and self.health(fallback).breaker.allow():
+            return fallback
+        return None
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        if not LLM_HEDGE_ENABLED:
+            return None
+        observed = self.health(model).percentile(LLM_HEDGE_PERCENTILE)
+        return None if observed is None else max(LLM_HEDGE_MIN_DELAY, observed)
+
+    def record(self, model: str, seconds: float, error: BaseException = None) -> None:
+        """Record a call's outcome; `seconds` counts from when it was sent.
+
+        Timeouts while still queued here and 429s come from our own load or the
+        account's limits, not from the model, so they don't count against its
+        circuit.
+        """
+        health = self.health(model)
+        health.calls += 1
+        if isinstance(error, (QueueTimeoutError, RateLimitError)):
+            if isinstance(error, QueueTimeoutError):
+                health.queue_timeouts += 1
+            else:
+                health.rate_limited += 1
+            health.breaker.release()
+            return
+        if error is None:
+            health.latencies.append(seconds)
+            health.breaker.record_success()
+            return
+        health.failures += 1
+        if isinstance(error, asyncio.TimeoutError):
+            health.timeouts += 1
+        health.breaker.record_failure()
+
+    async def _attempt(self, model: str, call: Callable[[str, float, Callable[[], None]], Awaitable],
+                       deadline: float, sent: asyncio.Event = None):
+        sent_at = [time.perf_counter()]
+
+        def on_send() -> None:
+            # The latency clock restarts with every attempt the scheduler sends
+            sent_at.append(time.perf_counter())
+            if sent is not None:
+                sent.set()
+
+        try:
+            result = await call(model, max(0.0, deadline - time.monotonic()), on_send)
+        except asyncio.CancelledError:
+            # A losing hedge; it says nothing about the model's health
+            self.health(model).breaker.release()
+            raise
+        except Exception as e:
+            self.record(model, time.perf_counter() - sent_at[-1], e)
+            raise
+        self.record(model, time.perf_counter() - sent_at[-1])
+        return result
+
+    async def call(self, model: str, call: Callable[[str, float, Callable[[], None]], Awaitable]) -> tuple:
+        """Run `call(model_name, timeout, on_send)` resiliently.
+
+        The call goes to `model`, or its fallback while `model`'s circuit is
+        open, with one deadline (the model's timeout) for everything it does.
+        If it is still running past the model's observed p95 latency, counted
+        from when it was sent rather than queued, and a healthy fallback is
+        configured, a hedge is sent to the fallback and the first success wins.
+        A slow model is never sent a duplicate.
+
+        Args:
+            model (str): The requested model.
+            call: Makes the request to the given model within the given
+                seconds, time spent queued and retrying included, calling
+                `on_send` whenever an attempt is sent.
+
+        Returns:
+            tuple: (result, model that produced it)
+        """
+        primary = self.choose_model(model)
+        deadline = time.monotonic() + self.timeout(primary)
+        sent = asyncio.Event()
+        first = asyncio.ensure_future(self._attempt(primary, call, deadline, sent))
+        attempts = {first: primary}
+        try:
+            delay = self.hedge_delay(primary)
+            if delay is not None and LLM_FALLBACK_MODELS.get(primary):
+                # Time waiting in our own queue doesn't count towards the hedge delay
+                sending = asyncio.ensure_future(sent.wait())
+                await asyncio.wait([first, sending], return_when=asyncio.FIRST_COMPLETED)
+                sending.cancel()
+                done, _ = await asyncio.wait([first], timeout=delay)
+                hedge = None if done else self.fallback(primary)
+                if hedge is not None:
+                    self.health(primary).hedges += 1
+                    attempts[asyncio.ensure_future(self._attempt(hedge, call, deadline))] = hedge
+
+            pending = set(attempts)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(attempts) > 1 and task is not next(iter(attempts)):
+                            self.health(primary).hedge_wins += 1
+                        return task.result(), attempts[task]
+                    error = task.exception()
+            raise error
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {model: health.stats() for model, health in self.models.items()}
+
+    def totals(self) -> dict:
+        """Counters summed over every model, for metrics."""
+        totals = {}
+        for health in self.models.values():
+            for key, value in health.stats().items():
+                if isinstance(value, int):
+                    totals[key] = totals.get(key, 0) + value
+        totals["open_circuits"] = sum(1 for health in self.models.values() if health.breaker.state == "open")
+        return totals
+
+
+llm_resilience = ResilientCaller()
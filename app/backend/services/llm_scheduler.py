@@ -0,0 +1,270 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional
+
+from together import APIConnectionError, InternalServerError, RateLimitError
+
+from services.metrics import LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT_SECONDS, label_value, register_label_values
+
+# Priority classes, most urgent first
+INTERACTIVE = 0
+SUMMARY = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", SUMMARY: "summary", BULK: "bulk"}
+
+# Limits of the whole Together account, shared by every model. 0 means unlimited.
+LLM_ACCOUNT_RPM = float(os.getenv("LLM_ACCOUNT_RPM", "0"))
+LLM_ACCOUNT_TPM = float(os.getenv("LLM_ACCOUNT_TPM", "0"))
+# Per-model limits, e.g. {"meta-llama/Llama-3.3-70B-Instruct-Turbo": {"rpm": 600, "tpm": 180000}};
+# models not listed, and limits left out or set to 0, are unlimited.
+LLM_RATE_LIMITS = json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))
+register_label_values(models=LLM_RATE_LIMITS)
+# Seconds of traffic a bucket can absorb in a burst
+LLM_BUCKET_BURST_SECONDS = float(os.getenv("LLM_BUCKET_BURST_SECONDS", "10"))
+# Retries of 429s and transient errors, and the backoff used without a Retry-After header
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+
+
+class QueueTimeoutError(asyncio.TimeoutError):
+    """The deadline passed while the request was still waiting to be sent."""
+
+
+class TokenBucket:
+    """Refills at `per_minute / 60` units a second, holding up to `burst_seconds` of them.
+
+    A request larger than the bucket is let through once the bucket is full,
+    leaving it in debt, so oversized requests are slowed rather than refused.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = LLM_BUCKET_BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be taken (0 if it can be taken now)."""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed / self.rate)
+
+    def take(self, amount: float) -> None:
+        if not self.unlimited:
+            self._refill()
+            self.level -= amount
+
+
+class _Lane:
+    """Rate limit state for one model."""
+
+    def __init__(self, model: str):
+        limits = LLM_RATE_LIMITS.get(model, {})
+        self.requests = TokenBucket(float(limits.get("rpm", 0)))
+        self.tokens = TokenBucket(float(limits.get("tpm", 0)))
+        self.granted = 0
+        self.rate_limited = 0
+
+
+class LLMScheduler:
+    """Central scheduler for every outbound Together request.
+
+    Requests to every model wait in one priority queue (interactive before
+    summary before bulk embedding, first come first served within a class) and
+    are released when the account's request and token buckets, and then the
+    model's own, allow. The account's capacity always goes to the most urgent
+    request, so bulk embedding gives way to chat calls whatever model they use;
+    a request held back only by its model's limit lets the ones behind it
+    through. A 429 pauses the whole account for its Retry-After (or an
+    exponential backoff) and the request is queued again; connection errors
+    and 5xx responses are retried with backoff. The Together client's own
+    retries are disabled, so every retry goes through here.
+    """
+
+    def __init__(self):
+        self.lanes = {}
+        self.requests = TokenBucket(LLM_ACCOUNT_RPM)
+        self.tokens = TokenBucket(LLM_ACCOUNT_TPM)
+        self.blocked_until = 0.0
+        self.waiters = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sequence = itertools.count()
+        self.retries = 0
+        self.waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.wait_seconds = {name: 0.0 for name in PRIORITY_NAMES.values()}
+
+    def lane(self, model: str) -> _Lane:
+        if model not in self.lanes:
+            self.lanes[model] = _Lane(model)
+        return self.lanes[model]
+
+    def _pump(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.waiters.sort()
+        delays = []
+        for waiter in list(self.waiters):
+            _, _, model, tokens, future = waiter
+            if future.done():
+                # Cancelled while waiting
+                self.waiters.remove(waiter)
+                continue
+            delay = max(self.blocked_until - time.monotonic(), self.requests.wait_time(1),
+                        self.tokens.wait_time(tokens))
+            if delay > 0:
+                # Nothing less urgent may take the account's capacity first
+                delays.append(delay)
+                break
+            lane = self.lane(model)
+            delay = max(lane.requests.wait_time(1), lane.tokens.wait_time(tokens))
+            if delay > 0:
+                delays.append(delay)
+                continue
+            self.waiters.remove(waiter)
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens), (lane.requests, 1),
+                                   (lane.tokens, tokens)):
+                bucket.take(amount)
+            lane.granted += 1
+            future.set_result(None)
+        if delays:
+            self._timer = asyncio.get_running_loop().call_later(min(delays), self._pump)
+
+    async def acquire(self, model: str, priority: int = INTERACTIVE, tokens: int = 0) -> None:
+        """Wait for a slot to send one request of about `tokens` tokens to `model`."""
+        name = PRIORITY_NAMES[priority]
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((priority, next(self._sequence), model, tokens, future))
+        self.waiting[name] += 1
+        LLM_QUEUE_DEPTH.labels(priority=name).inc()
+        start = time.perf_counter()
+        try:
+            self._pump()
+            await future
+        finally:
+            if not future.done():
+                future.cancel()
+                # Let whoever was queued behind this request move up
+                self._pump()
+            self.waiting[name] -= 1
+            LLM_QUEUE_DEPTH.labels(priority=name).dec()
+            waited = time.perf_counter() - start
+            self.wait_seconds[name] += waited
+            LLM_QUEUE_WAIT_SECONDS.labels(priority=name, model=label_value("model", model)).observe(waited)
+
+    @staticmethod
+    def _retry_after(error: RateLimitError, attempt: int) -> float:
+        value = error.response.headers.get("retry-after") if error.response is not None else None
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                try:
+                    return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+        return min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1)
+
+    async def run(self, model: str, priority: int, tokens: int, fn: Callable[[], Awaitable],
+                  timeout: Optional[float] = None, on_send: Callable[[], None] = None):
+        """Send a request through the scheduler.
+
+        Args:
+            model (str): Model the request goes to, for its own limits.
+            priority (int): INTERACTIVE, SUMMARY or BULK.
+            tokens (int): Estimated tokens the request consumes.
+            fn: Sends the request.
+            timeout (float): Deadline for the whole request: time queued, every
+                attempt and the pauses between them. Each attempt gets whatever
+                is left of it.
+            on_send: Called each time an attempt leaves the queue and is sent.
+
+        Returns:
+            The request's result.
+
+        Raises:
+            QueueTimeoutError: If the deadline passes before an attempt is sent.
+            asyncio.TimeoutError: If it passes while an attempt is in flight.
+        """
+        lane = self.lane(model)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining() -> Optional[float]:
+            if deadline is None:
+                return None
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise asyncio.TimeoutError()
+            return left
+
+        for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+            try:
+                await asyncio.wait_for(self.acquire(model, priority, tokens), remaining())
+                left = remaining()
+            except asyncio.TimeoutError:
+                raise QueueTimeoutError(f"Timed out waiting to send a request to {model}")
+            if on_send is not None:
+                on_send()
+            try:
+                return await asyncio.wait_for(fn(), left)
+            except RateLimitError as e:
+                lane.rate_limited += 1
+                pause = self._retry_after(e, attempt)
+                # Every request on the account waits out the pause, not just this one
+                self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+                if attempt == LLM_RATE_LIMIT_RETRIES or (deadline is not None
+                                                         and time.monotonic() + pause >= deadline):
+                    raise
+                self.retries += 1
+                print(f"Rate limited by {model}, retrying in {pause:.1f}s")
+            except (APIConnectionError, InternalServerError) as e:
+                pause = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1)
+                if attempt == LLM_RATE_LIMIT_RETRIES or (deadline is not None
+                                                         and time.monotonic() + pause >= deadline):
+                    raise
+                self.retries += 1
+                print(f"Request to {model} failed ({str(e)}), retrying in {pause:.1f}s")
+                await asyncio.sleep(pause)
+
+    def stats(self) -> dict:
+        return {
+            "waiting": dict(self.waiting),
+            "wait_seconds": {name: round(seconds, 3) for name, seconds in self.wait_seconds.items()},
+            "retries": self.retries,
+            "queued": len(self.waiters),
+            "paused_seconds": round(max(0.0, self.blocked_until - time.monotonic()), 3),
+            "models": {
+                model: {"granted": lane.granted, "rate_limited": lane.rate_limited,
+                        "queued": sum(1 for waiter in self.waiters if waiter[2] == model)}
+                for model, lane in self.lanes.items()
+            },
+        }
+
+    def totals(self) -> dict:
+        """Flat counters, for metrics."""
+        return {
+            "retries": self.retries,
+            "granted": sum(lane.granted for lane in self.lanes.values()),
+            "rate_limited": sum(lane.rate_limited for lane in self.lanes.values()),
+            "waiting": sum(self.waiting.values()),
+        }
+
+
+llm_scheduler = LLMScheduler()
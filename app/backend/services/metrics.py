@@ -0,0 +1,106 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable
+
+from prometheus_client import Gauge, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+# Models and collections reported as metric labels, on top of those the backend is configured with
+# (see register_label_values). Anything else a request names is reported as "other", so clients
+# can't create unbounded series.
+METRIC_MODELS = json.loads(os.getenv("METRIC_MODELS", json.dumps([
+    "meta-llama/Llama-3.3-70B-Instruct-Turbo",
+    "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
+    "Qwen/Qwen2.5-72B-Instruct-Turbo",
+    "mistralai/Mixtral-8x7B-Instruct-v0.1",
+])))
+METRIC_COLLECTIONS = json.loads(os.getenv("METRIC_COLLECTIONS", "[]"))
+
+_label_values = {"model": set(METRIC_MODELS), "collection": set(METRIC_COLLECTIONS)}
+
+
+def register_label_values(models: Iterable[str] = (), collections: Iterable[str] = ()) -> None:
+    """Allow these models and collections as metric label values."""
+    _label_values["model"].update(models)
+    _label_values["collection"].update(collections)
+
+
+def label_value(kind: str, value: str) -> str:
+    """`value` if it is a known `kind` ("model" or "collection") or empty, "other" if not."""
+    return value if not value or value in _label_values[kind] else "other"
+
+
+STAGE_SECONDS = Histogram(
+    "maap_stage_duration_seconds",
+    "Duration of backend pipeline stages.",
+    ["stage", "collection", "model"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160),
+)
+
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "maap_llm_queue_wait_seconds",
+    "Time LLM requests waited in the outbound scheduler.",
+    ["priority", "model"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+
+LLM_QUEUE_DEPTH = Gauge(
+    "maap_llm_queue_depth",
+    "LLM requests waiting in the outbound scheduler.",
+    ["priority"],
+)
+
+
+class StageTimings:
+    """Per-request record of stage durations, also observed into STAGE_SECONDS."""
+
+    def __init__(self):
+        self.spans = []
+
+    @contextmanager
+    def stage(self, stage: str, collection: str = "", model: str = ""):
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start, collection, model, status)
+
+    def record(self, stage: str, seconds: float, collection: str = "", model: str = "", status: str = "ok") -> None:
+        STAGE_SECONDS.labels(stage=stage, collection=label_value("collection", collection),
+                             model=label_value("model", model)).observe(seconds)
+        span = {"stage": stage, "seconds": round(seconds, 4), "status": status}
+        if collection:
+            span["collection"] = collection
+        if model:
+            span["model"] = model
+        self.spans.append(span)
+
+    def as_list(self) -> list:
+        return list(self.spans)
+
+
+class StatsCollector:
+    """Exposes numeric fields of registered `stats()` providers as gauges."""
+
+    def __init__(self):
+        self._providers: Dict[str, Callable[[], dict]] = {}
+
+    def register(self, name: str, provider: Callable[[], dict]) -> None:
+        self._providers[name] = provider
+
+    def collect(self):
+        for name, provider in self._providers.items():
+            for key, value in provider().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                yield GaugeMetricFamily(f"maap_{name}_{key}", f"{name} {key.replace('_', ' ')}.", value=value)
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
@@ -0,0 +1,76 @@
+"""Convert stored embeddings to another storage format in place.
+
+Usage (from app/backend):
+
+    python -m services.migrate_vectors [--storage int8] [collection ...]
+
+Collections default to those with embeddings (see data_loader.EMBEDDING_FIELDS)
+and the format to EMBEDDING_STORAGE. Run the backend with the same
+EMBEDDING_STORAGE afterwards, so query vectors are encoded to match.
+"""
+import argparse
+import asyncio
+from datetime import datetime, timezone
+
+from services import mongo_client
+from services.data_loader import EMBEDDING_FIELDS
+from services.vector_codec import EMBEDDING_STORAGE, STORAGE_FORMATS, encode_vector, storage_format
+
+MIGRATION_BATCH_SIZE = 500
+
+# Converting from a lossy format to a more precise one can't restore the lost
+# precision; re-embed the collection instead.
+_PRECISION = {"bit": 0, "int8": 1, "float32": 2, "array": 2}
+
+
+async def migrate_collection(collection_name: str, storage: str, batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """Re-encode every embedding in a collection that isn't in `storage` format.
+
+    Args:
+        collection_name (str): Name of the collection
+        storage (str): Target storage format
+        batch_size (int): Documents per bulk write
+
+    Returns:
+        int: Number of documents converted
+    """
+    collection = mongo_client.db[collection_name]
+    converted, lossy, batch = 0, 0, []
+    cursor = collection.find({"embedding": {"$exists": True}}, {"embedding": 1}).batch_size(batch_size)
+    async for doc in cursor:
+        current = storage_format(doc["embedding"])
+        if current == storage:
+            continue
+        if _PRECISION[current] < _PRECISION[storage]:
+            lossy += 1
+        # A new _embedded_at, so local vector indexes re-read the converted vector
+        batch.append((doc["_id"], {"embedding": encode_vector(doc["embedding"], storage),
+                                   "_embedded_at": datetime.now(timezone.utc)}))
+        if len(batch) >= batch_size:
+            converted += await mongo_client.bulk_update_fields(collection_name, batch)
+            batch = []
+    converted += await mongo_client.bulk_update_fields(collection_name, batch)
+    if lossy:
+        print(f"Warning: {lossy} vectors in {collection_name} were quantized; "
+              f"converting them to {storage} does not restore precision. Re-embed to recover it.")
+    return converted
+
+
+async def migrate(collections: list, storage: str) -> None:
+    for collection_name in collections:
+        converted = await migrate_collection(collection_name, storage)
+        print(f"Converted {converted} embeddings in {collection_name} to {storage}")
+        if await mongo_client.create_vector_index(collection_name, "embedding", storage):
+            print(f"Vector index on {collection_name} updated for {storage} vectors")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("collections", nargs="*", default=list(EMBEDDING_FIELDS))
+    parser.add_argument("--storage", choices=STORAGE_FORMATS, default=EMBEDDING_STORAGE)
+    args = parser.parse_args()
+    asyncio.run(migrate(args.collections, args.storage))
+
+
+if __name__ == "__main__":
+    main()
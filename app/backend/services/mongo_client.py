@@ -1,63 +1,309 @@
 import motor.motor_asyncio
 from bson.json_util import dumps
+import json
+import math
 import os
-from typing import List
+import time
+from datetime import datetime
+from typing import AsyncIterator, List, Tuple
 from together import AsyncTogether, Together
-from pymongo.operations import SearchIndexModel
+from pymongo import monitoring
+from pymongo.operations import SearchIndexModel, UpdateOne
 from dotenv import load_dotenv
 load_dotenv()
 
-from services.llm_caller import generate_embeddings
+from services.embedding_cache import query_embedding_cache, EMBEDDING_CACHE_COLLECTION
+from services.vector_engine import local_vector_engine
+from services.vector_codec import EMBEDDING_STORAGE, encode_vector, decode_vector, vector_index_field
 
-client = motor.motor_asyncio.AsyncIOMotorClient(os.getenv("MONGODB_URI"))
-db = client[os.getenv("DATABASE_NAME")]
+MONGODB_URI = os.getenv("MONGODB_URI")
+DATABASE_NAME = os.getenv("DATABASE_NAME")
+# Connection pool settings; MONGO_MIN_POOL_SIZE connections are kept open
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+# Documents per cursor batch when streaming a collection
+FIELD_DATA_BATCH_SIZE = int(os.getenv("FIELD_DATA_BATCH_SIZE", "1000"))
 
-async def fetch_context_data(collection: str):
-    """Fetch context data from MongoDB collection."""
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Connection pool usage from the driver's CMAP events: connections open and
+    checked out, checkouts waiting, and the time spent waiting for a connection."""
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _checkout_finished(self, duration: float) -> None:
+        self.waiting -= 1
+        self.wait_seconds += duration or 0.0
+        self.max_wait_seconds = max(self.max_wait_seconds, duration or 0.0)
+
+    def connection_check_out_started(self, event) -> None:
+        self.waiting += 1
+
+    def connection_checked_out(self, event) -> None:
+        self._checkout_finished(event.duration)
+        self.checkouts += 1
+        self.checked_out += 1
+
+    def connection_check_out_failed(self, event) -> None:
+        self._checkout_finished(event.duration)
+        self.checkout_failures += 1
+
+    def connection_checked_in(self, event) -> None:
+        self.checked_out -= 1
+
+    def connection_created(self, event) -> None:
+        self.open += 1
+
+    def connection_closed(self, event) -> None:
+        self.open -= 1
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "open_connections": self.open,
+            "checked_out": self.checked_out,
+            "waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "checkout_failures": self.checkout_failures,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+        }
+
+
+pool_monitor = PoolMonitor()
+
+
+def _create_client() -> motor.motor_asyncio.AsyncIOMotorClient:
+    return motor.motor_asyncio.AsyncIOMotorClient(
+        MONGODB_URI,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        event_listeners=[pool_monitor],
+    )
+
+
+# Created at import for scripts; the backend replaces it in connect() on startup
+client = _create_client()
+db = client[DATABASE_NAME]
+
+# Default vector search engine. "atlas" uses $vectorSearch; "local" uses the
+# in-process NumPy engine, for plain mongod deployments without Atlas Search;
+# "cached" serves from the local engine and falls back to Atlas; "bruteforce"
+# scores every stored vector in Python (benchmarks). Set per collection with
+# the "engine" key of VECTOR_SEARCH_OVERRIDES.
+VECTOR_SEARCH_BACKEND = os.getenv("VECTOR_SEARCH_BACKEND", "atlas")
+
+VECTOR_SEARCH_DEFAULTS = {
+    "engine": VECTOR_SEARCH_BACKEND,
+    "index": "vector_index",
+    "num_candidates": 10,
+    "limit": 2,
+    "fields": ["summary", "feedback"],
+    "filter_fields": {},
+}
+# Per-collection search settings. `filter_fields` maps the logical filter names
+# accepted in requests (date, product, ...) to indexed document fields; they are
+# declared as filter fields in the collection's vector index.
+VECTOR_SEARCH_CONFIG = {
+    "customer_feedback": {
+        "filter_fields": {"date": "created_at", "source": "source", "customer": "customer_id"},
+    },
+    "performance_logs": {
+        "filter_fields": {"date": "date_reported", "product": "feature", "severity": "severity"},
+    },
+}
+# e.g. VECTOR_SEARCH_OVERRIDES='{"performance_logs": {"num_candidates": 100, "limit": 5}}'
+for _collection, _overrides in json.loads(os.getenv("VECTOR_SEARCH_OVERRIDES", "{}")).items():
+    VECTOR_SEARCH_CONFIG[_collection] = {**VECTOR_SEARCH_CONFIG.get(_collection, {}), **_overrides}
+
+if EMBEDDING_CACHE_COLLECTION:
+    query_embedding_cache.attach_collection(db[EMBEDDING_CACHE_COLLECTION])
+
+_last_ping = {"ok": False, "latency_ms": None, "error": "not connected"}
+
+
+async def connect() -> dict:
+    """Open a fresh client on the running event loop and warm its pool.
+
+    Called from the application's lifespan, so the client is owned by the
+    server rather than by whichever loop first imported this module.
+
+    Returns:
+        dict: Result of the warm-up ping.
+    """
+    global client, db
+    client.close()
+    client = _create_client()
+    db = client[DATABASE_NAME]
+    if EMBEDDING_CACHE_COLLECTION:
+        query_embedding_cache.attach_collection(db[EMBEDDING_CACHE_COLLECTION])
+    return await ping()
+
+
+def close() -> None:
+    """Close the client and its pooled connections."""
+    client.close()
+    _last_ping.update({"ok": False, "latency_ms": None, "error": "closed"})
+
+
+async def ping() -> dict:
+    """Round-trip a ping to the server.
+
+    Returns:
+        dict: ok, latency_ms and error (None on success).
+    """
+    start = time.perf_counter()
+    try:
+        await client.admin.command("ping")
+        _last_ping.update({"ok": True, "latency_ms": (time.perf_counter() - start) * 1000, "error": None})
+    except Exception as e:
+        _last_ping.update({"ok": False, "latency_ms": None, "error": str(e)})
+    return dict(_last_ping)
+
+
+def pool_state() -> dict:
+    """Pool settings, pool usage (see PoolMonitor) and the outcome of the last ping."""
+    return {
+        "max_pool_size": MONGO_MAX_POOL_SIZE,
+        "min_pool_size": MONGO_MIN_POOL_SIZE,
+        **pool_monitor.stats(),
+        "last_ping": dict(_last_ping),
+    }
+
+async def fetch_context_data(collection: str, fields: List[str] = None):
+    """Fetch context data from MongoDB collection, projected to `fields` when given."""
     try:
         # for name in collections:
+        projection = {"_id": 0, **{field: 1 for field in fields}} if fields else {"_id": 0, "embedding": 0}
         data = await db[collection].find(
-            {},{"_id": 0}
+            {}, projection
         ).limit(10).to_list(length=None)
         return data
     except Exception as e:
         raise RuntimeError(f"Error fetching context data: {str(e)}")
 
 
-def load_data(collection_name: str, data: List[dict]) -> None:
-    """Load data into MongoDB collection."""
-    try:
-        collection = db[collection_name]
-        # Insert new data
-        if data:
-            collection.insert_many(data)
-    except Exception as e:
-        raise RuntimeError(f"Error loading data into {collection_name}: {str(e)}")
+def vector_search_settings(collection: str, options: dict = None) -> dict:
+    """Search settings for a collection: defaults, then collection config, then request options."""
+    settings = {**VECTOR_SEARCH_DEFAULTS, **VECTOR_SEARCH_CONFIG.get(collection, {})}
+    for key in ("num_candidates", "limit", "fields"):
+        if options and options.get(key) is not None:
+            settings[key] = options[key]
+    settings["num_candidates"] = max(settings["num_candidates"], settings["limit"])
+    return settings
+
+
+def _parse_date(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value
 
 
-async def get_query_results(query, collection: str) -> List[dict]:
+def build_vector_filter(filter_fields: dict, filters: dict) -> dict:
+    """Translate request filters into a $vectorSearch pre-filter.
+
+    `filters` uses logical names: `date_from` / `date_to` bound the collection's
+    `date` field; any other name declared in `filter_fields` matches a value, or
+    any of a list of values. Names the collection doesn't declare are ignored, so
+    one set of filters can be applied to every collection in scope.
+
+    Args:
+        filter_fields (dict): Logical filter name -> indexed document field
+        filters (dict): Requested filter values
+
+    Returns:
+        dict: An MQL filter, empty when nothing applies
+    """
+    clauses = []
+    for name, value in (filters or {}).items():
+        if value is None:
+            continue
+        if name in ("date_from", "date_to"):
+            if "date" not in filter_fields:
+                continue
+            operator = "$gte" if name == "date_from" else "$lte"
+            clauses.append({filter_fields["date"]: {operator: _parse_date(value)}})
+        elif name in filter_fields:
+            path = filter_fields[name]
+            clauses.append({path: {"$in": value}} if isinstance(value, list) else {path: {"$eq": value}})
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+async def get_query_results(query, collection: str, query_embedding: list = None, options: dict = None) -> List[dict]:
     """Gets results from a vector search query.
     Args:
         query (str): The query string to search for.
-        collections (list): List of collection names to search in.
+        collection (str): Name of the collection to search in.
+        query_embedding (list): Precomputed embedding of the query. When omitted
+            it is looked up in (or added to) the query embedding cache.
+        options (dict): Per-request overrides: `num_candidates`, `limit`,
+            `fields` (the fields to project) and `filters` (see `build_vector_filter`).
     Returns:
         List[dict]: A list of dictionaries containing the search results.
     """
-    query_embedding = await generate_embeddings(query)
+    if query_embedding is None:
+        query_embedding = await query_embedding_cache.get_or_embed(query)
+    settings = vector_search_settings(collection, options)
+    search_filter = build_vector_filter(settings["filter_fields"], (options or {}).get("filters"))
+    if settings["engine"] == "bruteforce":
+        return await _brute_force_search(collection, query_embedding, limit=settings["limit"],
+                                         fields=settings["fields"], search_filter=search_filter)
+    if settings["engine"] in ("local", "cached"):
+        try:
+            return await local_vector_engine.index(collection).search(
+                db[collection], query_embedding, settings["limit"], settings["fields"], search_filter
+            )
+        except Exception as e:
+            if settings["engine"] == "local":
+                raise
+            print(f"Local vector search on {collection} failed, falling back to Atlas: {str(e)}")
+    vector_search = {
+        "index": settings["index"],
+        # Query vectors must be in the same format as the stored vectors
+        "queryVector": encode_vector(query_embedding, EMBEDDING_STORAGE),
+        "path": "embedding",
+        "numCandidates": settings["num_candidates"],
+        "limit": settings["limit"]
+    }
+    if search_filter:
+        vector_search["filter"] = search_filter
     pipeline = [
         {
-            "$vectorSearch": {
-                "index": "vector_index",
-                "queryVector": query_embedding,
-                "path": "embedding",
-                "numCandidates": 10,
-                "limit": 2
-            }
+            "$vectorSearch": vector_search
         }, {
             "$project": {
                 "_id": 0,
-                "summary": 1,
-                "feedback": 1
+                **{field: 1 for field in settings["fields"]},
+                "score": {"$meta": "vectorSearchScore"}
             }
         }
     ]
@@ -69,21 +315,52 @@ async def get_query_results(query, collection: str) -> List[dict]:
     return array_of_results
 
 
-async def get_field_data(collection_name: str, field_name: str):
-    """Fetch data for a specific field from a MongoDB collection.
+def _cosine(a: list, b: list) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+async def _brute_force_search(collection: str, query_embedding: list, limit: int, fields: List[str],
+                              search_filter: dict = None) -> List[dict]:
+    """Exact top-k cosine search over every stored vector, a stand-in for $vectorSearch."""
+    projection = {"_id": 0, "embedding": 1, **{field: 1 for field in fields}}
+    query = {"embedding": {"$exists": True}}
+    if search_filter:
+        query = {"$and": [query, search_filter]}
+    cursor = db[collection].find(query, projection)
+    scored = []
+    async for doc in cursor:
+        scored.append((_cosine(query_embedding, decode_vector(doc.pop("embedding"))), doc))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [{**doc, "score": score} for score, doc in scored[:limit]]
+
+
+async def get_field_data(collection_name: str, field_name: str, query: dict = None, extra_fields: List[str] = (),
+                         batch_size: int = FIELD_DATA_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+    """Stream data for a specific field from a MongoDB collection.
     
     Args:
         collection_name (str): Name of the collection to query
         field_name (str): Name of the field to retrieve
-        return_json (bool): If True returns JSON, if False returns text
+        query (dict): Optional filter; all documents when omitted
+        extra_fields (list): Additional fields to project
+        batch_size (int): Documents per cursor batch, and per list yielded
         
-    Returns:
-        Union[str, dict]: Data in either JSON or text format
+    Yields:
+        List[dict]: Up to `batch_size` matching documents with `_id`, the field and any extra fields
     """
     try:
         collection = db[collection_name]
-        data = await collection.find({}, {field_name: 1}).to_list(length=None)    
-        return data
+        projection = {field_name: 1, **{field: 1 for field in extra_fields}}
+        batch = []
+        async for doc in collection.find(query or {}, projection, batch_size=batch_size):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
        
     except Exception as e:
         raise RuntimeError(f"Error fetching field data: {str(e)}")
@@ -113,30 +390,68 @@ async def insert_field_data(collection_name: str, doc_id: str, field_name: str,
         raise RuntimeError(f"Error inserting field data: {str(e)}")
 
 
-async def create_vector_index(collection_name: str, field_name: str = "embedding") -> bool:
+async def bulk_update_fields(collection_name: str, updates: List[Tuple[any, dict]]) -> int:
+    """Set several fields on many documents with a single bulk write.
+
+    Args:
+        collection_name (str): Name of the collection
+        updates (list): (doc_id, {field: value}) pairs
+
+    Returns:
+        int: Number of documents modified
+    """
+    if not updates:
+        return 0
+    try:
+        collection = db[collection_name]
+        operations = [UpdateOne({"_id": doc_id}, {"$set": fields}) for doc_id, fields in updates]
+        result = await collection.bulk_write(operations, ordered=False)
+        return result.modified_count
+    except Exception as e:
+        raise RuntimeError(f"Error bulk updating field data: {str(e)}")
+
+
+async def create_vector_index(collection_name: str, field_name: str = "embedding",
+                              storage: str = EMBEDDING_STORAGE) -> bool:
     """Create a vector index on a MongoDB collection field.
+
+    The vector field is declared to match the storage format, and the
+    collection's filter fields (see VECTOR_SEARCH_CONFIG) are declared as
+    `filter` fields so searches can be pre-filtered on them. An existing index
+    with a different definition is updated in place.
     
     Args:
         collection_name (str): Name of the collection
         field_name (str): Name of the field to index
+        storage (str): Storage format of the vectors (see vector_codec)
         
     Returns:
-        bool: True if index creation successful, False otherwise
+        bool: True if an index was created or updated, False otherwise
     """
+    settings = vector_search_settings(collection_name)
+    if settings["engine"] in ("bruteforce", "local"):
+        return False
     try:
         collection = db[collection_name]
+        definition = {
+            "fields": [
+                vector_index_field(field_name, 768, storage),
+                *[{"type": "filter", "path": path} for path in sorted(set(settings["filter_fields"].values()))]
+            ]}
+
+        # Re-running a load must not fail on an index that already exists
+        existing = await collection.list_search_indexes(settings["index"]).to_list(length=None)
+        if existing:
+            current = existing[0].get("latestDefinition", {}).get("fields")
+            if current == definition["fields"]:
+                return False
+            await collection.update_search_index(settings["index"], definition)
+            print("Search index on " + collection_name + " is being updated.")
+            return True
 
         search_index_model = SearchIndexModel(
-            definition={
-                "fields": [
-                    {
-                        "type": "vector",
-                        "numDimensions": 768,
-                        "path": field_name,
-                        "similarity": "cosine"
-                    }
-                ]},
-            name="vector_index",
+            definition=definition,
+            name=settings["index"],
             type="vectorSearch"
         )
         await collection.create_search_index(model=search_index_model)
@@ -1,18 +1,162 @@
-def build_agent_prompt(config: dict, topic: str, context_data: dict) -> str:
-    context_summary = "\n\n".join([
-        f"{col}: {docs[:2]}" for col, docs in context_data.items()
-    ])
-    return f"""
-You are {config['name']}, a {config['role']} who {config['description']}.
-Your task is to respond to the following topic:
-"{topic}"
+import json
+import math
+import os
+
+from services.metrics import register_label_values
+
+# Completion tokens requested per chat call
+MAX_COMPLETION_TOKENS = 512
+# Tokens reserved for the completion and the instructions around the context
+RESERVED_TOKENS = MAX_COMPLETION_TOKENS + 400
+# Share of the context window left unused, since token counts are estimated
+TOKEN_ESTIMATE_MARGIN = float(os.getenv("TOKEN_ESTIMATE_MARGIN", "0.25"))
+DEFAULT_CONTEXT_WINDOW = int(os.getenv("DEFAULT_CONTEXT_WINDOW", "8192"))
+# Upper bound on context tokens per prompt, whatever the model's window
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Per-model context windows, e.g. {"meta-llama/Llama-3.3-70B-Instruct-Turbo": 131072}
+MODEL_CONTEXT_WINDOWS = json.loads(os.getenv("MODEL_CONTEXT_WINDOWS", "{}"))
+register_label_values(models=MODEL_CONTEXT_WINDOWS)
+
+# Fields that are never useful to the model
+_HIDDEN_FIELDS = {"embedding", "score"}
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the tokens in `text` at four characters per token.
+
+    That is the usual average for English text, but the models' own tokenizers aren't available
+    here and can count more, so context_budget leaves TOKEN_ESTIMATE_MARGIN of the window unused.
+    """
+    return math.ceil(len(text) / 4)
+
+
+def context_budget(model: str = None) -> int:
+    """Context tokens available to a prompt for `model`."""
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    usable = int(window * (1 - TOKEN_ESTIMATE_MARGIN))
+    return max(0, min(CONTEXT_TOKEN_BUDGET, usable - RESERVED_TOKENS))
+
+
+def shared_context_budget(models: list) -> int:
+    """Budget that fits every model, so all agents can share one context block."""
+    return min((context_budget(model) for model in models), default=context_budget())
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    if isinstance(value, dict) and set(value) == {"$date"}:
+        return str(value["$date"])
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"), default=str)
+    return str(value)
+
+
+def serialize_document(doc: dict) -> str:
+    """Compact one-line rendering of a context document."""
+    return "; ".join(
+        f"{key}={_format_value(value)}" for key, value in doc.items()
+        if key not in _HIDDEN_FIELDS and not key.startswith("_")
+    )
+
+
+def rank_documents(docs: list) -> list:
+    """Most relevant documents first: by vector search score when present, else as fetched."""
+    if any("score" in doc for doc in docs):
+        return sorted(docs, key=lambda doc: doc.get("score", 0), reverse=True)
+    return list(docs)
+
+
+def context_view(context_data: dict, view: dict = None) -> dict:
+    """The part of the context an agent sees.
 
-Use insights from your assigned datasets:
-{context_summary}
+    Args:
+        context_data (dict): Fetched documents per collection.
+        view (dict): Collection name -> fields the agent declared, or None
+            for every collection and field.
 
+    Returns:
+        dict: The agent's documents per collection, limited to its fields.
+    """
+    if view is None:
+        return context_data
+    return {
+        col: [{key: value for key, value in doc.items() if key in fields or key == "score"}
+              for doc in context_data[col]]
+        for col, fields in view.items() if col in context_data
+    }
+
+
+def build_context_block(context_data: dict, budget: int) -> str:
+    """Serialize ranked context documents until `budget` tokens are used.
+
+    Collections take turns contributing their next-best document, so one large
+    collection can't crowd the others out. Collections are listed in sorted
+    order so the block is identical for identical context.
+    """
+    ranked = {col: [serialize_document(doc) for doc in rank_documents(docs)]
+              for col, docs in sorted(context_data.items())}
+    selected = {col: [] for col in ranked}
+    used = sum(estimate_tokens(f"[{col}]\n") for col in ranked)
+    depth = 0
+    while any(depth < len(lines) for lines in ranked.values()):
+        for col, lines in ranked.items():
+            if depth >= len(lines):
+                continue
+            cost = estimate_tokens(lines[depth] + "\n")
+            if used + cost <= budget:
+                selected[col].append(lines[depth])
+                used += cost
+        depth += 1
+    return "\n".join(
+        f"[{col}]\n" + ("\n".join(lines) if lines else "(no data)")
+        for col, lines in selected.items()
+    )
+
+
+def build_agent_prompt(config: dict, topic: str, context_block: str) -> str:
+    # The context and topic come first so the prefix is identical across agents
+    # with the same context view and can be reused by provider-side prompt caching
+    return f"""Business data for this debate:
+{context_block}
+
+Debate topic: "{topic}"
+
+You are {config['name']}, a {config['role']} who {config['description']}.
+Respond to the topic using insights from the business data above.
 Respond based on your unique perspective ({config['role']}), and be prepared to challenge or support other agents.
 Always provide a rationale for your responses and answer in brief within 50 words. Keep it concise and to the point.
 Your response should be in the format:
 Stance: **<Your stance here>**
 Rationale: <Your rationale here>
-"""
\ No newline at end of file
+"""
+
+
+def build_rebuttal_prompt(config: dict, topic: str, context_block: str, previous: dict) -> str:
+    """Prompt for a later debate round, where the agent answers the others' last stances.
+
+    Args:
+        config (dict): The agent's persona.
+        topic (str): The debate topic.
+        context_block (str): The agent's business data block.
+        previous (dict): Latest response text of every agent, keyed by agent name.
+    """
+    # Every agent's last stance, its own included, follows the context, so the
+    # prefix stays identical across the agents of a round that share a view
+    stances = "\n".join(f"{agent}: {response}" for agent, response in sorted(previous.items()))
+    return f"""Business data for this debate:
+{context_block}
+
+Debate topic: "{topic}"
+
+Stances from the previous round:
+{stances}
+
+You are {config['name']}, a {config['role']} who {config['description']}.
+Rebut the points of the other agents you disagree with and acknowledge those you find convincing, using the business data above.
+Keep your previous stance unless their arguments or the data give you a reason to change it.
+Always provide a rationale for your responses and answer in brief within 50 words. Keep it concise and to the point.
+Your response should be in the format:
+Stance: **<Your stance here>**
+Rationale: <Your rationale here>
+"""
@@ -0,0 +1,236 @@
+import os
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from services import mongo_client
+
+SALES_COLLECTION = "sales_data"
+SALES_ROLLUP_COLLECTION = os.getenv("SALES_ROLLUP_COLLECTION", "sales_rollups")
+# Regions listed in the "top" fields of quarter and overview rollups
+SALES_ROLLUP_TOP_N = int(os.getenv("SALES_ROLLUP_TOP_N", "3"))
+# Most recent quarters included in the debate context
+SALES_ROLLUP_QUARTERS = int(os.getenv("SALES_ROLLUP_QUARTERS", "4"))
+
+_META_ID = "meta"
+
+# "Q1-2025" -> "2025-Q1", which sorts chronologically
+_PERIOD = {"$concat": [
+    {"$arrayElemAt": [{"$split": ["$quarter", "-"]}, 1]}, "-",
+    {"$arrayElemAt": [{"$split": ["$quarter", "-"]}, 0]},
+]}
+
+
+def _growth(current: str, previous: str) -> dict:
+    return {"$cond": [
+        {"$gt": [previous, 0]},
+        {"$divide": [{"$subtract": [current, previous]}, previous]},
+        None
+    ]}
+
+
+def _merge() -> dict:
+    return {"$merge": {"into": SALES_ROLLUP_COLLECTION, "on": "_id",
+                       "whenMatched": "replace", "whenNotMatched": "insert"}}
+
+
+def region_quarter_pipeline(regions: Optional[List[str]] = None) -> List[dict]:
+    """Raw sales rows -> one rollup per (region, quarter) with quarter-over-quarter growth.
+
+    Growth is computed with $setWindowFields over each region's quarters, so a
+    refresh has to cover a region's whole history; `regions` limits it to the
+    regions that changed.
+    """
+    pipeline = [{"$match": {"region": {"$in": regions}}}] if regions is not None else []
+    return pipeline + [
+        {"$group": {
+            "_id": {"region": "$region", "quarter": "$quarter"},
+            "revenue": {"$sum": "$revenue"},
+            "churn_rate": {"$avg": "$churn_rate"},
+            "avg_deal_size": {"$avg": "$avg_deal_size"},
+        }},
+        {"$set": {"region": "$_id.region", "quarter": "$_id.quarter"}},
+        {"$set": {"period": _PERIOD}},
+        {"$setWindowFields": {
+            "partitionBy": "$region",
+            "sortBy": {"period": 1},
+            "output": {"previous_revenue": {"$shift": {"output": "$revenue", "by": -1}}},
+        }},
+        {"$set": {
+            "_id": {"$concat": ["region_quarter:", "$region", ":", "$quarter"]},
+            "kind": "region_quarter",
+            "revenue_growth": _growth("$revenue", "$previous_revenue"),
+            "refreshed_at": "$$NOW",
+        }},
+        {"$unset": "previous_revenue"},
+        _merge(),
+    ]
+
+
+def region_pipeline(regions: Optional[List[str]] = None) -> List[dict]:
+    """Region-quarter rollups -> one summary per region (totals, latest quarter, trend)."""
+    match = {"kind": "region_quarter"}
+    if regions is not None:
+        match["region"] = {"$in": regions}
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": "$region",
+            "total_revenue": {"$sum": "$revenue"},
+            "avg_churn_rate": {"$avg": "$churn_rate"},
+            "avg_deal_size": {"$avg": "$avg_deal_size"},
+            "avg_revenue_growth": {"$avg": "$revenue_growth"},
+            "quarters": {"$sum": 1},
+            "first": {"$top": {"sortBy": {"period": 1}, "output": {"quarter": "$quarter", "revenue": "$revenue"}}},
+            "latest": {"$bottom": {"sortBy": {"period": 1}, "output": {
+                "quarter": "$quarter", "revenue": "$revenue", "churn_rate": "$churn_rate",
+                "revenue_growth": "$revenue_growth"}}},
+        }},
+        {"$set": {
+            "region": "$_id",
+            "_id": {"$concat": ["region:", "$_id"]},
+            "kind": "region",
+            "revenue_trend": _growth("$latest.revenue", "$first.revenue"),
+            "refreshed_at": "$$NOW",
+        }},
+        {"$unset": "first"},
+        _merge(),
+    ]
+
+
+def quarter_pipeline() -> List[dict]:
+    """Region-quarter rollups -> one summary per quarter with growth and top regions.
+
+    Reads the (small) rollup collection rather than raw rows, so it is cheap to
+    recompute every quarter on each refresh.
+    """
+    return [
+        {"$match": {"kind": "region_quarter"}},
+        {"$group": {
+            "_id": "$quarter",
+            "period": {"$first": "$period"},
+            "revenue": {"$sum": "$revenue"},
+            "avg_churn_rate": {"$avg": "$churn_rate"},
+            "top_regions": {"$topN": {"n": SALES_ROLLUP_TOP_N, "sortBy": {"revenue": -1},
+                                      "output": {"region": "$region", "revenue": "$revenue"}}},
+        }},
+        {"$setWindowFields": {
+            "sortBy": {"period": 1},
+            "output": {"previous_revenue": {"$shift": {"output": "$revenue", "by": -1}}},
+        }},
+        {"$set": {
+            "quarter": "$_id",
+            "_id": {"$concat": ["quarter:", "$_id"]},
+            "kind": "quarter",
+            "revenue_growth": _growth("$revenue", "$previous_revenue"),
+            "refreshed_at": "$$NOW",
+        }},
+        {"$unset": "previous_revenue"},
+        _merge(),
+    ]
+
+
+def overview_pipeline() -> List[dict]:
+    """Region rollups -> a single overview with top regions by revenue and by growth."""
+    return [
+        {"$match": {"kind": "region"}},
+        {"$group": {
+            "_id": "overview",
+            "total_revenue": {"$sum": "$total_revenue"},
+            "regions": {"$sum": 1},
+            "top_regions_by_revenue": {"$topN": {"n": SALES_ROLLUP_TOP_N, "sortBy": {"total_revenue": -1},
+                                                 "output": {"region": "$region", "revenue": "$total_revenue"}}},
+            "top_regions_by_growth": {"$topN": {"n": SALES_ROLLUP_TOP_N, "sortBy": {"revenue_trend": -1},
+                                                "output": {"region": "$region", "trend": "$revenue_trend"}}},
+        }},
+        {"$set": {"kind": "overview", "refreshed_at": "$$NOW"}},
+        _merge(),
+    ]
+
+
+async def refresh_sales_rollups(full: bool = False) -> dict:
+    """Bring the sales rollups up to date with `sales_data`.
+
+    Incremental refreshes recompute only the regions with rows loaded or changed
+    (`_updated_at`) since the last refresh; the quarter and overview rollups are
+    then rebuilt from the rollup collection itself. A full refresh, and the
+    first refresh, rebuild everything.
+
+    Args:
+        full (bool): Rebuild every rollup, dropping stale ones.
+
+    Returns:
+        dict: The refreshed regions (None when all were) and whether it was full.
+    """
+    try:
+        sales = mongo_client.db[SALES_COLLECTION]
+        rollups = mongo_client.db[SALES_ROLLUP_COLLECTION]
+        meta = await rollups.find_one({"_id": _META_ID}) or {}
+        watermark: Optional[datetime] = meta.get("watermark")
+        full = full or watermark is None
+        started_at = datetime.now(timezone.utc)
+
+        changed_query = {} if full else {"_updated_at": {"$gt": watermark}}
+        latest = await sales.find(changed_query, {"_updated_at": 1}).sort("_updated_at", -1).limit(1).to_list(length=1)
+        if not full and not latest:
+            return {"regions": [], "full": False}
+        regions = None if full else await sales.distinct("region", changed_query)
+
+        if full:
+            await rollups.delete_many({"_id": {"$ne": _META_ID}})
+        await sales.aggregate(region_quarter_pipeline(regions)).to_list(length=None)
+        await rollups.aggregate(region_pipeline(regions)).to_list(length=None)
+        await rollups.aggregate(quarter_pipeline()).to_list(length=None)
+        await rollups.aggregate(overview_pipeline()).to_list(length=None)
+
+        # Rows loaded before `_updated_at` was recorded have none; the next
+        # change to any row will carry a later timestamp
+        watermark = latest[0].get("_updated_at") if latest else None
+        if watermark is None:
+            watermark = started_at
+        await rollups.replace_one({"_id": _META_ID}, {"kind": "meta", "watermark": watermark}, upsert=True)
+        return {"regions": regions, "full": full}
+    except Exception as e:
+        raise RuntimeError(f"Error refreshing sales rollups: {str(e)}")
+
+
+async def try_refresh_sales_rollups() -> Optional[dict]:
+    """`refresh_sales_rollups`, reporting a failure as a warning instead of raising it.
+
+    A failed refresh leaves the watermark where it was, so the next refresh
+    (loaders run one on every load, whether or not sales_data changed) picks
+    up the same rows. Until then debates read the previous rollups, or the raw
+    rows when there are none.
+
+    Returns:
+        dict: The refresh result, or None if it failed.
+    """
+    try:
+        return await refresh_sales_rollups()
+    except Exception as e:
+        print(f"Warning: {str(e)}; the next load retries the refresh")
+        return None
+
+
+async def fetch_sales_rollups(fields: List[str] = None) -> List[dict]:
+    """Precomputed sales context: the overview, each region, and the latest quarters.
+
+    Falls back to raw rows when the rollups haven't been built yet.
+
+    Args:
+        fields (list): Fields to project, besides `kind`; all fields when omitted.
+    """
+    try:
+        rollups = mongo_client.db[SALES_ROLLUP_COLLECTION]
+        if fields:
+            projection = {"_id": 0, "kind": 1, **{field: 1 for field in fields}}
+        else:
+            projection = {"_id": 0, "refreshed_at": 0, "period": 0}
+        overview = await rollups.find({"kind": "overview"}, projection).to_list(length=1)
+        if not overview:
+            return await mongo_client.fetch_context_data(SALES_COLLECTION, fields)
+        regions = await rollups.find({"kind": "region"}, projection).sort("total_revenue", -1).to_list(length=None)
+        quarters = await rollups.find({"kind": "quarter"}, projection).sort(
+            "period", -1).limit(SALES_ROLLUP_QUARTERS).to_list(length=None)
+        return overview + regions + quarters
+    except Exception as e:
+        raise RuntimeError(f"Error fetching sales rollups: {str(e)}")
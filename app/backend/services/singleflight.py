@@ -0,0 +1,104 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Hashable
+
+
+class _Broadcast:
+    """Events of one in-flight stream, replayed to every subscriber."""
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Condition()
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls into one in-flight computation.
+
+    The first caller for a key starts the work; callers arriving while it runs
+    wait for the same result (or exception) instead of starting their own. The
+    work runs in its own task, so it finishes even if the caller that started
+    it goes away. Nothing is kept once the work completes.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        """Await `fn()`, or the identical call already in flight for `key`.
+
+        Args:
+            key: Identity of the call; equal keys share one computation.
+            fn: Starts the computation when no call for `key` is in flight.
+
+        Returns:
+            The computation's result, shared by every caller.
+        """
+        self.calls += 1
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(self._calls, key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def stream(self, key: Hashable, fn: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """Iterate `fn()`, or join the identical stream already in flight for `key`.
+
+        Callers that join late first receive every event produced so far, so
+        each caller sees the complete stream.
+        """
+        self.calls += 1
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            task = asyncio.ensure_future(self._produce(broadcast, fn))
+            task.add_done_callback(lambda done: self._forget(self._streams, key, broadcast))
+        else:
+            self.coalesced += 1
+
+        position = 0
+        while True:
+            async with broadcast.changed:
+                await broadcast.changed.wait_for(lambda: position < len(broadcast.events) or broadcast.done)
+                events = broadcast.events[position:]
+                finished = broadcast.done
+            for event in events:
+                yield event
+            position += len(events)
+            if finished and position == len(broadcast.events):
+                break
+        if broadcast.error is not None:
+            raise broadcast.error
+
+    @staticmethod
+    async def _produce(broadcast: _Broadcast, fn: Callable[[], AsyncIterator]) -> None:
+        try:
+            async for event in fn():
+                async with broadcast.changed:
+                    broadcast.events.append(event)
+                    broadcast.changed.notify_all()
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            async with broadcast.changed:
+                broadcast.done = True
+                broadcast.changed.notify_all()
+
+    @staticmethod
+    def _forget(registry: dict, key: Hashable, entry) -> None:
+        if registry.get(key) is entry:
+            del registry[key]
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
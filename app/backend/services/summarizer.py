@@ -1,18 +1,33 @@
 from services.llm_caller import call_llm
+from services.llm_scheduler import SUMMARY
+from services.prompt_builder import context_budget, estimate_tokens
 
-async def summarize_debate(topic: str, agent_responses: list, aggregator_model) -> str:
-    compiled = "\n\n".join([f"{r['agent']}: {r['response']}" for r in agent_responses])
-    prompt = f"""
+
+def _truncate(text: str, max_tokens: int) -> str:
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    return text[:max(0, len(text) * max_tokens // tokens)].rstrip() + " ..."
+
+
+def build_summary_prompt(topic: str, agent_responses: list, aggregator_model: str = None) -> str:
+    per_agent = context_budget(aggregator_model) // max(1, len(agent_responses))
+    compiled = "\n\n".join([f"{r['agent']}: {_truncate(r['response'], per_agent)}" for r in agent_responses])
+    return f"""
 You are a debate moderator.
-Summarize the debate on: "\033[32m{topic}\033[0m", make a final decision, and provide a detailed rationale. 
+Summarize the debate on: "{topic}", make a final decision, and provide a detailed rationale.
 Here are the arguments from each agent:
-\033[32m{compiled}\033[0m
+{compiled}
 
 Only suggest a final stance and rationale, no other information.
 The summary should be in the format:
 Final Stance: **<Your stance here>**
 Rationale: <Your detailed rationale here>
 """
-    result = await call_llm(aggregator_model, prompt, "Moderator")
+
+
+async def summarize_debate(topic: str, agent_responses: list, aggregator_model, priority: int = SUMMARY) -> str:
+    prompt = build_summary_prompt(topic, agent_responses, aggregator_model)
+    result = await call_llm(aggregator_model, prompt, "Moderator", priority=priority)
     print("Summary", result)
-    return result['response']
\ No newline at end of file
+    return result['response']
@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype
+
+# How embeddings are stored in MongoDB: "array" (BSON array of doubles, ~7 KB
+# for 768 dimensions), "float32" (packed binary vector, ~3 KB), "int8" (scalar
+# quantized, ~0.8 KB) or "bit" (sign bits, 96 bytes).
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float32")
+# Optional Atlas-side quantization of float vectors in the index: "scalar" or "binary"
+EMBEDDING_INDEX_QUANTIZATION = os.getenv("EMBEDDING_INDEX_QUANTIZATION", "")
+
+STORAGE_FORMATS = ("array", "float32", "int8", "bit")
+
+_DTYPES = {
+    "float32": BinaryVectorDtype.FLOAT32,
+    "int8": BinaryVectorDtype.INT8,
+    "bit": BinaryVectorDtype.PACKED_BIT,
+}
+
+
+def _check_format(storage: str) -> str:
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown embedding storage format: {storage!r} (expected one of {STORAGE_FORMATS})")
+    return storage
+
+
+def encode_vector(vector, storage: str = EMBEDDING_STORAGE):
+    """Encode an embedding for storage (or as a $vectorSearch queryVector).
+
+    int8 vectors are scaled so the largest component maps to 127; bit vectors
+    keep one sign bit per dimension. Both preserve the direction of the vector,
+    which is all cosine similarity looks at.
+
+    Args:
+        vector (list): The embedding.
+        storage (str): One of STORAGE_FORMATS.
+
+    Returns:
+        list | Binary: A plain list for "array", otherwise a BSON binary vector.
+    """
+    storage = _check_format(storage)
+    if isinstance(vector, Binary):
+        vector = decode_vector(vector)
+    if storage == "array":
+        return [float(x) for x in vector]
+    values = np.asarray(vector, dtype=np.float32)
+    if storage == "float32":
+        return Binary.from_vector(values.tolist(), BinaryVectorDtype.FLOAT32)
+    if storage == "int8":
+        scale = float(np.max(np.abs(values))) or 1.0
+        quantized = np.clip(np.rint(values / scale * 127), -127, 127).astype(np.int8)
+        return Binary.from_vector(quantized.tolist(), BinaryVectorDtype.INT8)
+    padding = (-len(values)) % 8
+    packed = np.packbits(values > 0)
+    return Binary.from_vector(packed.tolist(), BinaryVectorDtype.PACKED_BIT, padding)
+
+
+def decode_vector(value) -> list:
+    """Decode a stored embedding, in any of the storage formats, to a list of floats."""
+    if not isinstance(value, Binary):
+        return list(value)
+    vector = value.as_vector()
+    if vector.dtype == BinaryVectorDtype.PACKED_BIT:
+        bits = np.unpackbits(np.asarray(vector.data, dtype=np.uint8))
+        if vector.padding:
+            bits = bits[:-vector.padding]
+        return (bits.astype(np.float32) * 2 - 1).tolist()
+    return [float(x) for x in vector.data]
+
+
+def storage_format(value) -> str:
+    """The storage format a stored embedding is in."""
+    if not isinstance(value, Binary):
+        return "array"
+    dtype = value.as_vector().dtype
+    return next(name for name, candidate in _DTYPES.items() if candidate == dtype)
+
+
+def vector_index_field(path: str, num_dimensions: int, storage: str = EMBEDDING_STORAGE) -> dict:
+    """Vector index field definition matching the storage format.
+
+    Bit vectors are compared by Hamming distance, which Atlas requires to be
+    declared as "euclidean" similarity.
+    """
+    storage = _check_format(storage)
+    field = {
+        "type": "vector",
+        "numDimensions": num_dimensions,
+        "path": path,
+        "similarity": "euclidean" if storage == "bit" else "cosine"
+    }
+    if EMBEDDING_INDEX_QUANTIZATION and storage in ("array", "float32"):
+        field["quantization"] = EMBEDDING_INDEX_QUANTIZATION
+    return field
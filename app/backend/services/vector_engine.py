@@ -0,0 +1,211 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+from bson import json_util
+
+from services.vector_codec import EMBEDDING_STORAGE, decode_vector
+
+VECTOR_SNAPSHOT_DIR = os.getenv("VECTOR_SNAPSHOT_DIR", ".vector_snapshots")
+VECTOR_ENGINE_REFRESH_SECONDS = float(os.getenv("VECTOR_ENGINE_REFRESH_SECONDS", "30"))
+
+
+class LocalVectorIndex:
+    """In-process top-k cosine search over one collection's `embedding` vectors.
+
+    Vectors are kept L2-normalized in a contiguous float32 matrix that is
+    memory-mapped from a `.npy` snapshot, so restarts don't need to re-read every
+    vector from MongoDB. Refreshes are incremental: only documents embedded after
+    the snapshot's watermark (`_embedded_at`) are read and appended or replaced.
+    Snapshots are kept per storage format, so one written before a migration
+    to another format isn't reused.
+    """
+
+    def __init__(self, name: str, snapshot_dir: str = VECTOR_SNAPSHOT_DIR,
+                 refresh_seconds: float = VECTOR_ENGINE_REFRESH_SECONDS, storage: str = EMBEDDING_STORAGE):
+        self.name = name
+        self.storage = storage
+        self.snapshot_dir = snapshot_dir
+        self.refresh_seconds = refresh_seconds
+        self.matrix: Optional[np.ndarray] = None
+        self.ids: list = []
+        self._rows = {}
+        self.watermark: Optional[datetime] = None
+        self._refreshed_at = None
+        self._lock = asyncio.Lock()
+        self.searches = 0
+        self.refreshes = 0
+
+    @property
+    def _matrix_path(self) -> str:
+        return os.path.join(self.snapshot_dir, f"{self.name}.{self.storage}.npy")
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.snapshot_dir, f"{self.name}.{self.storage}.meta.json")
+
+    def _load_snapshot(self) -> bool:
+        if not (os.path.exists(self._matrix_path) and os.path.exists(self._meta_path)):
+            return False
+        with open(self._meta_path) as f:
+            meta = json_util.loads(f.read())
+        matrix = np.load(self._matrix_path, mmap_mode="r")
+        if matrix.shape[0] != len(meta["ids"]):
+            return False
+        # MongoDB returns naive UTC datetimes; keep the watermark comparable with them
+        watermark = meta["watermark"].replace(tzinfo=None) if meta["watermark"] else None
+        self.matrix, self.ids, self.watermark = matrix, meta["ids"], watermark
+        self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        return True
+
+    def _write_snapshot(self, matrix: np.ndarray, ids: list) -> None:
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        tmp_matrix = self._matrix_path + ".tmp.npy"
+        tmp_meta = self._meta_path + ".tmp"
+        np.save(tmp_matrix, np.ascontiguousarray(matrix, dtype=np.float32))
+        with open(tmp_meta, "w") as f:
+            f.write(json_util.dumps({"ids": ids, "watermark": self.watermark}))
+        os.replace(tmp_matrix, self._matrix_path)
+        os.replace(tmp_meta, self._meta_path)
+        self.matrix = np.load(self._matrix_path, mmap_mode="r")
+        self.ids = ids
+        self._rows = {doc_id: row for row, doc_id in enumerate(ids)}
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    async def refresh(self, collection, full: bool = False) -> int:
+        """Bring the index up to date with `collection`.
+
+        Args:
+            collection: The motor collection backing this index.
+            full (bool): Rebuild from scratch instead of reading only new vectors.
+
+        Returns:
+            int: Number of vectors read from MongoDB.
+        """
+        async with self._lock:
+            if self.matrix is None and not full:
+                self._load_snapshot()
+            query = {"embedding": {"$exists": True}}
+            incremental = not full and self.matrix is not None and self.watermark is not None and len(self.ids) > 0
+            if incremental:
+                query["_embedded_at"] = {"$gt": self.watermark}
+                # Deleted documents can only be dropped by a full rebuild
+                if await collection.count_documents({"embedding": {"$exists": True}}) < len(self.ids):
+                    incremental = False
+                    del query["_embedded_at"]
+
+            new_ids, new_vectors, watermark = [], [], self.watermark if incremental else None
+            async for doc in collection.find(query, {"embedding": 1, "_embedded_at": 1}):
+                new_ids.append(doc["_id"])
+                new_vectors.append(decode_vector(doc["embedding"]))
+                embedded_at = doc.get("_embedded_at")
+                if embedded_at is not None and (watermark is None or embedded_at > watermark):
+                    watermark = embedded_at
+            self.watermark = watermark
+            self._refreshed_at = time.monotonic()
+            self.refreshes += 1
+
+            if not incremental:
+                if new_vectors:
+                    vectors = self._normalize(np.asarray(new_vectors, dtype=np.float32))
+                else:
+                    vectors = np.zeros((0, 0), dtype=np.float32)
+                self._write_snapshot(vectors, new_ids)
+                return len(new_ids)
+            if not new_ids:
+                return 0
+
+            matrix = np.array(self.matrix, dtype=np.float32)
+            ids = list(self.ids)
+            vectors = self._normalize(np.asarray(new_vectors, dtype=np.float32))
+            appended = []
+            for doc_id, vector in zip(new_ids, vectors):
+                row = self._rows.get(doc_id)
+                if row is None:
+                    appended.append(vector)
+                    ids.append(doc_id)
+                else:
+                    matrix[row] = vector
+            if appended:
+                matrix = np.vstack([matrix, np.asarray(appended, dtype=np.float32)])
+            self._write_snapshot(matrix, ids)
+            return len(new_ids)
+
+    async def ensure_fresh(self, collection) -> None:
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at > self.refresh_seconds:
+            await self.refresh(collection)
+
+    async def search(self, collection, query_embedding: list, limit: int, fields: List[str],
+                     search_filter: dict = None) -> List[dict]:
+        """Top-`limit` documents by cosine similarity to `query_embedding`.
+
+        `search_filter` is applied exactly: the matching ids are read from
+        MongoDB first and only those rows are scored.
+        """
+        await self.ensure_fresh(collection)
+        self.searches += 1
+        # A refresh during the awaits below replaces these; the search keeps the snapshot it started with
+        matrix, ids, row_of = self.matrix, self.ids, self._rows
+        if matrix is None or not len(ids):
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= (np.linalg.norm(query) or 1.0)
+        scores = matrix @ query
+
+        if search_filter:
+            allowed = [row_of[doc["_id"]] async for doc in collection.find(search_filter, {"_id": 1})
+                       if doc["_id"] in row_of]
+            if not allowed:
+                return []
+            allowed = np.asarray(allowed)
+            candidate_scores = scores[allowed]
+        else:
+            allowed = None
+            candidate_scores = scores
+
+        k = min(limit, len(candidate_scores))
+        top = np.argpartition(-candidate_scores, k - 1)[:k]
+        top = top[np.argsort(-candidate_scores[top])]
+        rows = allowed[top] if allowed is not None else top
+
+        # Scores use Atlas' normalization of cosine similarity, (1 + cosine) / 2
+        ranked = [(ids[row], (1 + float(scores[row])) / 2) for row in rows]
+        projection = {field: 1 for field in fields}
+        docs = {doc["_id"]: doc async for doc in collection.find({"_id": {"$in": [i for i, _ in ranked]}}, projection)}
+        return [
+            {**{field: value for field, value in docs[doc_id].items() if field != "_id"}, "score": score}
+            for doc_id, score in ranked if doc_id in docs
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "vectors": len(self.ids),
+            "searches": self.searches,
+            "refreshes": self.refreshes,
+        }
+
+
+class LocalVectorEngine:
+    """One LocalVectorIndex per collection, created on first use."""
+
+    def __init__(self):
+        self.indexes = {}
+
+    def index(self, name: str) -> LocalVectorIndex:
+        if name not in self.indexes:
+            self.indexes[name] = LocalVectorIndex(name)
+        return self.indexes[name]
+
+    def stats(self) -> dict:
+        return {name: index.stats() for name, index in self.indexes.items()}
+
+
+local_vector_engine = LocalVectorEngine()
@@ -1,13 +1,34 @@
+import json
+import os
+import threading
+import time
 import requests
 from typing import Dict, List, Optional
 
-def get_together_models(api_key: str) -> Optional[List[Dict]]:
+# The model catalogue is cached on disk so the UI can start without waiting on the API
+MODELS_CACHE_PATH = os.getenv("MODELS_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                ".models_cache.json"))
+MODELS_CACHE_TTL = float(os.getenv("MODELS_CACHE_TTL", "86400"))
+MODELS_FETCH_TIMEOUT = float(os.getenv("MODELS_FETCH_TIMEOUT", "10"))
+# Used until the catalogue has been fetched once, e.g. DEFAULT_CHAT_MODELS="model-a,model-b"
+DEFAULT_CHAT_MODELS = [model.strip() for model in os.getenv("DEFAULT_CHAT_MODELS", ",".join([
+    "meta-llama/Llama-3.3-70B-Instruct-Turbo",
+    "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
+    "Qwen/Qwen2.5-72B-Instruct-Turbo",
+    "mistralai/Mixtral-8x7B-Instruct-v0.1",
+])).split(",") if model.strip()]
+
+_refresh_lock = threading.Lock()
+
+
+def get_together_models(api_key: str, timeout: float = MODELS_FETCH_TIMEOUT) -> Optional[List[Dict]]:
     """
     Fetch available models from Together AI API
-    
+
     Args:
         api_key (str): Your Together AI API key
-    
+        timeout (float): Request timeout in seconds
+
     Returns:
         Optional[List[Dict]]: List of available models and their details, or None if error occurs
     """
@@ -15,12 +36,83 @@ def get_together_models(api_key: str) -> Optional[List[Dict]]:
     headers = {
         "Authorization": f"Bearer {api_key}"
     }
-    
+
     try:
-        response = requests.get(url, headers=headers)
+        response = requests.get(url, headers=headers, timeout=timeout)
         response.raise_for_status()
         return response.json()
-    
+
     except requests.exceptions.RequestException as e:
         print(f"Error fetching models: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def chat_model_ids(models: List[Dict]) -> List[str]:
+    """Ids of the chat and language models in a catalogue, in catalogue order."""
+    ids = [model["id"] for model in models if model.get("type") in ("chat", "language") and model.get("id")]
+    return list(dict.fromkeys(ids))
+
+
+def read_cached_models() -> Optional[Dict]:
+    """The cached catalogue ({"fetched_at", "models"}), or None if there is none."""
+    try:
+        with open(MODELS_CACHE_PATH) as f:
+            cached = json.load(f)
+        return cached if cached.get("models") else None
+    except (OSError, ValueError):
+        return None
+
+
+def get_chat_models() -> List[str]:
+    """Chat model ids from the disk cache, or the defaults before the first fetch."""
+    cached = read_cached_models()
+    return cached["models"] if cached else list(DEFAULT_CHAT_MODELS)
+
+
+def cache_is_fresh() -> bool:
+    cached = read_cached_models()
+    return cached is not None and time.time() - cached.get("fetched_at", 0) < MODELS_CACHE_TTL
+
+
+def refresh_models(api_key: str) -> Optional[List[str]]:
+    """Fetch the catalogue and cache its chat model ids on disk.
+
+    Returns:
+        Optional[List[str]]: The chat model ids, or None if the fetch failed
+    """
+    models = get_together_models(api_key)
+    if not models:
+        return None
+    ids = chat_model_ids(models)
+    if not ids:
+        return None
+    tmp_path = MODELS_CACHE_PATH + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump({"fetched_at": time.time(), "models": ids}, f)
+        os.replace(tmp_path, MODELS_CACHE_PATH)
+    except OSError as e:
+        print(f"Error caching models: {e}")
+    return ids
+
+
+def start_background_refresh(api_key: str) -> Optional[threading.Thread]:
+    """Refresh a missing or stale cache in a daemon thread.
+
+    Returns:
+        Optional[threading.Thread]: The refresh thread, or None if the cache is fresh
+    """
+    if cache_is_fresh():
+        return None
+
+    def refresh():
+        # One refresh at a time, even if several UIs start together
+        if _refresh_lock.acquire(blocking=False):
+            try:
+                refresh_models(api_key)
+            finally:
+                _refresh_lock.release()
+
+    thread = threading.Thread(target=refresh, name="model-catalogue-refresh", daemon=True)
+    thread.start()
+    return thread
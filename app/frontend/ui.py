@@ -1,8 +1,10 @@
+import asyncio
 import gradio as gr
-import requests
-from get_models import get_together_models
+import httpx
+from get_models import get_chat_models, start_background_refresh
 import os
 import json
+import time
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -13,50 +15,117 @@ AGENT_PERSONAS = {
     "Axel": "Focuses on factual data and trends."
 }
 
-# Available LLM models
-LLM_MODELS = get_together_models(os.getenv("TOGETHER_API_KEY"))
-LLM_MODELS_ID = [model["id"] for model in LLM_MODELS if model["type"]== "chat" or model["type"]== "language"]
+# Available LLM models: start from the cached (or default) list and refresh the
+# catalogue in the background; open pages pick up the refreshed list
+LLM_MODELS_ID = get_chat_models()
+models_refresh = start_background_refresh(os.getenv("TOGETHER_API_KEY"))
+MODELS_POLL_SECONDS = float(os.getenv("MODELS_POLL_SECONDS", "5"))
 
 IPV4 = os.getenv("IPV4") 
 BASE_URL = f"http://{IPV4}"
+STREAM_TOKENS = os.getenv("STREAM_TOKENS", "true").lower() == "true"
+# Rebuttal rounds per debate; the backend stops early once the stances converge
+DEBATE_ROUNDS = int(os.getenv("DEBATE_ROUNDS", "1"))
 
-def process_all_agents(message, nova_model, zeta_model, axel_model, aggregator_model, collection_names):
-    responses = {}
+# Debates run at once across all users (other events default to QUEUE_CONCURRENCY_LIMIT);
+# at most QUEUE_MAX_SIZE events wait in the queue
+DEBATE_CONCURRENCY_LIMIT = int(os.getenv("DEBATE_CONCURRENCY_LIMIT", "16"))
+QUEUE_CONCURRENCY_LIMIT = int(os.getenv("QUEUE_CONCURRENCY_LIMIT", "4"))
+QUEUE_MAX_SIZE = int(os.getenv("QUEUE_MAX_SIZE", "100"))
+BACKEND_READ_TIMEOUT = float(os.getenv("BACKEND_READ_TIMEOUT", "300"))
+# Seconds between progress polls of a data loading job
+LOAD_POLL_SECONDS = float(os.getenv("LOAD_POLL_SECONDS", "1"))
+
+# One pooled client for every handler, so concurrent debates reuse connections to the backend
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=DEBATE_CONCURRENCY_LIMIT + 4,
+                        max_keepalive_connections=DEBATE_CONCURRENCY_LIMIT),
+    timeout=httpx.Timeout(10.0, read=BACKEND_READ_TIMEOUT),
+)
+
+
+def format_job(job: dict) -> str:
+    """Console text for a data loading job's progress."""
+    lines = [f"Job {job['_id']}: {job['status']} (stage: {job['current_stage']}, "
+             f"{job.get('loaded', 0)} loaded, {job.get('embedded', 0)} embedded, {job['docs_per_sec']:.1f} docs/sec)"]
+    for collection, progress in sorted(job.get("progress", {}).items()):
+        if progress.get("skipped"):
+            lines.append(f"{collection} is up to date, skipping.")
+            continue
+        line = f"{collection}: {progress.get('loaded', 0)}/{progress.get('total', 0)} documents loaded"
+        if "to_embed" in progress:
+            line += f", {progress.get('embedded', 0)}/{progress['to_embed']} embedded"
+        lines.append(line)
+    lines += [f"Error: {error['error']}" for error in job.get("errors", [])[-5:]]
+    if job["status"] == "completed":
+        lines.append("All data loaded and embeddings created successfully!")
+    return "\n".join(lines)
+
+
+def queue_status(submitted_at, started_at, state: str) -> str:
+    waited = started_at - submitted_at if submitted_at else 0.0
+    return f"*Waited {waited:.1f}s in queue · {state} ({time.time() - started_at:.1f}s)*"
+
+
+async def process_all_agents(message, nova_model, zeta_model, axel_model, aggregator_model, collection_names,
+                             submitted_at=None):
+    started_at = time.time()
     agent_models = {"Nova": nova_model, "Zeta": zeta_model, "Axel": axel_model}
     print(agent_models)
-    url = f"{BASE_URL}/debate"
+    url = f"{BASE_URL}/debate/stream"
 
-    payload = json.dumps({
+    payload = {
         "topic": message,
         "agents": agent_models,
         "context_scope": collection_names,
-        "aggregator_model": aggregator_model
-    })
-    headers = {
-    'Content-Type': 'application/json'
+        "aggregator_model": aggregator_model,
+        "stream_tokens": STREAM_TOKENS,
+        "rounds": DEBATE_ROUNDS
     }
 
     print("Payload: ", payload)
+    responses = {"Nova": "", "Zeta": "", "Axel": "", "Aggregator": ""}
+    # Each agent's answers from earlier rounds, shown above the current one
+    earlier = {"Nova": "", "Zeta": "", "Axel": ""}
+
+    def render(state="debating"):
+        return tuple([{"role" : "assistant" , "content" : responses[name] }] if responses[name] else []
+                     for name in ("Nova", "Zeta", "Axel", "Aggregator")) + (
+            queue_status(submitted_at, started_at, state),)
+
     try :
-        response = requests.request("POST", url, headers=headers, data=payload)
-        if response.status_code == 200 : 
-            print(response.json())
-            response_data = response.json()['responses'] 
-        else:
-            raise gr.Error("Error: " + response.json().get("error", response.text))
-        for i in range(len(response_data)):
-            responses[response_data[i]['agent']] = response_data[i]['response']
-
-        responses["Aggregator"] = response.json().get("summary", "No response from server")
-            
-                
-        return  [{"role" : "assistant" , "content" : responses["Nova"] }],\
-                [{"role" : "assistant" , "content" : responses["Zeta"] }],\
-                [{"role" : "assistant" , "content" : responses["Axel"] }], \
-                [{"role" : "assistant" , "content" : responses["Aggregator"] }]
+        yield render("waiting for the backend")
+        async with http_client.stream("POST", url, json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise gr.Error("Error: " + response.text)
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                kind = event.get("event")
+                if kind == "token":
+                    name = "Aggregator" if event["agent"] == "Moderator" else event["agent"]
+                    responses[name] = responses.get(name, "") + event["delta"]
+                elif kind == "round":
+                    if event["round"] > 1:
+                        for name in event["agents"]:
+                            earlier[name] = responses.get(name, "") + f"\n\n**Round {event['round']}**\n"
+                            responses[name] = earlier[name]
+                elif kind == "agent":
+                    responses[event["agent"]] = earlier.get(event["agent"], "") + event["response"]
+                elif kind == "summary":
+                    responses["Aggregator"] = event.get("summary") or "No response from server"
+                elif kind == "error":
+                    raise gr.Error("Error: " + event["error"])
+                else:
+                    continue
+                yield render()
+        yield render("done")
 
+    except gr.Error:
+        raise
     except Exception as e:
-        responses = f"Error connecting to backend: {str(e)}"
         raise gr.Error(f"Error: {str(e)}")
 
 with gr.Blocks(theme=gr.themes.Soft()) as demo:
@@ -170,19 +239,32 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
                     interactive=False
                 )
 
-            def load_sample_data():
+            async def load_sample_data():
                 try:
-                    response = requests.get(f"{BASE_URL}/load_data")
-                    if response.status_code == 200:
-                        return gr.update(value=response.text)
-                    else:
+                    # The backend runs the load as a job; leaving the page doesn't stop it
+                    response = await http_client.post(f"{BASE_URL}/jobs/load")
+                    if response.status_code != 200:
                         raise gr.Error(f"Error: {response.text}")
+                    job_id = response.json()["job_id"]
+                    while True:
+                        response = await http_client.get(f"{BASE_URL}/jobs/{job_id}")
+                        if response.status_code != 200:
+                            raise gr.Error(f"Error: {response.text}")
+                        job = response.json()
+                        yield gr.update(value=format_job(job))
+                        if job["status"] in ("completed", "failed", "cancelled"):
+                            break
+                        await asyncio.sleep(LOAD_POLL_SECONDS)
+                except gr.Error:
+                    raise
                 except Exception as e:
                     raise gr.Error(f"Error loading sample data: {str(e)}")
 
             load_btn.click(
                 fn=load_sample_data,
-                outputs=console_output
+                outputs=console_output,
+                # Loading is shared by every user; one run at a time
+                concurrency_limit=1
             )
 
         with gr.TabItem("Chat with Agents"):
@@ -258,13 +340,41 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
                     scale=1
                     )
                     aggregator_output = gr.Chatbot(type="messages")
+            debate_status = gr.Markdown()
 
+            # Stamp the submission outside the queue, so the handler can report how long it waited
+            submitted_at = gr.State()
             submit_btn.click(
+                fn=time.time,
+                outputs=submitted_at,
+                queue=False
+            ).then(
                 fn=process_all_agents,
-                inputs=[prompt, nova_model_selector, zeta_model_selector, axel_model_selector, aggregator_model_selector, collection_selector],
-                outputs=[nova_output, zeta_output, axel_output, aggregator_output]
+                inputs=[prompt, nova_model_selector, zeta_model_selector, axel_model_selector, aggregator_model_selector, collection_selector, submitted_at],
+                outputs=[nova_output, zeta_output, axel_output, aggregator_output, debate_status],
+                concurrency_limit=DEBATE_CONCURRENCY_LIMIT,
+                # Queue position and estimated wait are shown on the outputs while queued
+                show_progress="full"
             )
 
+            model_selectors = [nova_model_selector, zeta_model_selector, axel_model_selector, aggregator_model_selector]
+            refreshing = models_refresh is not None and models_refresh.is_alive()
+            models_timer = gr.Timer(MODELS_POLL_SECONDS, active=refreshing)
+
+            def update_model_choices(*selected):
+                models = get_chat_models()
+                updates = [gr.update(choices=models, value=value if value in models else models[0])
+                           for value in selected]
+                # Stop polling once the background refresh has finished
+                return *updates, gr.Timer(active=models_refresh is not None and models_refresh.is_alive())
+
+            models_timer.tick(fn=update_model_choices, inputs=model_selectors, outputs=model_selectors + [models_timer],
+                              queue=False)
+            demo.load(fn=update_model_choices, inputs=model_selectors, outputs=model_selectors + [models_timer],
+                      queue=False)
+
+
+demo.queue(default_concurrency_limit=QUEUE_CONCURRENCY_LIMIT, max_size=QUEUE_MAX_SIZE)
 
 if __name__ == "__main__":
     demo.launch(server_name="0.0.0.0", server_port=7860)
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""Compare two benchmark result files produced by run_benchmarks.py.
+
+    python benchmarks/compare.py benchmarks/results/before.json benchmarks/results/after.json
+"""
+import argparse
+import json
+
+METRICS = [
+    ("requests_per_sec", lambda r: r["requests_per_sec"], True),
+    ("p50_ms", lambda r: r["latency_ms"]["p50"], False),
+    ("p95_ms", lambda r: r["latency_ms"]["p95"], False),
+    ("p99_ms", lambda r: r["latency_ms"]["p99"], False),
+]
+
+
+def _index(report: dict) -> dict:
+    return {(r["scenario"], r["concurrency"]): r for r in report["results"]}
+
+
+def _change(before: float, after: float) -> str:
+    if before == 0:
+        return "   n/a"
+    return f"{(after - before) / before * 100:+6.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="flag regressions larger than this percentage")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline:  {baseline['meta']['label']} ({baseline['meta']['git_commit'][:10]})")
+    print(f"candidate: {candidate['meta']['label']} ({candidate['meta']['git_commit'][:10]})")
+    before, after = _index(baseline), _index(candidate)
+    regressions = 0
+    for key in sorted(set(before) & set(after)):
+        print(f"\n{key[0]} @ concurrency {key[1]}")
+        for name, get, higher_is_better in METRICS:
+            b, a = get(before[key]), get(after[key])
+            worse = (a < b) if higher_is_better else (a > b)
+            flag = ""
+            if b and worse and abs(a - b) / b * 100 > args.threshold:
+                flag = "  <-- regression"
+                regressions += 1
+            print(f"  {name:<17} {b:>10.2f} -> {a:>10.2f}  {_change(b, a)}{flag}")
+    for key in sorted(set(before) ^ set(after)):
+        print(f"\n{key[0]} @ concurrency {key[1]} only in {'baseline' if key in before else 'candidate'}")
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
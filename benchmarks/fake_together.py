@@ -0,0 +1,146 @@
+"""Local stand-in for the Together AI API used by the benchmark suite.
+
+Serves the OpenAI-compatible endpoints the backend calls through `AsyncTogether`
+(`/v1/chat/completions`, streaming included, `/v1/embeddings` and `/v1/models`)
+with configurable latency and token rate. Embeddings are deterministic hashed
+bag-of-words vectors, so similar texts get similar vectors and vector search
+results are stable between runs.
+
+    python benchmarks/fake_together.py --port 9000 --latency-ms 300 --tokens-per-sec 80
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+app = FastAPI()
+settings = {
+    "latency_ms": 200.0,
+    "jitter": 0.1,
+    "tokens_per_sec": 100.0,
+    "completion_tokens": 60,
+    "embedding_latency_ms": 20.0,
+    "embedding_dim": 768,
+}
+rng = random.Random(0)
+
+WORDS = ("stance support expansion risk growth churn revenue region latency customers "
+         "feedback roadmap investment margin trend quarter demand adoption").split()
+
+
+def _delay(base_ms: float) -> float:
+    return max(0.0, base_ms * (1 + rng.uniform(-settings["jitter"], settings["jitter"]))) / 1000
+
+
+def embed_text(text: str, dim: int) -> list:
+    vector = [0.0] * dim
+    for token in text.lower().split():
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] % 2 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _completion_words(count: int) -> list:
+    return [rng.choice(WORDS) for _ in range(count)]
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    await asyncio.sleep(_delay(settings["embedding_latency_ms"]))
+    return {
+        "object": "list",
+        "model": body.get("model"),
+        "data": [
+            {"object": "embedding", "index": i, "embedding": embed_text(text, settings["embedding_dim"])}
+            for i, text in enumerate(inputs)
+        ],
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    count = min(int(body.get("max_tokens") or settings["completion_tokens"]), settings["completion_tokens"])
+    words = _completion_words(count)
+    completion_id = f"fake-{uuid.uuid4().hex}"
+    created = int(time.time())
+    per_token = 1 / settings["tokens_per_sec"] if settings["tokens_per_sec"] > 0 else 0.0
+    prompt_tokens = len(json.dumps(body.get("messages", [])).split())
+
+    if body.get("stream"):
+        async def generate():
+            await asyncio.sleep(_delay(settings["latency_ms"]))
+            for i, word in enumerate(words):
+                await asyncio.sleep(per_token)
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created,
+                    "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word},
+                                 "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    await asyncio.sleep(_delay(settings["latency_ms"]) + per_token * len(words))
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": body.get("model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "Stance: **" + " ".join(words) + "**"},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                  "total_tokens": prompt_tokens + len(words)},
+    }
+
+
+@app.get("/v1/models")
+async def models():
+    return [
+        {"id": f"fake/chat-model-{i}", "object": "model", "type": "chat"} for i in range(1, 4)
+    ] + [{"id": "togethercomputer/m2-bert-80M-32k-retrieval", "object": "model", "type": "embedding"}]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=settings["latency_ms"],
+                        help="time to first token for chat completions")
+    parser.add_argument("--jitter", type=float, default=settings["jitter"],
+                        help="relative latency jitter, e.g. 0.1 for +/-10%%")
+    parser.add_argument("--tokens-per-sec", type=float, default=settings["tokens_per_sec"])
+    parser.add_argument("--completion-tokens", type=int, default=settings["completion_tokens"])
+    parser.add_argument("--embedding-latency-ms", type=float, default=settings["embedding_latency_ms"])
+    parser.add_argument("--embedding-dim", type=int, default=settings["embedding_dim"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    settings.update(
+        latency_ms=args.latency_ms, jitter=args.jitter, tokens_per_sec=args.tokens_per_sec,
+        completion_tokens=args.completion_tokens, embedding_latency_ms=args.embedding_latency_ms,
+        embedding_dim=args.embedding_dim,
+    )
+    rng.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""Load-test the backend's /debate and /load_data endpoints.
+
+By default the script starts a self-contained stack: the fake Together server
+(`fake_together.py`), a throwaway local `mongod`, and the backend with
+`VECTOR_SEARCH_BACKEND=bruteforce` pointed at both. Pass `--backend-url` to
+benchmark an already running backend instead, or `--mongodb-uri` to reuse an
+existing MongoDB.
+
+Each scenario runs at every concurrency level in `--concurrency` and reports
+p50/p95/p99 latency and requests/sec. Results are written as JSON so runs can
+be compared with `compare.py`.
+
+    python benchmarks/run_benchmarks.py --concurrency 1,4,16 --requests 50 --label baseline
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT, "app", "backend")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+TOPICS = [
+    "Should we expand into EMEA next quarter?",
+    "Is it time to raise prices for enterprise customers?",
+    "Should we prioritize fixing search timeouts over new features?",
+    "Do we invest in smart filters or auto-tagging first?",
+    "Should we open a support center in APAC?",
+    "Is churn in North America a risk to our growth targets?",
+]
+
+
+def percentile(values: list, pct: float) -> float:
+    """Linear-interpolated percentile of `values` (pct in 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(name: str, concurrency: int, latencies: list, errors: int, duration: float) -> dict:
+    completed = len(latencies)
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": completed + errors,
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "requests_per_sec": round(completed / duration, 3) if duration > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "mean": round(sum(latencies) / completed * 1000, 2) if completed else 0.0,
+            "max": round(max(latencies) * 1000, 2) if completed else 0.0,
+        },
+    }
+
+
+async def run_scenario(name: str, request_fn, concurrency: int, total: int) -> dict:
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                await request_fn(i)
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors += 1
+                print(f"  {name} request {i} failed: {e}", file=sys.stderr)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(name, concurrency, latencies, errors, time.perf_counter() - start)
+    lat = result["latency_ms"]
+    print(f"{name:<10} c={concurrency:<3} n={result['requests']:<5} err={errors:<3} "
+          f"rps={result['requests_per_sec']:<8} p50={lat['p50']}ms p95={lat['p95']}ms p99={lat['p99']}ms")
+    return result
+
+
+def debate_request(client: httpx.AsyncClient, args):
+    agents = {"Nova": args.model, "Zeta": args.model, "Axel": args.model}
+
+    async def send(i: int):
+        response = await client.post("/debate", json={
+            "topic": TOPICS[i % len(TOPICS)],
+            "agents": agents,
+            "context_scope": args.context_scope,
+            "aggregator_model": args.model,
+            "bypass_cache": not args.use_debate_cache,
+        })
+        response.raise_for_status()
+        body = response.json()
+        if "error" in body:
+            raise RuntimeError(body["error"])
+    return send
+
+
+def load_data_request(client: httpx.AsyncClient, args):
+    async def send(i: int):
+        async with client.stream("GET", "/load_data") as response:
+            response.raise_for_status()
+            async for _ in response.aiter_lines():
+                pass
+    return send
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(check, timeout: float, what: str) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {what}")
+
+
+def _port_open(port: int) -> bool:
+    with socket.socket() as sock:
+        return sock.connect_ex(("127.0.0.1", port)) == 0
+
+
+class LocalStack:
+    """Fake Together server, local mongod and backend, as child processes."""
+
+    def __init__(self, args):
+        self.args = args
+        self.processes = []
+        self.tempdir = None
+        self.backend_url = None
+
+    def _spawn(self, command: list, **kwargs) -> subprocess.Popen:
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT, **kwargs)
+        self.processes.append(process)
+        return process
+
+    def start(self) -> str:
+        args = self.args
+        together_port = _free_port()
+        self._spawn([sys.executable, os.path.join(ROOT, "benchmarks", "fake_together.py"),
+                     "--port", str(together_port), "--latency-ms", str(args.llm_latency_ms),
+                     "--tokens-per-sec", str(args.tokens_per_sec),
+                     "--embedding-latency-ms", str(args.embedding_latency_ms)])
+        _wait_for(lambda: _port_open(together_port), 20, "fake Together server")
+
+        mongodb_uri = args.mongodb_uri
+        if not mongodb_uri:
+            mongod = shutil.which(args.mongod)
+            if not mongod:
+                raise RuntimeError(f"'{args.mongod}' not found; install mongod or pass --mongodb-uri")
+            self.tempdir = tempfile.mkdtemp(prefix="maap-bench-")
+            mongo_port = _free_port()
+            self._spawn([mongod, "--dbpath", self.tempdir, "--port", str(mongo_port),
+                         "--bind_ip", "127.0.0.1", "--quiet"])
+            _wait_for(lambda: _port_open(mongo_port), 30, "mongod")
+            mongodb_uri = f"mongodb://127.0.0.1:{mongo_port}"
+
+        backend_port = _free_port()
+        env = {
+            **os.environ,
+            "MONGODB_URI": mongodb_uri,
+            "DATABASE_NAME": args.database,
+            "TOGETHER_API_KEY": "benchmark",
+            "TOGETHER_BASE_URL": f"http://127.0.0.1:{together_port}/v1",
+            "VECTOR_SEARCH_BACKEND": "bruteforce",
+            "DEBATE_CACHE_ENABLED": "true" if args.use_debate_cache else "false",
+        }
+        self._spawn([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                     "--port", str(backend_port), "--log-level", "warning"], cwd=BACKEND_DIR, env=env)
+        self.backend_url = f"http://127.0.0.1:{backend_port}"
+        _wait_for(lambda: httpx.get(f"{self.backend_url}/health").status_code == 200, 60, "backend")
+        return self.backend_url
+
+    def stop(self) -> None:
+        for process in reversed(self.processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.tempdir:
+            shutil.rmtree(self.tempdir, ignore_errors=True)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+async def run(args, backend_url: str) -> dict:
+    results = []
+    limits = httpx.Limits(max_connections=max(args.concurrency) * 2)
+    async with httpx.AsyncClient(base_url=backend_url, timeout=args.timeout, limits=limits) as client:
+        scenarios = {
+            "load_data": (load_data_request(client, args), args.load_requests),
+            "debate": (debate_request(client, args), args.requests),
+        }
+        for name in args.scenarios:
+            request_fn, total = scenarios[name]
+            if name == "debate" and args.warmup:
+                await run_scenario("warmup", request_fn, 1, args.warmup)
+            for concurrency in args.concurrency:
+                results.append(await run_scenario(name, request_fn, concurrency, total))
+    return {
+        "meta": {
+            "label": args.label,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "backend_url": backend_url,
+            "settings": {
+                "requests": args.requests,
+                "load_requests": args.load_requests,
+                "context_scope": args.context_scope,
+                "model": args.model,
+                "llm_latency_ms": args.llm_latency_ms,
+                "tokens_per_sec": args.tokens_per_sec,
+                "embedding_latency_ms": args.embedding_latency_ms,
+                "use_debate_cache": args.use_debate_cache,
+            },
+        },
+        "results": results,
+    }
+
+
+def _csv(value: str) -> list:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend-url", help="benchmark a running backend instead of starting one")
+    parser.add_argument("--mongodb-uri", help="use this MongoDB instead of starting a local mongod")
+    parser.add_argument("--mongod", default="mongod", help="mongod binary for the local stack")
+    parser.add_argument("--database", default="maap_benchmark")
+    parser.add_argument("--scenarios", type=_csv, default=["load_data", "debate"])
+    parser.add_argument("--concurrency", type=lambda v: [int(c) for c in _csv(v)], default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=50, help="/debate requests per concurrency level")
+    parser.add_argument("--load-requests", type=int, default=1, help="/load_data requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--model", default="fake/chat-model-1")
+    parser.add_argument("--context-scope", type=_csv, default=["customer_feedback", "sales_data", "performance_logs"])
+    parser.add_argument("--use-debate-cache", action="store_true", help="let /debate hit the semantic cache")
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-sec", type=float, default=100)
+    parser.add_argument("--embedding-latency-ms", type=float, default=20)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<timestamp>-<label>.json)")
+    args = parser.parse_args()
+
+    stack = None
+    backend_url = args.backend_url
+    if not backend_url:
+        stack = LocalStack(args)
+        backend_url = stack.start()
+    try:
+        report = asyncio.run(run(args, backend_url))
+    finally:
+        if stack:
+            stack.stop()
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{args.label}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()